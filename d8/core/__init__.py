@@ -1,3 +1,4 @@
 from .reader import *
 from .downloader import *
 from .base_dataset import *
+from .cache import *
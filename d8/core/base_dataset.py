@@ -5,17 +5,30 @@
 #@save_all
 #@hide_all
 import abc
+import concurrent.futures
+import contextvars
 import copy
+import functools
 import logging
+import os
 import pathlib
-from typing import Callable, List, Optional, Sequence, Type, TypeVar, Union
-
+import shutil
+import threading
+import time
+import types
+import weakref
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Type, TypeVar, Union
+
+import numpy as np
 import pandas as pd
+import tqdm
+import xxhash
 from matplotlib import pyplot as plt
 
+import d8
 from d8 import core
 
-__all__ = ['BaseDataset', 'show_images']
+__all__ = ['BaseDataset', 'show_images', 'prefetch']
 
 _T = TypeVar("_T", bound='BaseDataset')
 
@@ -32,6 +45,7 @@ class BaseDataset(abc.ABC):
     :ivar reader: The data reader
     :ivar name: The string name about this dataset
     :cvar TYPE: The string type of this dataset, such as ``image_classification``
+    :cvar CACHE_VERSION: The version of the constructed datasets cached by :meth:`get`
     """
     def __init__(self, df: pd.DataFrame, reader: core.Reader,
                  label_name: Optional[Union[str, int]] = None) -> None:
@@ -60,6 +74,24 @@ class BaseDataset(abc.ABC):
         """Return the number of examples."""
         return len(self.df)
 
+    def __getstate__(self):
+        # cached values are not copied or pickled
+        return {k:v for k, v in self.__dict__.items() if k != '_frozen'}
+
+    def freeze(self):
+        """Return a compact columnar representation of the examples.
+
+        Indexing it in the training loop costs a few array slices instead of
+        constructing pandas rows. It is computed once and cached until ``df`` is replaced.
+        """
+        cached = self.__dict__.get('_frozen')
+        if cached is None or cached[0]() is not self.df:
+            cached = self._frozen = (weakref.ref(self.df), self._freeze())
+        return cached[1]
+
+    def _freeze(self):
+        raise NotImplementedError(f'{type(self).__name__} cannot be frozen')
+
     @property
     def labels(self):
         """Return the list of labels."""
@@ -107,20 +139,65 @@ class BaseDataset(abc.ABC):
     def merge(self, *args: 'BaseDataset') -> 'BaseDataset':
         """Merge with other datasets.
 
+        Datasets with different readers are merged through a :class:`core.CompositeReader`.
+        If a file path of a dataset also exists in the manifest of an earlier reader,
+        which would be read instead, then the files of the i-th distinct reader are
+        placed under the folder ``i`` and the file paths are updated accordingly.
+
         :param args: One or multiple datasets
         :return: A new dataset with examples merged.
         """
-        dfs = [self.df]
-        for ds in args:
-            if ds.reader != self.reader:
-                raise ValueError('You cannot merge with another dataset with a different reader')
-            dfs.append(ds.df)
-        self.df = None
+        readers: List[core.Reader] = []
+        groups = []
+        for ds in (self, *args):
+            i = next((i for i, r in enumerate(readers) if _same_reader(r, ds.reader)), len(readers))
+            if i == len(readers): readers.append(ds.reader)
+            groups.append(i)
+        dfs = [self.df] + [ds.df for ds in args]
+        reader = self.reader
+        if len(readers) > 1:
+            paths: List[set] = [set() for _ in readers]
+            for df, i in zip(dfs, groups):
+                for c in _FILE_COLUMNS:
+                    if c in df.columns:
+                        paths[i].update(pathlib.PurePath(p).as_posix() for p in df[c] if _is_path(p))
+            # a path is read from the first reader having it
+            files = [set(r.manifest()['file_path']) for r in readers]
+            prefixes = None
+            if any(paths[i] & files[j] for i in range(len(readers)) for j in range(i)):
+                prefixes = [str(i) for i in range(len(readers))]
+                dfs = [_add_prefix(df, prefixes[i]) for df, i in zip(dfs, groups)]
+            reader = core.CompositeReader(readers, prefixes)
+        self_df, self_reader = self.df, self.reader
+        self.df, self.reader = None, None
         merged_ds = copy.deepcopy(self)
+        self.df, self.reader = self_df, self_reader
         merged_ds.df = pd.concat(dfs, axis=0, ignore_index=True)
-        self.df = dfs[0]
+        merged_ds.reader = reader
         return merged_ds
 
+    def to_shards(self, save_dir: Union[str, pathlib.Path], shard_size: int = 2**30) -> 'BaseDataset':
+        """Pack the files of all examples into a few large shard files.
+
+        Reading from shards avoids opening many small files, which is slow on network
+        file systems. The file paths in ``df`` are unchanged.
+
+        :param save_dir: The folder to save the shards.
+        :param shard_size: The approximate number of bytes in each shard.
+        :return: A new dataset reading from the shards through a :class:`core.ShardReader`.
+        """
+        columns = [c for c in _FILE_COLUMNS if c in self.df.columns]
+        if not columns:
+            raise ValueError(f'Not found a file_path column in {self.df.columns}')
+        file_paths = pd.unique(pd.concat([self.df[c] for c in columns]).map(str))
+        reader = core.ShardReader.write(self.reader, file_paths, save_dir, shard_size)
+        self_df, self.df = self.df, None
+        self_reader, self.reader = self.reader, None
+        new_ds = copy.deepcopy(self)
+        self.df, self.reader = self_df, self_reader
+        new_ds.df, new_ds.reader = self_df.copy(), reader
+        return new_ds
+
     @classmethod
     def add(cls, entry, *args) -> None:
         """Add a dataset to be retrieved later.
@@ -142,14 +219,102 @@ class BaseDataset(abc.ABC):
         cls._DATASETS[(cls.TYPE, name)] = (fn, fn_args, fn_kwargs)
 
     @classmethod
-    def get(cls, name: str) -> 'BaseDataset':
-        """Return the dataset by its name."""
-        with core.NameContext(name):
+    def get(cls, name: str, cache: bool = True) -> 'BaseDataset':
+        """Return the dataset by its name.
+
+        :param name: The dataset name.
+        :param cache: If True (default), then reuse the dataset constructed before,
+            which is saved in ``core.DATAROOT/name``, if neither its registration
+            nor its downloaded files have changed.
+
+        Its access is recorded for :func:`core.enforce_quota`, which is called
+        afterwards. The dataset is pinned by :func:`core.hold` until the returned
+        dataset and its copies are garbage collected.
+        """
+        with core.NameContext(name), core.pinned(name):
             (fn, fn_args, fn_kwargs) = cls._DATASETS[(cls.TYPE, name)]
-            ds = fn(*fn_args, **fn_kwargs)
-            ds.name = name
+            cache_path = core.DATAROOT/name/f'{cls.TYPE}_dataset.pkl'
+            key = cls._cache_key(name) if cache and cache_path.is_file() else None
+            ds = cls._load_cache(cache_path, key) if key else None
+            if ds is None:
+                ds = fn(*fn_args, **fn_kwargs)
+                ds.name = name
+                # downloading may have changed the key
+                key = cls._cache_key(name) if cache and cache_path.parent.exists() else None
+                if key:
+                    ds._save_cache(cache_path, key)
+                    core.cache._invalidate_usage(cache_path.parent)
+            ds._hold = core.hold(name)
+            core.touch(name)
+            core.enforce_quota()
             return ds
 
+    # The version of the constructed datasets saved by get. Bump it when the
+    # constructed dataframe changes, e.g. a parser produces different dtypes.
+    CACHE_VERSION = 1
+
+    @classmethod
+    def _cache_key(cls, name: str) -> Optional[str]:
+        """Return the key of a constructed dataset.
+
+        It depends on the d8 version, ``CACHE_VERSION``, the registered function and
+        arguments, and the hashes of the downloaded files, which are saved by
+        :func:`core.downloader._save_hash`. Return None if the registration cannot
+        be digested deterministically, then the dataset is not cached.
+        """
+        (fn, fn_args, fn_kwargs) = cls._DATASETS[(cls.TYPE, name)]
+        hashes = [(p.name, p.read_text().partition('\n')[0].strip())
+                  for p in sorted((core.DATAROOT/name).glob('*.xxh'))]
+        try:
+            key = _digest([d8.__version__, cls.CACHE_VERSION, cls.TYPE, name,
+                           fn, fn_args, fn_kwargs, hashes])
+        except TypeError as e:
+            logging.warning(f'Not caching dataset {name}. {e}')
+            return None
+        return xxhash.xxh128(key.encode()).hexdigest()
+
+    def _save_cache(self, cache_path: pathlib.Path, key: str) -> None:
+        # The reader is saved by its type and root, and reconstructed when loading.
+        reader, self.reader = self.reader, None
+        try:
+            state = {'key':key, 'dataset':self, 'reader':_reader_state(reader)}
+            tmp_path = cache_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            pd.to_pickle(state, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logging.warning(f'Failed to save {cache_path}: {e}')
+        finally:
+            self.reader = reader
+
+    @classmethod
+    def _load_cache(cls, cache_path: pathlib.Path, key: str) -> Optional['BaseDataset']:
+        if not cache_path.is_file():
+            return None
+        try:
+            state = pd.read_pickle(cache_path)
+        except Exception as e:
+            logging.warning(f'Failed to load {cache_path}: {e}')
+            return None
+        reader = _load_reader(state['reader']) if state['key'] == key else None
+        if reader is None:
+            return None
+        ds = state['dataset']
+        ds.reader = reader
+        return ds
+
+    @classmethod
+    def prefetch(cls, names: Optional[Sequence[str]] = None, workers: int = 4,
+                 max_rate: Optional[float] = None, min_free_space: int = 0) -> pd.DataFrame:
+        """Download and construct multiple datasets concurrently.
+
+        It is a shortcut of :func:`prefetch` for datasets of this type, note that
+        Kaggle downloads are not rate limited by ``max_rate``.
+
+        :param names: The dataset names, the default value is all added datasets.
+        """
+        names = cls.list() if names is None else names
+        return prefetch([(cls, name) for name in names], workers, max_rate, min_free_space)
+
     @classmethod
     def list(cls) -> Sequence[str]:
         """Return the list of names of added datasets."""
@@ -200,6 +365,131 @@ class BaseDataset(abc.ABC):
                 'You could change `quick=True` to `quick=False` to fix it')
         return summary.sort_values(summary.columns[0])
 
+# The columns of a dataframe containing file paths to read by the reader
+_FILE_COLUMNS = ('file_path', 'label_file_path')
+
+def _is_path(p: Any) -> bool:
+    return isinstance(p, (str, pathlib.PurePath))
+
+def _add_prefix(df: pd.DataFrame, prefix: str) -> pd.DataFrame:
+    """Return a copy of df with file paths placed under the folder prefix."""
+    df = df.copy()
+    for c in _FILE_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].map(lambda p: (pathlib.Path(prefix)/p if isinstance(p, pathlib.PurePath)
+                                         else f'{prefix}/{p}' if isinstance(p, str) else p))
+    return df
+
+def _same_reader(a: core.Reader, b: core.Reader) -> bool:
+    return type(a) == type(b) and a == b
+
+def _reader_state(reader: core.Reader) -> Tuple:
+    """Return the state to reconstruct reader, which saves its type and root
+    instead of pickling it."""
+    if isinstance(reader, core.CompositeReader):
+        return (core.CompositeReader, [_reader_state(r) for r in reader.readers], reader.prefixes)
+    return (type(reader), getattr(reader, '_root', None))
+
+def _load_reader(state: Tuple) -> Optional[core.Reader]:
+    """Reconstruct the reader saved by :func:`_reader_state`, or return None if its
+    data no longer exist."""
+    if state[0] is core.CompositeReader:
+        readers = [_load_reader(s) for s in state[1]]
+        if any(r is None for r in readers): return None
+        return core.CompositeReader(readers, state[2])
+    reader_cls, root = state
+    if root is None: return reader_cls()
+    return reader_cls(root) if root.exists() else None
+
+def prefetch(datasets: Sequence[Tuple[Type[BaseDataset], str]], workers: int = 4,
+             max_rate: Optional[float] = None, min_free_space: int = 0) -> pd.DataFrame:
+    """Download and construct multiple datasets concurrently.
+
+    The same data used by multiple datasets, e.g. a dataset added to both image
+    classification and object detection, are only downloaded once.
+
+    :param datasets: A list of (dataset class, dataset name).
+    :param workers: The number of datasets to prefetch concurrently.
+    :param max_rate: The maximal total download rate in bytes per second. Note that
+        Kaggle downloads are not rate limited.
+    :param min_free_space: Skip a dataset, or stop downloading a file, if the free
+        disk space in ``core.DATAROOT`` would be less than this number of bytes. A
+        Kaggle download is only checked before it starts and after it finishes, and
+        removed if the free space became too small.
+    :return: The status of each dataset, with the error message if failed.
+    """
+    def fetch(dataset):
+        cls, name = dataset
+        start = time.time()
+        error = ''
+        try:
+            core.DATAROOT.mkdir(parents=True, exist_ok=True)
+            free = shutil.disk_usage(core.DATAROOT).free
+            if free < min_free_space:
+                raise OSError(f'Only {free} bytes are free in {core.DATAROOT}')
+            cls.get(name)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            logging.warning(f'Failed to prefetch {cls.TYPE} dataset {name}. {error}')
+        return {'type':cls.TYPE, 'name':name, 'seconds':time.time()-start, 'error':error}
+
+    rows = []
+    # the limits are only set in the contexts of the prefetching threads
+    with core.downloader._limited(max_rate, min_free_space), \
+        concurrent.futures.ThreadPoolExecutor(workers) as pool, \
+        tqdm.tqdm(total=len(datasets), desc='datasets', unit='') as progress:
+        futures = [pool.submit(contextvars.copy_context().run, fetch, ds) for ds in datasets]
+        for row in (f.result() for f in concurrent.futures.as_completed(futures)):
+            rows.append(row)
+            progress.update(1)
+            progress.set_postfix(failed=sum(bool(r['error']) for r in rows))
+    order = {(cls.TYPE, name):i for i, (cls, name) in enumerate(datasets)}
+    rows.sort(key=lambda r: order[(r['type'], r['name'])])
+    return pd.DataFrame(rows, columns=['type', 'name', 'seconds', 'error'])
+
+def _digest(obj: Any, depth: int = 0) -> str:
+    """Return a string representing obj that is stable across processes.
+
+    Functions are represented by their bytecode, constants and closures instead of
+    their memory addresses, and dataframes and arrays by the hashes of their data.
+
+    :raise TypeError: If obj cannot be represented deterministically.
+    """
+    if depth > 8:
+        raise TypeError('the object is too deeply nested to digest')
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, pathlib.PurePath, np.generic)):
+        return repr(obj)
+    if isinstance(obj, (list, tuple)):
+        return '(' + ','.join(_digest(x, depth+1) for x in obj) + ')'
+    if isinstance(obj, (set, frozenset)):
+        return '{' + ','.join(sorted(_digest(x, depth+1) for x in obj)) + '}'
+    if isinstance(obj, dict):
+        return '{' + ','.join(sorted(f'{_digest(k, depth+1)}:{_digest(v, depth+1)}'
+                                     for k, v in obj.items())) + '}'
+    if isinstance(obj, functools.partial):
+        return (f'partial({_digest(obj.func, depth+1)},{_digest(obj.args, depth+1)},'
+                f'{_digest(obj.keywords, depth+1)})')
+    if isinstance(obj, types.MethodType):
+        return f'method({_digest(obj.__self__, depth+1)},{_digest(obj.__func__, depth+1)})'
+    if isinstance(obj, types.FunctionType):
+        code = obj.__code__
+        closure = [c.cell_contents for c in (obj.__closure__ or [])]
+        return (f'{code.co_name}:{code.co_code.hex()}:{code.co_names}:'
+                f'{_digest(code.co_consts, depth+1)}:{_digest(closure, depth+1)}:'
+                f'{_digest(obj.__defaults__, depth+1)}')
+    if isinstance(obj, types.CodeType):  # a nested code object
+        return f'{obj.co_name}:{obj.co_code.hex()}:{obj.co_names}:{_digest(obj.co_consts, depth+1)}'
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        dtypes = obj.dtypes.astype(str).to_dict() if isinstance(obj, pd.DataFrame) else str(obj.dtype)
+        data = xxhash.xxh128(pd.util.hash_pandas_object(obj).to_numpy().tobytes()).hexdigest()
+        return f'{type(obj).__name__}:{_digest(dtypes, depth+1)}:{data}'
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        data = xxhash.xxh128(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        return f'ndarray:{obj.dtype}:{obj.shape}:{data}'
+    if isinstance(obj, (type, types.ModuleType, types.BuiltinFunctionType)):
+        return f'{getattr(obj, "__module__", "")}.{getattr(obj, "__qualname__", obj.__name__)}'
+    raise TypeError(f'{type(obj).__name__} cannot be digested deterministically')
+
 def show_images(images, layout, scale):
     nrows, ncols = layout
     if len(images) != nrows * ncols:
@@ -212,6 +502,8 @@ def show_images(images, layout, scale):
         ax.axis("off")
     return axes
 
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch
 import pandas as pd
@@ -247,6 +539,32 @@ class TestBaseDataset(unittest.TestCase):
         ds = rets[0].merge(*rets[1:])
         self.assertTrue(ds.df['file_path'].equals(self.ds.df['file_path']))
 
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_merge_readers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for folder in ('a', 'b'):
+                (pathlib.Path(tmp)/folder).mkdir()
+                (pathlib.Path(tmp)/folder/'1.txt').write_text(folder)
+            a = BaseDataset(pd.DataFrame({'file_path':['1.txt']}), core.FolderReader(pathlib.Path(tmp)/'a'))
+            b = BaseDataset(pd.DataFrame({'file_path':['1.txt']}), core.FolderReader(pathlib.Path(tmp)/'b'))
+            ds = a.merge(b, a)
+            self.assertEqual(type(ds.reader), core.CompositeReader)
+            self.assertEqual(ds.df['file_path'].tolist(), ['0/1.txt', '1/1.txt', '0/1.txt'])
+            self.assertEqual([ds.reader.open(p).read() for p in ds.df['file_path']], [b'a', b'b', b'a'])
+            self.assertEqual(a.df['file_path'].tolist(), ['1.txt'])
+            self.assertEqual(_load_reader(_reader_state(ds.reader)), ds.reader)
+            # b's path only exists in a's folder, but not in a's dataframe
+            (pathlib.Path(tmp)/'a'/'2.txt').write_text('a')
+            (pathlib.Path(tmp)/'b'/'2.txt').write_text('b')
+            b = BaseDataset(pd.DataFrame({'file_path':['2.txt']}), core.FolderReader(pathlib.Path(tmp)/'b'))
+            ds = a.merge(b)
+            self.assertEqual([ds.reader.open(p).read() for p in ds.df['file_path']], [b'a', b'b'])
+            # no prefixes without overlapping files
+            (pathlib.Path(tmp)/'c').mkdir()
+            (pathlib.Path(tmp)/'c'/'3.txt').write_text('c')
+            c = BaseDataset(pd.DataFrame({'file_path':['3.txt']}), core.FolderReader(pathlib.Path(tmp)/'c'))
+            self.assertEqual(a.merge(c).df['file_path'].tolist(), ['1.txt', '3.txt'])
+
     @patch.multiple(BaseDataset, __abstractmethods__=set())
     def test_add(self):
         @BaseDataset.add
@@ -260,6 +578,127 @@ class TestBaseDataset(unittest.TestCase):
         self.assertTrue(BaseDataset.get('test').df.equals(self.df))
         self.assertTrue(BaseDataset.get('test2').df.equals(self.df))
 
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_get_cache(self):
+        name = 'test_get_cache'
+        shutil.rmtree(core.DATAROOT/name, ignore_errors=True)
+        (core.DATAROOT/name).mkdir(parents=True)
+        calls = []
+        def construct(df, calls=calls):
+            calls.append(1)
+            return BaseDataset(df, core.EmptyReader(), 'file_path')
+        BaseDataset.add(name, construct, [self.df])
+        for _ in range(2):
+            ds = BaseDataset.get(name)
+            self.assertTrue(ds.df.equals(self.df))
+            self.assertEqual(ds.name, name)
+            self.assertEqual(type(ds.reader), core.EmptyReader)
+        self.assertEqual(len(calls), 1)
+        # a changed download invalidates the cache
+        (core.DATAROOT/name/'data.zip.xxh').write_text('abc\n')
+        BaseDataset.get(name)
+        self.assertEqual(len(calls), 2)
+        BaseDataset.get(name, cache=False)
+        self.assertEqual(len(calls), 3)
+        del BaseDataset._DATASETS[(BaseDataset.TYPE, name)]
+        shutil.rmtree(core.DATAROOT/name)
+
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_to_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            for i in range(5):
+                (root/f'{i}.txt').write_text(str(i))
+            df = pd.DataFrame({'file_path':[pathlib.Path(f'{i}.txt') for i in (3, 1, 1, 0)]})
+            ds = BaseDataset(df, core.FolderReader(root), 'file_path')
+            shard_ds = ds.to_shards(root/'shards')
+            self.assertEqual(type(shard_ds.reader), core.ShardReader)
+            self.assertEqual(type(ds.reader), core.FolderReader)
+            self.assertEqual(len(shard_ds.reader.list_files()), 3)
+            for p in shard_ds.df['file_path']:
+                self.assertEqual(shard_ds.reader.open(p).read(), p.stem.encode())
+
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_freeze(self):
+        with patch.object(BaseDataset, '_freeze', side_effect=lambda: object()):
+            table = self.ds.freeze()
+            self.assertIs(self.ds.freeze(), table)
+            a, _ = self.ds.split(0.5)
+            self.assertFalse('_frozen' in a.__dict__)
+            self.ds.df = self.ds.df.copy()
+            self.assertIsNot(self.ds.freeze(), table)
+
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_prefetch(self):
+        def construct(fail):
+            if fail: raise ValueError('failed')
+            return BaseDataset(self.df, core.EmptyReader())
+        BaseDataset.add('test_prefetch_1', construct, [False])
+        BaseDataset.add('test_prefetch_2', construct, [True])
+        status = BaseDataset.prefetch(['test_prefetch_1', 'test_prefetch_2'], workers=2)
+        self.assertEqual(status['name'].tolist(), ['test_prefetch_1', 'test_prefetch_2'])
+        self.assertEqual(status['error'].tolist(), ['', 'ValueError: failed'])
+        status = prefetch([(BaseDataset, 'test_prefetch_1')], min_free_space=2**62)
+        self.assertTrue(status['error'][0].startswith('OSError'))
+        for name in ('test_prefetch_1', 'test_prefetch_2'):
+            del BaseDataset._DATASETS[(BaseDataset.TYPE, name)]
+
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_get_hold(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+            patch.object(core, 'DATAROOT', pathlib.Path(tmp)), \
+            patch.object(core.downloader, 'DATAROOT', pathlib.Path(tmp)), \
+            patch.object(core.cache, 'QUOTA', 1):
+            def construct(name):
+                # other processes see it's in use before anything is downloaded
+                self.assertTrue(core.cache._in_use_path(name).exists())
+                (core.DATAROOT/name).mkdir(exist_ok=True)
+                (core.DATAROOT/name/'1.txt').write_bytes(bytes(1000))
+                return BaseDataset(self.df, core.FolderReader(core.DATAROOT/name))
+            names = ('test_hold_a', 'test_hold_b')
+            for name in names:
+                BaseDataset.add(name, construct, [name])
+            a = BaseDataset.get(names[0])
+            BaseDataset.get(names[1])
+            self.assertTrue((core.DATAROOT/names[0]/'1.txt').exists())
+            train, val = a.split(0.5)
+            del a
+            BaseDataset.get(names[1])
+            self.assertTrue((core.DATAROOT/names[0]/'1.txt').exists())
+            del train, val
+            BaseDataset.get(names[1])
+            self.assertFalse((core.DATAROOT/names[0]).exists())
+            self.assertTrue((core.DATAROOT/names[1]/'1.txt').exists())
+            for name in names:
+                del BaseDataset._DATASETS[(BaseDataset.TYPE, name)]
+
+    def test_digest(self):
+        self.assertEqual(_digest([1, 'a', {'b':(2,)}]), _digest([1, 'a', {'b':(2,)}]))
+        self.assertEqual(_digest(lambda p: p.name), _digest(lambda p: p.name))
+        self.assertNotEqual(_digest(lambda p: p.name), _digest(lambda p: p.stem))
+        f = lambda a, b=1: a + b
+        self.assertEqual(_digest(functools.partial(f, 1, b=2)), _digest(functools.partial(f, 1, b=2)))
+        self.assertNotEqual(_digest(functools.partial(f, 1)), _digest(functools.partial(f, 2)))
+        self.assertNotEqual(_digest(functools.partial(f, 1)), _digest(functools.partial(len, 1)))
+        self.assertEqual(_digest(self.df), _digest(self.df.copy()))
+        self.assertNotEqual(_digest(self.df), _digest(self.df.iloc[1:]))
+        with self.assertRaises(TypeError):
+            _digest([1, object()])
+
+    @patch.multiple(BaseDataset, __abstractmethods__=set())
+    def test_cache_key(self):
+        BaseDataset.add('test_cache_key', BaseDataset, [self.df, core.EmptyReader()])
+        key = BaseDataset._cache_key('test_cache_key')
+        self.assertIsNone(key)
+        BaseDataset.add('test_cache_key', functools.partial(BaseDataset, self.df), [])
+        key = BaseDataset._cache_key('test_cache_key')
+        self.assertEqual(BaseDataset._cache_key('test_cache_key'), key)
+        with patch.object(BaseDataset, 'CACHE_VERSION', 2):
+            self.assertNotEqual(BaseDataset._cache_key('test_cache_key'), key)
+        with patch.object(d8, '__version__', '0.0.0'):
+            self.assertNotEqual(BaseDataset._cache_key('test_cache_key'), key)
+        del BaseDataset._DATASETS[(BaseDataset.TYPE, 'test_cache_key')]
+
     def test_list(self):
         self.assertEqual(BaseDataset.list(), ['test', 'test2'])
 
@@ -0,0 +1,387 @@
+# This file is generated from core/cache.md automatically through:
+#    d2lbook build lib
+# Don't edit it directly
+
+#@save_all
+#@hide_all
+import contextlib
+import glob
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from d8 import core
+
+__all__ = ['cache_usage', 'enforce_quota', 'pin', 'unpin', 'pinned', 'hold', 'touch']
+
+# The maximal number of bytes used by core.DATAROOT, None means no limit.
+QUOTA: Optional[int] = (int(float(os.environ['D8_QUOTA_GB']) * 2**30)
+                        if os.environ.get('D8_QUOTA_GB') else None)
+
+# The access record of a dataset. Its mtime is the last access time, and it saves
+# the disk usage of the dataset folder, which is emptied when files are changed.
+_ACCESS = '.d8_access'
+_PINNED = '.d8_pinned'
+# The folder in core.DATAROOT with a ``<name>.<pid>`` file for each dataset used by a
+# process. It's outside of the dataset folders, so a dataset is marked before its
+# folder is created by downloading.
+_IN_USE = '.d8_in_use'
+_DOWNLOAD_SUFFIXES = ('.xxh', '.part', '.chunks', '.validator')
+
+_pinned_lock = threading.Lock()
+_pinned: Dict[str, int] = {}
+
+def touch(name: str) -> None:
+    """Record an access to the dataset name."""
+    folder = core.DATAROOT/name
+    if folder.is_dir():
+        (folder/_ACCESS).touch()
+
+def pin(name: str) -> None:
+    """Pin the dataset name so it will not be evicted, until :func:`unpin` is called."""
+    folder = core.DATAROOT/name
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder/_PINNED).touch()
+
+def unpin(name: str) -> None:
+    """Unpin the dataset name."""
+    path = core.DATAROOT/name/_PINNED
+    if path.exists():
+        path.unlink()
+
+def _in_use_path(name: str, pid: Optional[int] = None) -> pathlib.Path:
+    return core.DATAROOT/_IN_USE/f'{name}.{os.getpid() if pid is None else pid}'
+
+def _acquire(name: str) -> None:
+    with _pinned_lock:
+        _pinned[name] = _pinned.get(name, 0) + 1
+        path = _in_use_path(name)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        except OSError:
+            pass
+
+def _release(name: str) -> None:
+    with _pinned_lock:
+        _pinned[name] -= 1
+        if not _pinned[name]:
+            del _pinned[name]
+            try:
+                _in_use_path(name).unlink()
+            except OSError:
+                pass
+
+@contextlib.contextmanager
+def pinned(name: str) -> Iterator[None]:
+    """Pin the dataset name within this context."""
+    _acquire(name)
+    try:
+        yield
+    finally:
+        _release(name)
+
+class _Hold:
+    def __init__(self, name: str):
+        self.name = name
+        _acquire(name)
+        weakref.finalize(self, _release, name)
+
+    def __reduce__(self):
+        # a copy, or an unpickled object in another process, holds its own pin
+        return (_Hold, (self.name,))
+
+def hold(name: str) -> Any:
+    """Return an object pinning the dataset name until it is garbage collected.
+
+    :func:`BaseDataset.get` saves it in the returned dataset, so a dataset in use,
+    including its copies such as splits, is never evicted. The pin is visible to
+    other processes through a ``.d8_in_use/<name>.<pid>`` file in ``core.DATAROOT``,
+    which is created before anything is downloaded.
+    """
+    return _Hold(name)
+
+def _is_alive(pid: int) -> bool:
+    if os.name == 'nt': return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _is_pinned(name: str) -> bool:
+    with _pinned_lock:
+        if name in _pinned: return True
+    folder = core.DATAROOT/name
+    if (folder/_PINNED).exists(): return True
+    for path in (core.DATAROOT/_IN_USE).glob(f'{glob.escape(name)}.*'):
+        pid = path.name[len(name)+1:]
+        if not pid.isdigit() or int(pid) == os.getpid(): continue
+        if _is_alive(int(pid)): return True
+        try:
+            path.unlink()  # left by a process that exited without cleaning up
+        except OSError:
+            pass
+    return False
+
+def _is_downloaded(path: pathlib.Path) -> bool:
+    """Return if path, a file in a dataset folder, is a downloaded file or its
+    book-keeping files, which are kept when evicting extracted files."""
+    return (path.name in (_ACCESS, _PINNED) or path.suffix in _DOWNLOAD_SUFFIXES or path.with_name(path.name+'.xxh').is_file())
+
+def _last_access(folder: pathlib.Path) -> float:
+    access = folder/_ACCESS
+    return (access if access.exists() else folder).stat().st_mtime
+
+def _measure(folder: pathlib.Path) -> Dict[str, Any]:
+    """Walk folder to compute the bytes of its extracted and downloaded files.
+
+    Files with multiple hardlinks, e.g. downloads linked to the blob store, are
+    counted once and listed in ``links`` by their inodes, so they are also counted
+    once across datasets.
+    """
+    extracted, downloaded = 0, 0
+    links: Dict[str, int] = {}
+    for root, _, files in os.walk(folder):
+        for fn in files:
+            path = pathlib.Path(root, fn)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if st.st_nlink > 1:
+                key = f'{st.st_dev}:{st.st_ino}'
+                if key in links: continue
+                links[key] = st.st_size
+            if root == str(folder) and _is_downloaded(path):
+                downloaded += st.st_size
+            else:
+                extracted += st.st_size
+    return {'extracted':extracted, 'downloaded':downloaded, 'links':links}
+
+def _read_usage(folder: pathlib.Path) -> Optional[Dict[str, Any]]:
+    """Return the usage saved in the access record of folder, or None if missing."""
+    try:
+        return json.loads((folder/_ACCESS).read_text())
+    except (OSError, ValueError):
+        return None
+
+def _write_usage(folder: pathlib.Path, usage: Optional[Dict[str, Any]]) -> None:
+    """Save usage into the access record of folder without changing its access time."""
+    atime = _last_access(folder)
+    tmp_path = folder/f'{_ACCESS}.{os.getpid()}.{threading.get_ident()}.tmp'
+    tmp_path.write_text(json.dumps(usage) if usage else '')
+    os.utime(tmp_path, (atime, atime))
+    os.replace(tmp_path, folder/_ACCESS)
+
+def _usage(folder: pathlib.Path) -> Dict[str, Any]:
+    """Return the disk usage of a dataset folder, which is only walked if not recorded."""
+    usage = _read_usage(folder)
+    if usage is None:
+        usage = _measure(folder)
+        _write_usage(folder, usage)
+    return usage
+
+def _invalidate_usage(path: pathlib.Path) -> None:
+    """Mark the recorded usage outdated after files in path, a dataset folder or
+    one of its subfolders, are changed."""
+    try:
+        parts = pathlib.Path(path).resolve().relative_to(core.DATAROOT.resolve()).parts
+    except (OSError, ValueError):
+        return
+    if not parts or parts[0].startswith('.'): return
+    folder = core.DATAROOT/parts[0]
+    if _read_usage(folder) is not None:
+        _write_usage(folder, None)
+
+def _dataset_folders() -> List[pathlib.Path]:
+    folders = sorted(core.DATAROOT.iterdir()) if core.DATAROOT.is_dir() else []
+    return [f for f in folders if f.is_dir() and not f.name.startswith('.')]
+
+def _total_usage(usages: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+    """Return the bytes used by ``core.DATAROOT`` from the usages of all datasets,
+    hardlinks and blobs are counted once."""
+    if usages is None:
+        usages = {f.name:_usage(f) for f in _dataset_folders()}
+    total = 0
+    links: Dict[str, int] = {}
+    for usage in usages.values():
+        total += usage['extracted'] + usage['downloaded'] - sum(usage['links'].values())
+        links.update(usage['links'])
+    # blobs not linked by any dataset
+    for blob in (core.DATAROOT/core.downloader._BLOBS).glob('objects/*/*'):  # type: ignore
+        try:
+            st = blob.stat()
+        except OSError:
+            continue
+        if st.st_nlink <= 1: total += st.st_size
+    return total + sum(links.values())
+
+def _cache_usage(usages: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    rows = [{'name':name, 'extracted':usage['extracted'], 'downloaded':usage['downloaded'],
+             'last_access':pd.Timestamp(_last_access(core.DATAROOT/name), unit='s'),
+             'pinned':_is_pinned(name)} for name, usage in usages.items()]
+    df = pd.DataFrame(rows, columns=['name', 'extracted', 'downloaded', 'last_access', 'pinned'])
+    return df.sort_values('last_access', ignore_index=True)
+
+def cache_usage() -> pd.DataFrame:
+    """Return the disk usage of each dataset in ``core.DATAROOT``.
+
+    :return: A dataframe with the number of bytes of extracted files and downloaded
+        files, the last access time and whether it's pinned, ordered from the least
+        recently used. The downloaded files shared by datasets are counted in each
+        of them.
+    """
+    return _cache_usage({f.name:_usage(f) for f in _dataset_folders()})
+
+def _evict_extracted(folder: pathlib.Path) -> None:
+    """Remove all files in folder except for the downloaded ones. Constructed
+    datasets are removed as well since they may read the extracted files."""
+    for p in folder.iterdir():
+        if p.is_dir():
+            shutil.rmtree(p)
+        elif not _is_downloaded(p):
+            p.unlink()
+
+def enforce_quota(quota: Optional[int] = None) -> pd.DataFrame:
+    """Evict the least recently used datasets until ``core.DATAROOT`` uses at most
+    quota bytes.
+
+    Extracted files of all datasets are evicted before downloaded files. Pinned
+    datasets are never evicted. The disk usage of each dataset is saved in its
+    access record, so only datasets whose files changed are walked.
+
+    :param quota: The number of bytes, the default value is ``QUOTA``. Do nothing
+        if both are None.
+    :return: The evicted datasets with the kind of evicted files.
+    """
+    quota = QUOTA if quota is None else quota
+    evicted: List[Dict[str, str]] = []
+    if quota is None or not core.DATAROOT.is_dir():
+        return pd.DataFrame(evicted, columns=['name', 'kind'])
+    usages = {f.name:_usage(f) for f in _dataset_folders()}
+    usage = _total_usage(usages)
+    if usage <= quota:
+        return pd.DataFrame(evicted, columns=['name', 'kind'])
+    datasets = _cache_usage(usages)
+    datasets = datasets[~datasets['pinned']]
+    candidates = ([(name, 'extracted') for name in datasets['name'][datasets['extracted'] > 0]] +
+                  [(name, 'downloaded') for name in datasets['name']])
+    for name, kind in candidates:
+        folder = core.DATAROOT/name
+        if _is_pinned(name): continue
+        logging.info(f'Evicting {kind} files of {name} from {folder}')
+        if kind == 'extracted':
+            _evict_extracted(folder)
+            _write_usage(folder, None)
+            usages[name] = _usage(folder)
+        else:
+            shutil.rmtree(folder)
+            core.gc()
+            del usages[name]
+        evicted.append({'name':name, 'kind':kind})
+        usage = _total_usage(usages)
+        if usage <= quota: break
+    else:
+        logging.warning(f'{core.DATAROOT} uses {usage} bytes after eviction, '
+                        f'more than the quota {quota} bytes')
+    return pd.DataFrame(evicted, columns=['name', 'kind'])
+
+import copy
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp.name)
+        self.patchers = [unittest.mock.patch.object(core, 'DATAROOT', root),
+                         unittest.mock.patch.object(core.downloader, 'DATAROOT', root)]
+        for p in self.patchers: p.start()
+        for i, name in enumerate(['a', 'b', 'c']):
+            folder = root/name
+            (folder/'data').mkdir(parents=True)
+            (folder/'data'/'1.txt').write_bytes(bytes(1000))
+            (folder/'data.zip').write_bytes(bytes(500))
+            core.downloader._save_hash(folder/'data.zip')
+            (folder/'x_dataset.pkl').write_bytes(bytes(100))
+            touch(name)
+            os.utime(folder/_ACCESS, (i, i))
+
+    def tearDown(self):
+        for p in self.patchers: p.stop()
+        self.tmp.cleanup()
+
+    def test_usage(self):
+        df = cache_usage()
+        self.assertEqual(df['name'].tolist(), ['a', 'b', 'c'])
+        self.assertEqual(df['extracted'].tolist(), [1100]*3)
+        self.assertGreater(df['downloaded'][0], 500)
+
+    def test_record(self):
+        cache_usage()
+        with unittest.mock.patch.object(os, 'walk', side_effect=AssertionError):
+            self.assertEqual(cache_usage()['extracted'].tolist(), [1100]*3)
+            self.assertEqual(enforce_quota(10**9).values.tolist(), [])
+        self.assertEqual(cache_usage()['name'].tolist(), ['a', 'b', 'c'])
+        (core.DATAROOT/'a'/'data'/'2.txt').write_bytes(bytes(100))
+        _invalidate_usage(core.DATAROOT/'a'/'data')
+        self.assertEqual(cache_usage()['extracted'].tolist(), [1200, 1100, 1100])
+        # a hardlinked file is counted once in total
+        total = _total_usage()
+        os.link(core.DATAROOT/'a'/'data'/'2.txt', core.DATAROOT/'b'/'data'/'2.txt')
+        for name in ('a', 'b'): _invalidate_usage(core.DATAROOT/name)
+        self.assertEqual(_total_usage(), total)
+
+    def test_hold(self):
+        obj = hold('a')
+        self.assertTrue(_in_use_path('a').exists())
+        copied = copy.deepcopy(obj)
+        del obj
+        self.assertTrue(_is_pinned('a'))
+        del copied
+        self.assertFalse(_is_pinned('a'))
+        self.assertFalse(_in_use_path('a').exists())
+        # marked before the dataset folder is created
+        with pinned('new'):
+            self.assertTrue(_in_use_path('new').exists())
+            self.assertFalse((core.DATAROOT/'new').exists())
+        self.assertFalse(_in_use_path('new').exists())
+        # pinned by another alive process, or not if it has exited
+        _in_use_path('a', os.getppid()).touch()
+        self.assertTrue(_is_pinned('a'))
+        _in_use_path('a', os.getppid()).rename(_in_use_path('a', 2**22+1))
+        self.assertFalse(_is_pinned('a'))
+        self.assertFalse(_in_use_path('a', 2**22+1).exists())
+
+    def test_evict(self):
+        total = _total_usage()
+        pin('a')
+        evicted = enforce_quota(total - 1500)
+        self.assertEqual(evicted.values.tolist(), [['b', 'extracted'], ['c', 'extracted']])
+        self.assertTrue((core.DATAROOT/'a'/'data'/'1.txt').exists())
+        self.assertFalse((core.DATAROOT/'b'/'x_dataset.pkl').exists())
+        self.assertTrue((core.DATAROOT/'b'/'data.zip').exists())
+        unpin('a')
+        with pinned('c'):
+            evicted = enforce_quota(1000)
+        self.assertEqual(evicted.values.tolist(), [['a', 'extracted'], ['a', 'downloaded'], ['b', 'downloaded']])
+        self.assertEqual(cache_usage()['name'].tolist(), ['c'])
+        self.assertEqual(enforce_quota(10**9).values.tolist(), [])
+
+
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
+
@@ -4,13 +4,24 @@
 
 #@save_all
 #@hide_all
+import asyncio
+import concurrent.futures
+import contextlib
 import contextvars
+import functools
+import http.server
+import io
+import json
 import logging
 import os
 import pathlib
+import shutil
 import tempfile
+import threading
+import time
 import unittest
-from typing import Optional, Union
+import unittest.mock
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import requests
 import tqdm
@@ -18,7 +29,7 @@ import xxhash
 
 from d8 import core
 
-__all__ = ['download', 'DATAROOT', 'NameContext']
+__all__ = ['download', 'download_async', 'verify', 'gc', 'DATAROOT', 'NameContext']
 
 DATAROOT = pathlib.Path.home()/'.d8'
 
@@ -55,8 +66,39 @@ class TestNameContext(unittest.TestCase):
 def _add_suffix(file_path: pathlib.Path, suffix: str) -> pathlib.Path:
     return file_path.with_suffix(file_path.suffix+suffix)
 
-def _get_xxhash(file_path: pathlib.Path) -> str:
-    """Compute the hash of the content of file_pathpath"""
+_HASH_CHUNK = 2**26
+_HASH_MAX_CHUNKS = 16
+
+def _get_xxhash(file_path: pathlib.Path, num_workers: int = 8) -> str:
+    """Compute the hash of the content of file_path.
+
+    The file is split into 64MB chunks hashed by multiple threads, and the result
+    combines the chunk digests. Only the first and last 0.5GB are hashed for a
+    file larger than 1GB.
+    """
+    n = file_path.stat().st_size
+    chunks = list(range(0, n, _HASH_CHUNK))
+    if len(chunks) > _HASH_MAX_CHUNKS:
+        half = _HASH_MAX_CHUNKS // 2
+        chunks = chunks[:half] + [n-(half-i)*_HASH_CHUNK for i in range(half)]
+    def hash_chunk(start):
+        x = xxhash.xxh128()
+        with file_path.open('rb') as f:
+            f.seek(start)
+            remaining = _HASH_CHUNK
+            while remaining > 0:
+                data = f.read(min(remaining, 2**23))
+                if not data: break
+                x.update(data)
+                remaining -= len(data)
+        return x.digest()
+    with concurrent.futures.ThreadPoolExecutor(min(num_workers, max(len(chunks), 1))) as pool:
+        digests = list(pool.map(hash_chunk, chunks))
+    return xxhash.xxh128(str(n).encode()+b''.join(digests)).hexdigest()
+
+def _get_legacy_xxhash(file_path: pathlib.Path) -> str:
+    """The hash saved by previous versions, which is verified once and then
+    replaced by :func:`_get_xxhash`."""
     n = file_path.stat().st_size
     x = xxhash.xxh128()
     m = 2 ** 23  # read 8MB each time
@@ -74,35 +116,126 @@ def _get_xxhash(file_path: pathlib.Path) -> str:
                 x.update(f.read(m))
     return x.hexdigest()
 
-def _match_hash(file_path: pathlib.Path) -> bool:
-    """Return true if the saved hash matches the contents of file_path."""
+def _file_stat(file_path: pathlib.Path) -> Dict[str, int]:
+    st = file_path.stat()
+    return {'size':st.st_size, 'mtime':st.st_mtime_ns, 'inode':st.st_ino}
+
+def _match_hash(file_path: pathlib.Path, verify: bool = False) -> bool:
+    """Return true if the saved hash matches the contents of file_path.
+
+    The hash file saves the hash in the first line, followed by the size, mtime and
+    inode of file_path when the hash was computed. An unchanged file is trusted
+    without rehashing unless ``verify`` is True.
+    """
     hash_file_path = _add_suffix(file_path, '.xxh')
-    if hash_file_path.is_file() and file_path.is_file():
-        with hash_file_path.open('r') as f:
-            saved_hash = f.read().strip()
-            if saved_hash == _get_xxhash(file_path):
-                return True
-    return False
-
-def _save_hash(file_path: pathlib.Path) -> None:
+    if not (hash_file_path.is_file() and file_path.is_file()):
+        return False
+    lines = hash_file_path.read_text().split('\n')
+    saved_hash = lines[0].strip()
+    if len(lines) < 2 or not lines[1].strip():
+        if saved_hash != _get_legacy_xxhash(file_path):
+            return False
+        _save_hash(file_path)
+        return True
+    if not verify and json.loads(lines[1]) == _file_stat(file_path):
+        return True
+    if saved_hash != _get_xxhash(file_path):
+        return False
+    _save_hash(file_path, saved_hash)
+    return True
+
+def _save_hash(file_path: pathlib.Path, file_hash: Optional[str] = None) -> None:
     """Save the hash for file_path."""
     if not file_path.is_file(): return
     hash_file_path = _add_suffix(file_path, '.xxh')
-    with hash_file_path.open('w') as f:
-        f.write(_get_xxhash(file_path)+'\n')
+    tmp_path = _add_suffix(hash_file_path, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    with tmp_path.open('w') as f:
+        f.write((file_hash or _get_xxhash(file_path))+'\n')
+        f.write(json.dumps(_file_stat(file_path))+'\n')
+    os.replace(tmp_path, hash_file_path)
+
+def verify(save_dir: Optional[str] = None) -> List[pathlib.Path]:
+    """Verify the downloaded files by fully rehashing their contents.
+
+    Downloaded files are only checked by size and mtime before being reused, use
+    this function to detect a file that was corrupted in place.
+
+    :param save_dir: The directory to check, the default value is
+        :py:func:`current_name`, or all directories in ``DATAROOT`` if it is empty.
+    :return: The files not matching their saved hashes.
+    """
+    save_dir = save_dir or current_name()
+    folder = DATAROOT/save_dir if save_dir else DATAROOT
+    pattern = '*.xxh' if save_dir else '*/*.xxh'
+    corrupted = []
+    for hash_file_path in sorted(folder.glob(pattern)):
+        file_path = hash_file_path.with_suffix('')
+        if not _match_hash(file_path, verify=True):
+            logging.warning(f'{file_path} does not match its hash')
+            corrupted.append(file_path)
+    return corrupted
 
 
 class TestHash(unittest.TestCase):
     def test_hash(self):
         f = tempfile.NamedTemporaryFile()
         f.write(b'12345678')
+        f.flush()
         fn = pathlib.Path(f.name)
         self.assertEqual(_match_hash(fn), False)
         _save_hash(fn)
         self.assertEqual(_match_hash(fn), True)
+        # a changed file with the same size and mtime is only found by verify
+        stat = fn.stat()
+        fn.write_bytes(b'87654321')
+        os.utime(fn, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(_match_hash(fn), True)
+        self.assertEqual(_match_hash(fn, verify=True), False)
+        _add_suffix(fn, '.xxh').unlink()
+
+    def test_legacy_hash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = pathlib.Path(tmp)/'data'
+            fn.write_bytes(os.urandom(1000))
+            _add_suffix(fn, '.xxh').write_text(_get_legacy_xxhash(fn)+'\n')
+            with unittest.mock.patch(f'{__name__}._get_xxhash', wraps=_get_xxhash) as get_xxhash:
+                self.assertTrue(_match_hash(fn))
+                self.assertTrue(_match_hash(fn))
+                self.assertEqual(get_xxhash.call_count, 1)
+            self.assertEqual(len(_add_suffix(fn, '.xxh').read_text().splitlines()), 2)
+
+    @unittest.mock.patch(f'{__name__}._HASH_CHUNK', 100)
+    def test_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = pathlib.Path(tmp)/'data'
+            data = os.urandom(2000)
+            fn.write_bytes(data)
+            h = _get_xxhash(fn)
+            self.assertEqual(h, _get_xxhash(fn, num_workers=1))
+            # the middle isn't hashed if more than _HASH_MAX_CHUNKS chunks
+            fn.write_bytes(data[:1000]+bytes(10)+data[1010:])
+            self.assertEqual(h, _get_xxhash(fn))
+            fn.write_bytes(data[:10]+bytes(10)+data[20:])
+            self.assertNotEqual(h, _get_xxhash(fn))
+
+    def test_verify(self):
+        with NameContext('test_verify'):
+            folder = DATAROOT/'test_verify'
+            folder.mkdir(parents=True, exist_ok=True)
+            (folder/'a').write_bytes(b'123')
+            _save_hash(folder/'a')
+            self.assertEqual(verify(), [])
+            (folder/'a').write_bytes(b'456')
+            self.assertEqual(verify(), [folder/'a'])
+            shutil.rmtree(folder)
 
 def _download_kaggle(url: str, save_dir:str) -> pathlib.Path:
-    """Download the dataset from Kaggle and return path of the zip file."""
+    """Download the dataset from Kaggle and return path of the zip file.
+
+    The Kaggle API doesn't report the progress, so the download is not rate limited,
+    and the free disk space is only checked before and after downloading, a file
+    leaving less than the minimal free space is removed.
+    """
     try:
         import kaggle
     except OSError:
@@ -136,6 +269,8 @@ def _download_kaggle(url: str, save_dir:str) -> pathlib.Path:
     if _match_hash(zip_file_path): return zip_file_path
 
     # download
+    full_dir.mkdir(parents=True, exist_ok=True)
+    _check_free_space(full_dir, 0)
     if user and user != 'c':
         if file:
             logging.info(f'Downloading {file} from Kaggle dataset {user}/{dataset} into {full_dir}')
@@ -160,60 +295,428 @@ def _download_kaggle(url: str, save_dir:str) -> pathlib.Path:
         if save_path.is_file():
             save_path.rename(zip_file_path)
 
-    if file_path.is_file():
-        _save_hash(file_path)
-        return file_path
-    if zip_file_path.is_file():
-        _save_hash(zip_file_path)
-        return zip_file_path
+    for path in (file_path, zip_file_path):
+        if path.is_file():
+            try:
+                _check_free_space(full_dir, 0)
+            except OSError:
+                path.unlink()
+                raise
+            _save_hash(path)
+            return path
     raise FileNotFoundError(f'Not found downloaded file as {file_path} or {zip_file_path}')
     return ''
 
 
-def _download_url(url: str, save_dir:str):
-    """Download from a URL, save it to file_path."""
+# Files are downloaded in chunks with this number of bytes by multiple connections
+_CHUNK_SIZE = 2**24
+# The minimal number of chunks to download a file by multiple connections
+_MIN_CHUNKS = 4
+_session_lock = threading.Lock()
+_session = None
+
+# Downloading is skipped if the free disk space would become less than this number of bytes.
+# Kaggle downloads are only checked before and after downloading
+MIN_FREE_SPACE = 0
+
+class _RateLimiter:
+    """A token bucket to limit the total download rate of all threads.
+
+    :ivar rate: The maximal bytes per second, None means unlimited.
+    """
+    def __init__(self, rate: Optional[float] = None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+
+    def consume(self, nbytes: int) -> None:
+        """Block until nbytes are allowed to be downloaded."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+_rate_limiter = _RateLimiter()
+
+# The rate limiter and the minimal free space of downloads in the current context,
+# None means the module defaults above
+_limits: contextvars.ContextVar[Optional[Tuple[_RateLimiter, int]]] = contextvars.ContextVar(
+    'limits', default=None)
+
+def _get_limits() -> Tuple[_RateLimiter, int]:
+    limits = _limits.get()
+    return (_rate_limiter, MIN_FREE_SPACE) if limits is None else limits
+
+@contextlib.contextmanager
+def _limited(max_rate: Optional[float], min_free_space: int) -> Iterator[None]:
+    """Limit the downloads in this context, including threads started with a copy
+    of it, by a total rate and a minimal free disk space."""
+    token = _limits.set((_RateLimiter(max_rate), min_free_space))
+    try:
+        yield
+    finally:
+        _limits.reset(token)
+
+def _check_free_space(folder: pathlib.Path, nbytes: int) -> None:
+    free = shutil.disk_usage(folder).free
+    min_free_space = _get_limits()[1]
+    if free - nbytes < min_free_space:
+        raise OSError(f'Not enough disk space in {folder} to save {nbytes} bytes, '
+                      f'{free} bytes are free and at least {min_free_space} should remain')
+
+def _get_session() -> requests.Session:
+    """Return a session shared by all downloads to reuse connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+def _download_url(url: str, save_dir:str, num_workers: int = 8) -> pathlib.Path:
+    """Download from a URL, save it to file_path.
+
+    Data are written into a ``.part`` file, which is renamed after completion. An
+    interrupted download is resumed through HTTP range requests, and a large file is
+    downloaded by ``num_workers`` connections concurrently.
+    """
     file_path = DATAROOT/save_dir/url.split('/')[-1]
     if _match_hash(file_path): return file_path
     logging.info(f'Downloading {url} into {file_path}')
     if not file_path.parent.exists():
         file_path.parent.mkdir(parents=True)
-    r = requests.get(url, stream=True, verify=True)
+    part_path = _add_suffix(file_path, '.part')
+    session = _get_session()
+    r = session.head(url, allow_redirects=True, timeout=60)
+    total_size_in_bytes = int(r.headers.get('content-length', 0)) if r.ok else 0
+    accept_ranges = r.ok and r.headers.get('accept-ranges', '') == 'bytes'
+    validator = _validator(r.headers) if r.ok else ''
+    _check_free_space(file_path.parent, total_size_in_bytes)
+    if (accept_ranges and validator and num_workers > 1 and
+        total_size_in_bytes >= _CHUNK_SIZE * _MIN_CHUNKS):
+        _download_chunks(session, url, part_path, total_size_in_bytes, num_workers, validator)
+    else:
+        _download_stream(session, url, part_path, total_size_in_bytes, validator)
+    os.replace(part_path, file_path)
+    _save_hash(file_path)
+    return file_path
+
+def _validator(headers) -> str:
+    """Return the strong validator of a response to be sent in ``If-Range``, which
+    is either its ETag or its last modified time, or '' if not available."""
+    etag = headers.get('etag', '')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('last-modified', '')
+
+def _download_stream(session: requests.Session, url: str, part_path: pathlib.Path,
+                     total_size_in_bytes: int, validator: str = '') -> None:
+    """Download by a single connection, continue from the existing part_path.
+
+    The validator of the data is saved in a ``.validator`` file next to part_path.
+    A download is only resumed if the validator is unchanged, and the ``If-Range``
+    header makes the server send the whole file if it changed since then.
+    """
+    validator_path = _add_suffix(part_path, '.validator')
+    rate_limiter = _get_limits()[0]
+    pos = part_path.stat().st_size if part_path.is_file() else 0
+    saved = validator_path.read_text() if validator_path.is_file() else ''
+    if pos and not (validator and saved == validator):
+        pos = 0  # the part may be from other data
+    if pos and pos == total_size_in_bytes:
+        return
+    headers = {'Range':f'bytes={pos}-', 'If-Range':validator} if pos else {}
+    r = session.get(url, stream=True, verify=True, headers=headers, timeout=60)
+    if r.status_code == 416:  # the range is not satisfiable, download from scratch
+        pos = 0
+        r = session.get(url, stream=True, verify=True, timeout=60)
     r.raise_for_status()
-    total_size_in_bytes = int(r.headers.get('content-length', 0))
-    progress_bar = tqdm.tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True)
+    if r.status_code != 206:
+        pos = 0
+    if not pos:
+        validator = _validator(r.headers) or validator
+        if validator:
+            validator_path.write_text(validator)
+        elif validator_path.exists():
+            validator_path.unlink()
+    total_size_in_bytes = pos + int(r.headers.get('content-length', 0))
+    progress_bar = tqdm.tqdm(total=total_size_in_bytes, initial=pos, unit='iB', unit_scale=True)
     block_size = 2**20
-    with file_path.open('wb') as fb:
+    with part_path.open('r+b' if pos else 'wb') as fb:
+        fb.seek(pos)
         for chunk in r.iter_content(chunk_size=block_size):
             fb.write(chunk)
             progress_bar.update(len(chunk))
+            rate_limiter.consume(len(chunk))
     progress_bar.close()
     if progress_bar.n < total_size_in_bytes:
         raise IOError(f'Only {progress_bar.n} bytes out of {total_size_in_bytes} bytes are downloaded.')
-    _save_hash(file_path)
-    return file_path
+    if validator_path.exists():
+        validator_path.unlink()
+
+def _download_chunks(session: requests.Session, url: str, part_path: pathlib.Path,
+                     total_size_in_bytes: int, num_workers: int, validator: str) -> None:
+    """Download chunks by multiple connections concurrently.
+
+    Finished chunks are recorded in a ``.chunks`` file next to part_path together
+    with the validator of the data, and are skipped when resuming if the validator
+    is unchanged. Each range request is sent with ``If-Range``, so chunks of
+    different versions are never mixed. The ``.chunks`` file is written atomically,
+    and an unreadable one restarts the download.
+    """
+    chunks_path = _add_suffix(part_path, '.chunks')
+    rate_limiter = _get_limits()[0]
+    num_chunks = (total_size_in_bytes + _CHUNK_SIZE - 1) // _CHUNK_SIZE
+    done = set()
+    if part_path.is_file() and chunks_path.is_file():
+        try:
+            state = json.loads(chunks_path.read_text())
+            if (state['size'] == total_size_in_bytes and state['chunk_size'] == _CHUNK_SIZE and
+                state.get('validator') == validator):
+                done = set(i for i in state['done'] if 0 <= i < num_chunks)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f'Restart downloading {url}, failed to read {chunks_path}. {e}')
+    if not done:
+        with part_path.open('wb') as f:
+            f.truncate(total_size_in_bytes)
+    progress_bar = tqdm.tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True,
+                             initial=sum(min(_CHUNK_SIZE, total_size_in_bytes-i*_CHUNK_SIZE) for i in done))
+    lock = threading.Lock()
+
+    def download_chunk(i):
+        start = i * _CHUNK_SIZE
+        end = min(start + _CHUNK_SIZE, total_size_in_bytes) - 1
+        r = session.get(url, stream=True, verify=True, timeout=60,
+                        headers={'Range':f'bytes={start}-{end}', 'If-Range':validator})
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError(f'{url} changed during downloading, or doesn\'t support range requests')
+        n = 0
+        with part_path.open('r+b') as fb:
+            fb.seek(start)
+            for data in r.iter_content(chunk_size=2**20):
+                fb.write(data)
+                n += len(data)
+                progress_bar.update(len(data))
+                rate_limiter.consume(len(data))
+        if n != end - start + 1:
+            raise IOError(f'Only {n} bytes out of {end-start+1} bytes are downloaded for chunk {i}.')
+        with lock:
+            done.add(i)
+            _write_text(chunks_path, json.dumps({'size':total_size_in_bytes, 'chunk_size':_CHUNK_SIZE,
+                                                 'validator':validator, 'done':sorted(done)}))
+
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+        list(pool.map(download_chunk, [i for i in range(num_chunks) if i not in done]))
+    progress_bar.close()
+    chunks_path.unlink()
+
+_COPY_BUFFER = 2**20
 
-def _extract_file(file_path: pathlib.Path) -> pathlib.Path:
-    """Extract the file_path, returns the saved folder."""
+def _extract_file(file_path: pathlib.Path, num_workers: int = 8) -> pathlib.Path:
+    """Extract the file_path, returns the saved folder.
+
+    Members are streamed to disk with a bounded buffer, and extracted by multiple
+    threads unless the archive is a compressed tar file. Extracted members are logged
+    in a ``.extracted`` file next to the archive, so an interrupted extraction resumes
+    from where it stopped. Members already extracted from the same blob by another
+    dataset are hardlinked instead.
+    """
     save_folder = file_path.parent
-    if file_path.suffix not in ['.zip', '.tar', '.gz', '.tgz']:
+    if core.reader._archive_type(file_path) is None:
         return save_folder
     reader = core.create_reader(file_path)
-    compressed_files = set(reader.list_files())
-    existed_files = set(core.create_reader(save_folder).list_files())
-    uncompressed_files = compressed_files.difference(existed_files)
-    if len(uncompressed_files):
-        logging.info(f'Extracting {str(file_path)} to {str(save_folder.resolve())}')
-        for p in tqdm.tqdm(uncompressed_files):
-            out = save_folder / p
-            if not out.parent.exists(): out.parent.mkdir(parents=True)
-            with out.open('wb') as f:
-                f.write(reader.open(p).read())
+    files = reader.manifest()
+    log_path = _add_suffix(file_path, '.extracted')
+    stat = file_path.stat()
+    header = json.dumps({'size':stat.st_size, 'mtime':stat.st_mtime_ns})
+    lines = log_path.read_text().split('\n') if log_path.exists() else []
+    if lines and lines[0] == header:
+        done = set(lines[1:])
+    else:
+        # Without a valid log, trust existing files with the same sizes
+        sizes = [_file_size(save_folder/p) for p in files['file_path']]
+        done = set(files['file_path'][files['size'] == sizes])
+        with log_path.open('w') as f:
+            f.write('\n'.join([header] + sorted(done)) + '\n')
+    todo = files[~files['file_path'].isin(done)].sort_values('offset')
+    file_hash = _saved_hash(file_path)
+    if not len(todo):
+        _add_extracted_folder(file_hash, save_folder)
+        return save_folder
+    sources = [f for f in _extracted_folders(file_hash) if f != save_folder]
+    logging.info(f'Extracting {str(file_path)} to {str(save_folder.resolve())}')
+    if isinstance(reader, core.TarReader) and reader._decompressor():
+        num_workers = 1  # a compressed stream can only be read sequentially
+    log_lock = threading.Lock()
+    def extract(path, size):
+        out = save_folder / path
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f'{out.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        if not any(_link_file(src/path, tmp, size) for src in sources):
+            with reader.open(path) as src, tmp.open('wb') as dst:
+                shutil.copyfileobj(src, dst, _COPY_BUFFER)
+        os.replace(tmp, out)
+        with log_lock:
+            log.write(path+'\n')
+            log.flush()
+    with log_path.open('a') as log, \
+        concurrent.futures.ThreadPoolExecutor(num_workers) as pool, \
+        tqdm.tqdm(total=int(todo['size'].sum()), unit='B', unit_scale=True) as progress:
+        futures = {pool.submit(extract, p, size):size for p, size in zip(todo['file_path'], todo['size'])}
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            progress.update(futures[future])
+    _add_extracted_folder(file_hash, save_folder)
+    core.cache._invalidate_usage(save_folder)
     return save_folder
 
+def _file_size(path: pathlib.Path) -> int:
+    """Return the file size, or -1 if not exists."""
+    try:
+        return path.stat().st_size
+    except OSError:
+        return -1
+
+def _link_file(src: pathlib.Path, dst: pathlib.Path, size: int) -> bool:
+    """Hardlink src to dst if src has the size, return if succeeded."""
+    try:
+        if src.stat().st_size != size: return False
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
+
+_BLOBS = '.blobs'
+
+def _saved_hash(file_path: pathlib.Path) -> Optional[str]:
+    """Return the hash saved by :func:`_save_hash`, or None if not exists."""
+    hash_file_path = _add_suffix(file_path, '.xxh')
+    if not hash_file_path.is_file(): return None
+    return hash_file_path.read_text().partition('\n')[0].strip() or None
+
+def _blob_path(file_hash: str) -> pathlib.Path:
+    return DATAROOT/_BLOBS/'objects'/file_hash[:2]/file_hash
+
+def _url_key(url: str) -> str:
+    """Normalize url so that the same data have the same key."""
+    for prefix in ('kaggle://', 'https://www.kaggle.com/', 'http://', 'https://'):
+        if url.startswith(prefix):
+            return url[len(prefix):]
+    return url
+
+def _url_index_path(url: str) -> pathlib.Path:
+    return DATAROOT/_BLOBS/'urls'/(xxhash.xxh64(_url_key(url).encode()).hexdigest()+'.json')
+
+def _write_text(path: pathlib.Path, text: str) -> None:
+    """Write text into path atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _add_suffix(path, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+def _replace_with_link(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """Replace dst with a hardlink of src."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _add_suffix(dst, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def _add_blob(url: str, file_path: pathlib.Path) -> None:
+    """Move the downloaded file_path into the blob store and link it back."""
+    file_hash = _saved_hash(file_path)
+    if not file_hash or not file_path.is_file(): return
+    blob = _blob_path(file_hash)
+    try:
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.link(file_path, blob)
+        elif not os.path.samefile(blob, file_path):
+            _replace_with_link(blob, file_path)
+            _save_hash(file_path, file_hash)
+        _write_text(_url_index_path(url), json.dumps({'hash':file_hash, 'name':file_path.name}))
+    except OSError as e:
+        logging.warning(f'Failed to add {file_path} into the blob store. {e}')
+
+def _link_blob(url: str, save_dir: str) -> Optional[pathlib.Path]:
+    """Link the blob of url into save_dir if it was downloaded, return the linked path."""
+    index_path = _url_index_path(url)
+    if not index_path.is_file(): return None
+    info = json.loads(index_path.read_text())
+    blob = _blob_path(info['hash'])
+    file_path = DATAROOT/save_dir/info['name']
+    if not blob.is_file(): return None
+    try:
+        if not (file_path.is_file() and os.path.samefile(blob, file_path)):
+            _replace_with_link(blob, file_path)
+            _save_hash(file_path, info['hash'])
+            core.cache._invalidate_usage(file_path.parent)
+    except OSError as e:
+        logging.warning(f'Failed to link {blob} to {file_path}. {e}')
+        return None
+    return file_path if _match_hash(file_path) else None
+
+def _extracted_folders(file_hash: Optional[str]) -> List[pathlib.Path]:
+    """Return the folders where the blob with file_hash was extracted."""
+    if not file_hash: return []
+    index_path = DATAROOT/_BLOBS/'extracted'/(file_hash+'.txt')
+    if not index_path.is_file(): return []
+    return [pathlib.Path(l) for l in index_path.read_text().split('\n')
+            if l and pathlib.Path(l).is_dir()]
+
+def _add_extracted_folder(file_hash: Optional[str], folder: pathlib.Path) -> None:
+    if not file_hash or not _blob_path(file_hash).is_file(): return
+    folders = _extracted_folders(file_hash)
+    if folder not in folders:
+        _write_text(DATAROOT/_BLOBS/'extracted'/(file_hash+'.txt'),
+                    '\n'.join(str(f) for f in folders + [folder]) + '\n')
+
+def gc() -> int:
+    """Remove blobs not linked by any dataset folder.
+
+    :return: The number of bytes freed.
+    """
+    freed = 0
+    for blob in (DATAROOT/_BLOBS).glob('objects/*/*'):
+        st = blob.stat()
+        if st.st_nlink <= 1:
+            logging.info(f'Removing {blob}')
+            blob.unlink()
+            freed += st.st_size
+    for index_path in (DATAROOT/_BLOBS).glob('urls/*.json'):
+        if not _blob_path(json.loads(index_path.read_text())['hash']).is_file():
+            index_path.unlink()
+    for index_path in (DATAROOT/_BLOBS).glob('extracted/*.txt'):
+        if not _blob_path(index_path.stem).is_file() or not _extracted_folders(index_path.stem):
+            index_path.unlink()
+    return freed
+
+_download_locks_lock = threading.Lock()
+_download_locks: Dict[str, threading.Lock] = {}
+
+def _download_lock(url: str) -> threading.Lock:
+    """Return the lock to download url, so that threads downloading the same data,
+    even into different folders, wait for the first one and then reuse its result."""
+    with _download_locks_lock:
+        return _download_locks.setdefault(_url_key(url), threading.Lock())
+
 def download(url: str, save_dir: Optional[str] = None, extract: bool = False
             ) -> pathlib.Path:
     """Download a URL and return the file path. 
 
+    It is thread-safe, concurrent calls with the same URL only download once. The
+    downloaded file is saved in the blob store and hardlinked into save_dir, so the
+    same URL downloaded into another save_dir is linked without downloading again.
+
     :param url: The URL to be downloaded.
     :param save_dir: The directory to save the file, the default value is :py:func:`current_name`
     :param extract: If True, then extract the downloaded file into its current directory. 
@@ -222,17 +725,59 @@ def download(url: str, save_dir: Optional[str] = None, extract: bool = False
     if save_dir is None:
         save_dir = current_name()
     kaggle_prefix = ['kaggle://', 'https://www.kaggle.com/']
-    downloaded = False
-    for prefix in kaggle_prefix:
-        if url.startswith(prefix):
-            file_path =  _download_kaggle(url[len(prefix):], save_dir)
-            downloaded = True
-    if not downloaded:
-        file_path = _download_url(url, save_dir)
-    if extract:
-        file_path = _extract_file(file_path)
+    with _download_lock(url):
+        linked = _link_blob(url, save_dir)
+        if linked:
+            file_path = linked
+        else:
+            downloaded = False
+            for prefix in kaggle_prefix:
+                if url.startswith(prefix):
+                    file_path =  _download_kaggle(url[len(prefix):], save_dir)
+                    downloaded = True
+            if not downloaded:
+                file_path = _download_url(url, save_dir)
+            _add_blob(url, file_path)
+            core.cache._invalidate_usage(file_path.parent)
+        if extract:
+            file_path = _extract_file(file_path)
     return file_path
 
+# The number of downloads run concurrently by download_async, a change takes
+# effect for the following calls
+ASYNC_WORKERS = 8
+_async_executor_lock = threading.Lock()
+_async_executor: Optional[Tuple[int, concurrent.futures.ThreadPoolExecutor]] = None
+
+def _get_async_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the executor of download_async, which is replaced if ``ASYNC_WORKERS``
+    is changed. Downloads running in the old one continue."""
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None or _async_executor[0] != ASYNC_WORKERS:
+            if _async_executor is not None:
+                _async_executor[1].shutdown(wait=False)
+            _async_executor = (ASYNC_WORKERS, concurrent.futures.ThreadPoolExecutor(
+                ASYNC_WORKERS, thread_name_prefix='d8-download'))
+        return _async_executor[1]
+
+async def download_async(url: str, save_dir: Optional[str] = None, extract: bool = False
+                         ) -> pathlib.Path:
+    """The asyncio version of :func:`download`.
+
+    It runs :func:`download` in a thread pool with ``ASYNC_WORKERS`` threads, which
+    shares the pooled HTTP connections and bounds the number of concurrent downloads.
+    The event loop is not blocked, so multiple URLs can be downloaded concurrently
+    by ``asyncio.gather``.
+    """
+    if save_dir is None:
+        save_dir = current_name()
+    loop = asyncio.get_running_loop()
+    # run with a copy of the current context to keep the download limits
+    return await loop.run_in_executor(
+        _get_async_executor(), functools.partial(
+            contextvars.copy_context().run, download, url, save_dir, extract))
+
 class TestDownload(unittest.TestCase):
     def setUp(self):
         self.name = 'test_download'
@@ -271,6 +816,274 @@ class TestDownload(unittest.TestCase):
                 self.dir/'train.csv')
 
 
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve files with single byte ranges and If-Range supported."""
+    ranges: list = []
+    if_ranges: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        with open(path, 'rb') as f:
+            data = f.read()
+        start, end = 0, len(data) - 1
+        etag = f'"{xxhash.xxh64(data).hexdigest()}"'
+        byte_range = self.headers.get('Range')
+        self.ranges.append(byte_range)
+        self.if_ranges.append(self.headers.get('If-Range'))
+        if self.headers.get('If-Range', etag) != etag:
+            byte_range = None
+        if byte_range:
+            start, end = byte_range[len('bytes='):].split('-')
+            start, end = int(start), (int(end) if end else len(data) - 1)
+            if start >= len(data):
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        return io.BytesIO(data[start:end+1])
+
+class TestDownloadURL(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.patcher = unittest.mock.patch(f'{__name__}.DATAROOT', pathlib.Path(self.root.name))
+        self.patcher.start()
+        self.name = 'test_download_url'
+        self.dir = DATAROOT/self.name
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = os.urandom(10000)
+        (pathlib.Path(self.tmp.name)/'data.bin').write_bytes(self.data)
+        handler = functools.partial(_RangeRequestHandler, directory=self.tmp.name)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/data.bin'
+        self.etag = f'"{xxhash.xxh64(self.data).hexdigest()}"'
+        _RangeRequestHandler.ranges = []
+        _RangeRequestHandler.if_ranges = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+        self.patcher.stop()
+        self.root.cleanup()
+
+    def test_download(self):
+        self.assertEqual(_download_url(self.url, self.name), self.dir/'data.bin')
+        self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+        self.assertFalse((self.dir/'data.bin.part').exists())
+        self.assertEqual(_RangeRequestHandler.ranges, [None, None])
+
+    def test_resume(self):
+        (self.dir/'data.bin.part').write_bytes(self.data[:3000])
+        (self.dir/'data.bin.part.validator').write_text(self.etag)
+        _download_url(self.url, self.name)
+        self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+        self.assertEqual(_RangeRequestHandler.ranges[-1], 'bytes=3000-')
+        self.assertEqual(_RangeRequestHandler.if_ranges[-1], self.etag)
+        self.assertFalse((self.dir/'data.bin.part.validator').exists())
+        # a part of other data is not resumed
+        (self.dir/'data.bin').unlink()
+        for validator in ('"other"', None):
+            (self.dir/'data.bin.part').write_bytes(os.urandom(3000))
+            if validator: (self.dir/'data.bin.part.validator').write_text(validator)
+            _download_url(self.url, self.name)
+            self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+            self.assertEqual(_RangeRequestHandler.ranges[-1], None)
+            (self.dir/'data.bin').unlink()
+        # the server sends the whole file if it changed after the HEAD request
+        (self.dir/'data.bin.part').write_bytes(os.urandom(3000))
+        (self.dir/'data.bin.part.validator').write_text('"other"')
+        _download_stream(_get_session(), self.url, self.dir/'data.bin.part', 10000, '"other"')
+        self.assertEqual(_RangeRequestHandler.if_ranges[-1], '"other"')
+        self.assertEqual((self.dir/'data.bin.part').read_bytes(), self.data)
+
+    def test_concurrent(self):
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            paths = list(pool.map(lambda _: download(self.url, self.name), range(4)))
+        self.assertEqual(paths, [self.dir/'data.bin'] * 4)
+        # a single HEAD and GET
+        self.assertEqual(len(_RangeRequestHandler.ranges), 2)
+
+    def test_download_async(self):
+        for fn in ('a.bin', 'b.bin'):
+            (pathlib.Path(self.tmp.name)/fn).write_bytes(self.data)
+        async def main():
+            with NameContext(self.name):
+                return await asyncio.gather(*[download_async(self.url.replace('data.bin', fn))
+                                              for fn in ('data.bin', 'a.bin', 'b.bin')])
+        paths = asyncio.run(main())
+        self.assertEqual(paths, [self.dir/fn for fn in ('data.bin', 'a.bin', 'b.bin')])
+        for p in paths:
+            self.assertEqual(p.read_bytes(), self.data)
+        executor = _get_async_executor()
+        self.assertIs(_get_async_executor(), executor)
+        with unittest.mock.patch(f'{__name__}.ASYNC_WORKERS', 2):
+            self.assertEqual(_get_async_executor()._max_workers, 2)
+
+    def test_blobs(self):
+        paths = [download(self.url, name) for name in ('blob_a', 'blob_b', 'blob_b')]
+        self.assertEqual(len(_RangeRequestHandler.ranges), 2)
+        self.assertTrue(os.path.samefile(paths[0], paths[1]))
+        self.assertEqual(paths[1].read_bytes(), self.data)
+        blob = _blob_path(_saved_hash(paths[0]))
+        self.assertEqual(blob.stat().st_nlink, 3)
+        self.assertEqual(gc(), 0)
+        for p in paths[:2]: p.unlink()
+        self.assertEqual(gc(), len(self.data))
+        self.assertFalse(blob.exists())
+        self.assertEqual(list((DATAROOT/_BLOBS).glob('urls/*')), [])
+        # downloaded again after gc
+        self.assertEqual(download(self.url, 'blob_a').read_bytes(), self.data)
+        self.assertEqual(len(_RangeRequestHandler.ranges), 4)
+
+    def test_extract_blobs(self):
+        import zipfile
+        zip_path = pathlib.Path(self.tmp.name)/'data.zip'
+        with zipfile.ZipFile(zip_path, 'w') as f:
+            f.writestr('a/1.txt', self.data)
+        url = self.url.replace('data.bin', 'data.zip')
+        folder_a = download(url, 'blob_a', extract=True)
+        with unittest.mock.patch.object(shutil, 'copyfileobj') as copy:
+            folder_b = download(url, 'blob_b', extract=True)
+            copy.assert_not_called()
+        self.assertTrue(os.path.samefile(folder_a/'a/1.txt', folder_b/'a/1.txt'))
+
+    def test_limits(self):
+        # at most 1 second of data can be downloaded without waiting
+        _rate_limiter.rate = 5000
+        try:
+            start = time.time()
+            _download_url(self.url, self.name)
+            self.assertGreater(time.time() - start, 0.5)
+        finally:
+            _rate_limiter.rate = None
+        (self.dir/'data.bin').unlink()
+        with unittest.mock.patch(f'{__name__}.MIN_FREE_SPACE', 2**62):
+            with self.assertRaises(OSError):
+                _download_url(self.url, self.name)
+        # limits in a context don't change other threads
+        with _limited(None, 2**62), concurrent.futures.ThreadPoolExecutor(1) as pool:
+            with self.assertRaises(OSError):
+                _download_url(self.url, self.name)
+            pool.submit(_check_free_space, self.dir, 0).result()
+            with self.assertRaises(OSError):
+                pool.submit(contextvars.copy_context().run, _check_free_space, self.dir, 0).result()
+        self.assertIsNone(_limits.get())
+
+    def test_kaggle_limits(self):
+        import sys
+        import types
+        kaggle = types.SimpleNamespace(api=unittest.mock.Mock())
+        kaggle.api.dataset_download_file.side_effect = (
+            lambda dataset, file, path: (pathlib.Path(path)/file).write_bytes(self.data))
+        with unittest.mock.patch.dict(sys.modules, {'kaggle':kaggle}):
+            with unittest.mock.patch(f'{__name__}.MIN_FREE_SPACE', 2**62):
+                with self.assertRaises(OSError):
+                    _download_kaggle('user/data#k.bin', self.name)
+            kaggle.api.dataset_download_file.assert_not_called()
+            # the file is removed if the free space became too small
+            with unittest.mock.patch(f'{__name__}._check_free_space', side_effect=[None, OSError()]):
+                with self.assertRaises(OSError):
+                    _download_kaggle('user/data#k.bin', self.name)
+            self.assertFalse((self.dir/'k.bin').exists())
+            self.assertEqual(_download_kaggle('user/data#k.bin', self.name).read_bytes(), self.data)
+
+    @unittest.mock.patch(f'{__name__}._CHUNK_SIZE', 1000)
+    def test_chunks(self):
+        _download_url(self.url, self.name)
+        self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+        self.assertEqual(len(_RangeRequestHandler.ranges), 11)
+        self.assertFalse((self.dir/'data.bin.part.chunks').exists())
+        # resume with the first 4 chunks done
+        (self.dir/'data.bin').unlink()
+        (self.dir/'data.bin.part').write_bytes(self.data[:4000]+bytes(6000))
+        with (self.dir/'data.bin.part.chunks').open('w') as f:
+            json.dump({'size':10000, 'chunk_size':1000, 'validator':self.etag, 'done':[0, 1, 2, 3]}, f)
+        _RangeRequestHandler.ranges, _RangeRequestHandler.if_ranges = [], []
+        _download_url(self.url, self.name)
+        self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+        self.assertEqual(sorted(_RangeRequestHandler.ranges[1:]),
+                         sorted(f'bytes={i*1000}-{i*1000+999}' for i in range(4, 10)))
+        self.assertEqual(set(_RangeRequestHandler.if_ranges[1:]), {self.etag})
+        # chunks of other data are downloaded again
+        (self.dir/'data.bin').unlink()
+        (self.dir/'data.bin.part').write_bytes(bytes(10000))
+        with (self.dir/'data.bin.part.chunks').open('w') as f:
+            json.dump({'size':10000, 'chunk_size':1000, 'validator':'"other"', 'done':[0, 1, 2, 3]}, f)
+        _RangeRequestHandler.ranges = []
+        _download_url(self.url, self.name)
+        self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+        self.assertEqual(len(_RangeRequestHandler.ranges), 11)
+        # a truncated state restarts the download
+        (self.dir/'data.bin').unlink()
+        (self.dir/'data.bin.part').write_bytes(bytes(10000))
+        (self.dir/'data.bin.part.chunks').write_text('{"size":10000, "chunk_si')
+        _RangeRequestHandler.ranges = []
+        _download_url(self.url, self.name)
+        self.assertEqual((self.dir/'data.bin').read_bytes(), self.data)
+        self.assertEqual(len(_RangeRequestHandler.ranges), 11)
+        # a chunk changed after the HEAD request is not written
+        with self.assertRaises(IOError):
+            _download_chunks(_get_session(), self.url, self.dir/'data.bin.part', 10000, 2, '"other"')
+
+class TestExtract(unittest.TestCase):
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.files = {f'a/{i}.txt':os.urandom(i*1000) for i in range(10)}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self):
+        for p, data in self.files.items():
+            self.assertEqual((self.dir/p).read_bytes(), data)
+        self.assertEqual(list(self.dir.glob('**/*.tmp')), [])
+
+    def test_zip(self):
+        import zipfile
+        zip_path = self.dir/'test.zip'
+        with zipfile.ZipFile(zip_path, 'w') as f:
+            for p, data in self.files.items():
+                f.writestr(p, data)
+        self.assertEqual(_extract_file(zip_path, 4), self.dir)
+        self.check()
+        # resume, only members not in the log are extracted
+        log_path = self.dir/'test.zip.extracted'
+        lines = log_path.read_text().split('\n')
+        log_path.write_text('\n'.join(l for l in lines if l != 'a/3.txt'))
+        (self.dir/'a/3.txt').write_bytes(b'x')
+        (self.dir/'a/5.txt').write_bytes(b'x')
+        _extract_file(zip_path)
+        self.assertEqual((self.dir/'a/3.txt').read_bytes(), self.files['a/3.txt'])
+        self.assertEqual((self.dir/'a/5.txt').read_bytes(), b'x')
+        # without a log, files with mismatched sizes are extracted again
+        log_path.unlink()
+        _extract_file(zip_path)
+        self.check()
+
+    def test_tar_gz(self):
+        import tarfile
+        tar_path = self.dir/'test.tar.gz'
+        with tarfile.open(tar_path, 'w:gz') as f:
+            for p, data in self.files.items():
+                info = tarfile.TarInfo(p)
+                info.size = len(data)
+                f.addfile(info, io.BytesIO(data))
+        _extract_file(tar_path)
+        self.check()
+
 
 
 
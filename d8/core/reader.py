@@ -5,18 +5,33 @@
 #@save_all
 #@hide_all
 import abc
+import asyncio
+import bz2
+import collections
+import concurrent.futures
+import functools
 import glob
+import gzip
 import io
 import logging
+import lzma
 import mimetypes
+import mmap
 import os
 import pathlib
+import shutil
 import tarfile
+import threading
+import time
+import weakref
 import zipfile
-from typing import List, Optional, Sequence, TypeVar, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
 
+import numpy as np
 import pandas as pd
 import PIL
+import tqdm
+import xxhash
 from PIL import ImageFile
 
 from d8 import core
@@ -24,7 +39,9 @@ from d8 import core
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
-__all__ = ['Reader', 'EmptyReader', 'FolderReader', 'TarReader', 'ZipReader', 'create_reader', 'listify']
+__all__ = ['Reader', 'EmptyReader', 'FolderReader', 'TarReader', 'ZipReader', 'ShardReader',
+           'CompositeReader', 'ImageCache', 'create_reader', 'create_reader_async', 'listify',
+           'EXTRACT_ARCHIVES']
 
 #_E = TypeVar("_E")
 #def listify(x: Optional[Union[_E, Sequence[_E]]]) -> List[_E]:
@@ -32,6 +49,29 @@ def listify(x):
     """Make x a list if it isn't."""
     return [] if not x else (list(x) if isinstance(x, (tuple, list)) else [x])
 
+def _files_frame(file_paths: Sequence[str], sizes: Sequence[int],
+                 mtimes: Sequence[float], offsets: Sequence[int]) -> pd.DataFrame:
+    """Construct the dataframe of files in a manifest."""
+    return pd.DataFrame({
+        'file_path':pd.Series(file_paths, dtype=object),
+        'suffix':pd.Series([pathlib.PurePosixPath(p).suffix.lower() for p in file_paths], dtype=object),
+        'size':pd.Series(sizes, dtype='int64'),
+        'mtime':pd.Series(mtimes, dtype='float64'),
+        'offset':pd.Series(offsets, dtype='int64')})
+
+def _target_size(image_size: Tuple[int, int], max_width: Optional[int], max_height: Optional[int],
+                 size: Optional[Union[int, Tuple[int, int]]]) -> Optional[Tuple[int, int]]:
+    """Return the (width, height) to resize an image to, or None to keep it."""
+    width, height = image_size
+    if isinstance(size, int):
+        scale = size / min(width, height)
+    elif size:
+        return (int(size[0]), int(size[1]))
+    else:
+        scale = min(max_width / width if max_width else 1, max_height / height if max_height else 1)
+        if scale >= 1: return None
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
 class Reader(abc.ABC):
     """The base class of the data reader.
 
@@ -62,22 +102,55 @@ class Reader(abc.ABC):
         pass
 
     @abc.abstractclassmethod
-    def _list_all(self) -> List[pathlib.Path]:
+    def _update_manifest(self, saved: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Return the manifest of all files, or ``saved`` if it is still up to date.
+
+        A manifest is a dict with a ``files`` dataframe, see :func:`_files_frame`,
+        and a ``state`` used to check if the data have changed.
+        """
         pass
 
+    def _manifest_path(self) -> pathlib.Path:
+        key = xxhash.xxh64(str(self._root.resolve()).encode()).hexdigest()
+        return core.DATAROOT/'.manifests'/f'{type(self).__name__}-{key}.pkl'
+
+    def manifest(self) -> pd.DataFrame:
+        """Return all files with their sizes, modification times and offsets.
+
+        The listing is saved under ``core.DATAROOT``, and only updated when
+        the data on disk have changed.
+
+        :return: A dataframe with columns ``file_path``, ``suffix``, ``size``,
+            ``mtime`` and ``offset`` (-1 if not in an archive).
+        """
+        manifest_path = self._manifest_path()
+        saved = None
+        if manifest_path.is_file():
+            try:
+                saved = pd.read_pickle(manifest_path)
+            except Exception as e:
+                logging.warning(f'Failed to load {manifest_path}: {e}')
+        manifest = self._update_manifest(saved)
+        if manifest is not saved:
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = manifest_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            pd.to_pickle(manifest, tmp_path)
+            os.replace(tmp_path, manifest_path)
+        return manifest['files']
+
     def list_files(self, extensions: Sequence[str] =[], subfolders: Sequence[str] = []) -> List[pathlib.Path]:
         """List all files.
 
         :param extensions: If specified, then only keep files with extensions in this list.
+        :param subfolders: If specified, then only keep files in these subfolders.
         :return: The list of file paths.
         """
-        # remove folders
-        files = self._list_all()
+        files = self.manifest()
         if extensions:
-            files = [f for f in files if f.suffix.lower() in set(extensions)]
+            files = files[files['suffix'].isin(set(extensions))]
         if subfolders:
-            files = [f for f in files if any([str(f).startswith(s) for s in subfolders])]
-        return files
+            files = files[files['file_path'].str.startswith(tuple(str(s) for s in subfolders))]
+        return [pathlib.Path(f) for f in files['file_path']]
 
     def list_images(self, subfolders: Sequence[str] = []) -> List[pathlib.Path]:
         """List all image files.
@@ -87,49 +160,163 @@ class Reader(abc.ABC):
         image_extensions = list(set(k for k,v in mimetypes.types_map.items() if v.startswith('image/')))
         return self.list_files(image_extensions, subfolders)
 
+    # An optional ImageCache shared by all readers, unless a reader sets its own
+    image_cache: Optional['ImageCache'] = None
+
     def read_image(self, file_path: Union[str, pathlib.Path],
                    max_width: Optional[int] = None,
-                   max_height: Optional[int] = None):
+                   max_height: Optional[int] = None,
+                   size: Optional[Union[int, Tuple[int, int]]] = None):
         """Read an image.
 
+        When resizing, a JPEG image is decoded at a reduced scale as long as the
+        result is not smaller than the target, and then resized to the target
+        exactly. If :attr:`image_cache` is set, then decoded images are cached.
+
         :param file_path: The image file_path.
         :param max_width: The maximal width in pixel for the returned image.
             Specifying it with a small value may accelerate the reading.
         :param max_height: The maximal height in pixel for the returned image.
             Specifying it with a small value may accelerate the reading.
-        :return: The image as a numpy array.
+        :param size: If an int, then resize the shorter side to it while keeping the
+            aspect ratio. If a tuple of (width, height), then resize to it exactly.
+            It overwrites ``max_width`` and ``max_height``.
+        :return: The image as a :class:`PIL.Image.Image` in the RGB mode.
         """
+        if self.image_cache is None:
+            return self._decode_image(file_path, max_width, max_height, size)
+        key = (str(self._root), str(file_path), max_width, max_height, size, 'RGB')
+        data = self.image_cache.get(key)
+        if data is not None:
+            return PIL.Image.fromarray(data)
+        img = self._decode_image(file_path, max_width, max_height, size)
+        self.image_cache.put(key, np.asarray(img))
+        return img
+
+    def _decode_image(self, file_path, max_width, max_height, size):
         img = PIL.Image.open(self.open(file_path))
-        if img.mode != 'RGB': img = img.convert('RGB')
-        ratio = 0
-        if max_width: ratio = max(ratio, img.size[0] / max_width)
-        if max_height: ratio = max(ratio, img.size[1] / max_height)
-        if ratio > 0:
-            # TODO(mli) handle gray images
-            img.draft('RGB',(int(img.size[0]/ratio), int(img.size[1]/ratio)))
+        target = _target_size(img.size, max_width, max_height, size)
+        if target:
+            # must be called before the image is loaded, only works for JPEG
+            img.draft(img.mode, target)
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA', 'CMYK'):
+            # e.g. palette images cannot be resized with interpolation
+            img = img.convert('RGB')
+        if target and img.size != target:
+            img = img.resize(target, PIL.Image.BICUBIC, reducing_gap=3.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
         return img
 
-    def get_image_info(self, image_paths: Sequence[str]) -> pd.DataFrame:
+    def get_image_info(self, image_paths: Sequence[str],
+                       num_workers: Optional[int] = None) -> pd.DataFrame:
         """Query image information such as size, width and height.
 
-        :param reader: The data reader.
+        Only the image headers are parsed, and the file sizes are read from the
+        file system or the archive metadata. Images are probed by a thread pool.
+
         :param image_paths: The image file_paths to query.
+        :param num_workers: The number of threads to probe images. The default
+            value is decided by :class:`concurrent.futures.ThreadPoolExecutor`.
         :return: The results with each image in a row.
         """
-        rows = []
-        for img_path in image_paths:
-            raw = self.open(img_path).read()
-            img = PIL.Image.open(io.BytesIO(raw))
-            rows.append({'file_path':img_path, 'size (KB)':len(raw)/2**10,
-                        'width':img.size[0], 'height':img.size[1]})
+        def probe(img_path):
+            with self.open(img_path) as f:
+                width, height = PIL.Image.open(f).size
+            return {'file_path':img_path, 'size (KB)':self._file_size(img_path)/2**10,
+                    'width':width, 'height':height}
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+            rows = list(pool.map(probe, image_paths))
         return pd.DataFrame(rows)
 
+    def _file_size(self, path: Union[str, pathlib.Path]) -> int:
+        """Return the size of a file in bytes."""
+        with self.open(path) as f:
+            return f.seek(0, io.SEEK_END)
+
+
+class ImageCache:
+    """A two-tier cache of decoded images.
+
+    Images are kept in memory with the least recently used ones evicted when
+    exceeding ``max_bytes``. If ``cache_dir`` is specified, images are also saved
+    there as ``.npy`` files, which are memory mapped when loaded again, e.g. in a
+    new epoch after being evicted, or by another process.
+
+    :param max_bytes: The memory budget in bytes.
+    :param cache_dir: An optional folder to save decoded images.
+    """
+    def __init__(self, max_bytes: int = 2**30,
+                 cache_dir: Optional[Union[str, pathlib.Path]] = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir else None
+        self._reset_memory()
+
+    def _reset_memory(self):
+        self._images: collections.OrderedDict = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # each process has its own memory tier
+        return {'max_bytes':self.max_bytes, 'cache_dir':self.cache_dir}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_memory()
+
+    def __len__(self):
+        return len(self._images)
+
+    def _disk_path(self, key) -> pathlib.Path:
+        return self.cache_dir/(xxhash.xxh128(repr(key).encode()).hexdigest()+'.npy')
+
+    def get(self, key) -> Optional[np.ndarray]:
+        """Return the image for key, or None if not cached."""
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+        if self.cache_dir:
+            path = self._disk_path(key)
+            if path.is_file():
+                try:
+                    data = np.load(path, mmap_mode='r')
+                except Exception as e:
+                    logging.warning(f'Failed to load {path}: {e}')
+                    return None
+                self._put_memory(key, data)
+                return data
+        return None
+
+    def put(self, key, data: np.ndarray) -> None:
+        """Cache the image data for key."""
+        self._put_memory(key, data)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            if not path.is_file():
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+                with tmp_path.open('wb') as f:
+                    np.save(f, data)
+                os.replace(tmp_path, path)
+
+    def _put_memory(self, key, data):
+        with self._lock:
+            if key in self._images:
+                self._nbytes -= self._images.pop(key).nbytes
+            self._images[key] = data
+            self._nbytes += data.nbytes
+            while self._nbytes > self.max_bytes and self._images:
+                self._nbytes -= self._images.popitem(last=False)[1].nbytes
 
 class EmptyReader(Reader):
     def __init__(self):
         pass
-    def _list_all(self):
-        return []
+    def _update_manifest(self, saved):
+        return {'state':None, 'files':_files_frame([], [], [], [])}
+    def manifest(self):
+        return self._update_manifest(None)['files']
     def open(self, path: Union[str, pathlib.Path]):
         raise ValueError('Empty reader cannot open a path')
     def __eq__(self, other) -> bool:
@@ -137,6 +324,22 @@ class EmptyReader(Reader):
             raise NotImplementedError()
         return True
 
+# The nanoseconds of the coarsest mtime resolution of file systems, e.g. FAT
+_RACY_NS = 2 * 10**9
+
+def _restat(root: pathlib.Path, entries: List[Tuple[str, int, float, int]]
+            ) -> Optional[List[Tuple[str, int, float, int]]]:
+    """Return the manifest entries of files with their current sizes and mtimes,
+    or None if a file is removed."""
+    updated = []
+    for path, _, _, offset in entries:
+        try:
+            st = os.stat(root/path)
+        except OSError:
+            return None
+        updated.append((path, st.st_size, st.st_mtime, offset))
+    return updated
+
 class FolderReader(Reader):
     def __init__(self, root: pathlib.Path):
         super().__init__(root)
@@ -144,67 +347,515 @@ class FolderReader(Reader):
     def open(self, path: Union[str, pathlib.Path]):
         return (self._root/path).open('rb')
 
-    def _list_all(self):
-        return [p.relative_to(self._root) for p in self._root.glob('**/*') if not p.is_dir()]
+    def _file_size(self, path: Union[str, pathlib.Path]) -> int:
+        return (self._root/path).stat().st_size
 
-# Note that zip reader doesn't support multiprocess https://bugs.python.org/issue39363
-class ZipReader(Reader):
-    """A data reader to read from a zip file.
+    def _update_manifest(self, saved):
+        # The state maps each folder to its mtime, subfolders, files and the time
+        # it was scanned. Only folders whose mtime changed are scanned again, the
+        # files in other folders are stat-ed to catch files rewritten in place. A
+        # folder modified within _RACY_NS before its scan is always scanned again,
+        # as files added in the same tick of a coarse mtime don't change it.
+        saved_dirs = saved['state'] if saved else {}
+        dirs, files, changed, stack = {}, [], False, ['']
+        while stack:
+            folder = stack.pop()
+            mtime = (self._root/folder).stat().st_mtime_ns
+            cached = saved_dirs.get(folder)
+            entries = None
+            if cached and len(cached) == 4 and cached[0] == mtime and cached[3] - mtime >= _RACY_NS:
+                entries = _restat(self._root, cached[2])
+            if entries is not None:
+                dirs[folder] = (mtime, cached[1], entries, cached[3])
+            else:
+                scanned = time.time_ns()
+                subfolders, entries = [], []
+                with os.scandir(self._root/folder) as it:
+                    for e in it:
+                        path = folder + '/' + e.name if folder else e.name
+                        if e.is_dir():
+                            subfolders.append(path)
+                        else:
+                            st = e.stat()
+                            entries.append((path, st.st_size, st.st_mtime, -1))
+                if (cached and cached[:3] == (mtime, subfolders, entries) and
+                    scanned - mtime < _RACY_NS):
+                    dirs[folder] = cached  # unchanged and still racy
+                else:
+                    dirs[folder] = (mtime, subfolders, entries, scanned)
+            changed = changed or dirs[folder] != cached
+            stack.extend(dirs[folder][1])
+        if saved and not changed and len(dirs) == len(saved_dirs):
+            return saved
+        for folder in sorted(dirs):
+            files.extend(dirs[folder][2])
+        return {'state':dirs, 'files':_files_frame(*zip(*files)) if files else
+                _files_frame([], [], [], [])}
+
+def _close_archives(handles: List[Any]) -> None:
+    """Close the opened archives of a reader."""
+    while handles:
+        handles.pop().close()
+
+class _ArchiveReader(Reader):
+    """The base class of readers keeping an opened archive.
+
+    An archive is opened lazily in each process and each thread, so a reader can
+    be pickled, used in forked workers and read by multiple threads concurrently.
+    A zip file cannot be shared among processes, see https://bugs.python.org/issue39363
+
+    The archives opened in this process are closed by :meth:`close`, or when the
+    reader is garbage collected.
 
     :param root: The root path.
     """
     def __init__(self, root: pathlib.Path):
         super().__init__(root)
-        self._root_fp = zipfile.ZipFile(self._root, 'r')
+        self._reset_handles()
+        self._root_fp  # open it now to fail early on a corrupted archive
+
+    @abc.abstractmethod
+    def _open_archive(self):
+        """Open and return the archive."""
+        pass
+
+    def _reset_handles(self):
+        # Handles inherited from the parent process are left to the parent
+        if getattr(self, '_finalizer', None) is not None:
+            self._finalizer.detach()
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _close_archives, self._handles)
+
+    @property
+    def _root_fp(self):
+        """The archive opened by the current process and thread."""
+        if self._pid != os.getpid():
+            self._reset_handles()
+        fp = getattr(self._local, 'fp', None)
+        if fp is None:
+            fp = self._local.fp = self._open_archive()
+            with self._handles_lock:
+                self._handles.append(fp)
+        return fp
+
+    def close(self) -> None:
+        """Close the archives opened by all threads, which are reopened if read again."""
+        if self._pid != os.getpid():
+            self._reset_handles()
+            return
+        with self._handles_lock:
+            self._local = threading.local()
+            _close_archives(self._handles)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_local', '_handles', '_handles_lock', '_finalizer'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_handles()
+
+class ZipReader(_ArchiveReader):
+    """A data reader to read from a zip file.
+
+    :param root: The root path.
+    """
+    def _open_archive(self):
+        return zipfile.ZipFile(self._root, 'r')
 
     def open(self, path: Union[str, pathlib.Path]):
         return self._root_fp.open(str(path))
 
-    def _list_all(self):
-        filenames = [file.filename for file in self._root_fp.infolist()
-                     if not '__MACOSX' in file.filename and not file.is_dir()]
-        return [pathlib.Path(fn) for fn in filenames]
+    def _file_size(self, path: Union[str, pathlib.Path]) -> int:
+        return self._root_fp.getinfo(str(path)).file_size
+
+    def _update_manifest(self, saved):
+        st = self._root.stat()
+        state = (st.st_size, st.st_mtime_ns)
+        if saved and saved['state'] == state:
+            return saved
+        infos = [info for info in self._root_fp.infolist()
+                 if not '__MACOSX' in info.filename and not info.is_dir()]
+        return {'state':state, 'files':_files_frame(
+            [info.filename for info in infos],
+            [info.file_size for info in infos],
+            [time.mktime(info.date_time + (0, 0, -1)) for info in infos],
+            [info.header_offset for info in infos])}
 
-class TarReader(Reader):
+class TarReader(_ArchiveReader):
     """A data reader to read from a tar file.
 
+    Members are located through the offsets saved in :meth:`manifest`, so opening a
+    member doesn't scan the archive. It is O(1) for an uncompressed tar file, while
+    a compressed one needs to decompress all data before the member. Use
+    :meth:`decompress` to convert it once for fast random access.
+
     :param root: The root path.
     """
+    def _open_archive(self):
+        return tarfile.open(self._root, 'r')
+
+    @property
+    def _index(self) -> Dict[str, Any]:
+        """A dict mapping a member name to its (offset, size)."""
+        if getattr(self, '_index_cache', None) is None:
+            files = self.manifest()
+            self._index_cache = dict(zip(files['file_path'], zip(files['offset'], files['size'])))
+        return self._index_cache
+
+    def open(self, path: Union[str, pathlib.Path]):
+        path = str(path)
+        if path not in self._index:
+            raise KeyError(f'{path} is not found in {self._root}')
+        info = tarfile.TarInfo(path)
+        info.offset_data, info.size = (int(x) for x in self._index[path])
+        return self._root_fp.extractfile(info)
+
+    def _file_size(self, path: Union[str, pathlib.Path]) -> int:
+        return int(self._index[str(path)][1])
+
+    def _update_manifest(self, saved):
+        st = self._root.stat()
+        state = (st.st_size, st.st_mtime_ns)
+        if saved and saved['state'] == state:
+            return saved
+        members = [m for m in self._root_fp.getmembers() if m.isfile()]
+        return {'state':state, 'files':_files_frame(
+            [m.name for m in members], [m.size for m in members],
+            [m.mtime for m in members], [m.offset_data for m in members])}
+
+    _MAGICS = {b'\x1f\x8b':gzip.open, b'BZh':bz2.open, b'\xfd7zXZ\x00':lzma.open}
+
+    def _decompressor(self) -> Optional[Callable]:
+        with self._root.open('rb') as f:
+            head = f.read(6)
+        for magic, opener in self._MAGICS.items():
+            if head.startswith(magic):
+                return opener
+        return None
+
+    def decompress(self) -> 'TarReader':
+        """Convert a compressed tar file into an uncompressed one, which is saved
+        next to it, and return a reader to read it.
+
+        It returns this reader if the tar file isn't compressed, and the conversion
+        is skipped if it has been done before. The uncompressed copy takes extra disk
+        space, so this reader is also returned if the free disk space would be less
+        than ``core.downloader.MIN_FREE_SPACE``, or the disk is full.
+        """
+        opener = self._decompressor()
+        if opener is None:
+            return self
+        name = self._root.name
+        for suffix in ('.tgz', '.tbz2', '.txz', '.gz', '.bz2', '.xz'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        tar_path = self._root.parent/(name if name.endswith('.tar') else name+'.tar')
+        if not tar_path.is_file() or tar_path.stat().st_mtime < self._root.stat().st_mtime:
+            size = self._decompressed_size(opener)
+            free = shutil.disk_usage(self._root.parent).free
+            if free - size < core.downloader._get_limits()[1]:
+                logging.warning(f'Read {self._root} without decompressing, {size} bytes '
+                                f'are needed but only {free} bytes are free')
+                return self
+            logging.info(f'Decompressing {self._root} to {tar_path}')
+            tmp_path = tar_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            try:
+                with opener(self._root, 'rb') as fin, tmp_path.open('wb') as fout:
+                    shutil.copyfileobj(fin, fout, 2**23)
+            except OSError as e:
+                if tmp_path.exists(): tmp_path.unlink()
+                logging.warning(f'Read {self._root} without decompressing. {e}')
+                return self
+            os.replace(tmp_path, tar_path)
+        return TarReader(tar_path)
+
+    def _decompressed_size(self, opener: Callable) -> int:
+        """Return a lower bound of the decompressed size, which is exact for a gzip
+        file less than 4GB."""
+        size = self._root.stat().st_size
+        if opener is gzip.open:
+            # the last 4 bytes are the decompressed size modulo 2^32
+            with self._root.open('rb') as f:
+                f.seek(-4, os.SEEK_END)
+                size = max(size, int.from_bytes(f.read(4), 'little'))
+        return size
+class ShardReader(Reader):
+    """A data reader to read from shard files written by :meth:`write`.
+
+    Files are packed into a few large shard files, and located through an index
+    saved in the same folder. Shards are memory mapped, and the data following
+    an opened file are prefetched for sequential reading.
+
+    :param root: The folder containing the shards.
+    """
+    INDEX = 'd8_shards.pkl'
+    # The number of bytes to prefetch after each opened file
+    PREFETCH = 2**24
+
     def __init__(self, root: pathlib.Path):
         super().__init__(root)
-        self._root_fp = tarfile.open(self._root, 'r')
+        if not (self._root/self.INDEX).is_file():
+            raise NameError(f'Not found {self._root/self.INDEX}')
+        index = pd.read_pickle(self._root/self.INDEX)
+        self._shards = sorted(index['shard'].unique().tolist())
+        self._index = dict(zip(index['file_path'], zip(
+            index['shard'], index['offset'], index['size'])))
+        self._reset_mmaps()
+
+    def _reset_mmaps(self):
+        self._pid = os.getpid()
+        self._mmaps: Dict[str, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_mmaps'], state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_mmaps()
+
+    def _mmap(self, shard: str) -> mmap.mmap:
+        if self._pid != os.getpid():
+            self._reset_mmaps()
+        if shard not in self._mmaps:
+            with self._lock:
+                if shard not in self._mmaps:
+                    with (self._root/shard).open('rb') as f:
+                        self._mmaps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmaps[shard]
 
     def open(self, path: Union[str, pathlib.Path]):
-        return self._root_fp.open(str(path))
+        path = str(path)
+        if path not in self._index:
+            raise KeyError(f'{path} is not found in {self._root}')
+        shard, offset, size = self._index[path]
+        offset, size = int(offset), int(size)
+        if size == 0:
+            return io.BytesIO(b'')
+        mm = self._mmap(shard)
+        if hasattr(mm, 'madvise'):
+            start = (offset + size) // mmap.PAGESIZE * mmap.PAGESIZE
+            length = min(self.PREFETCH, len(mm) - start)
+            if length > 0:
+                mm.madvise(mmap.MADV_WILLNEED, start, length)
+        return io.BytesIO(mm[offset:offset+size])
+
+    def _file_size(self, path: Union[str, pathlib.Path]) -> int:
+        return int(self._index[str(path)][2])
+
+    def _update_manifest(self, saved):
+        state = (self._root/self.INDEX).stat().st_mtime_ns
+        if saved and saved['state'] == state:
+            return saved
+        paths = list(self._index)
+        mtimes = [(self._root/shard).stat().st_mtime for shard in self._shards]
+        return {'state':state, 'files':_files_frame(
+            paths, [self._index[p][2] for p in paths],
+            [mtimes[self._shards.index(self._index[p][0])] for p in paths],
+            [self._index[p][1] for p in paths])}
+
+    @classmethod
+    def write(cls, reader: Reader, file_paths: Sequence[Union[str, pathlib.Path]],
+              save_dir: Union[str, pathlib.Path], shard_size: int = 2**30) -> 'ShardReader':
+        """Pack files into shards.
+
+        :param reader: The reader to read the files.
+        :param file_paths: The files to pack, which are saved in this order.
+        :param save_dir: The folder to save the shards.
+        :param shard_size: A new shard is started once the current one exceeds
+            this number of bytes.
+        :return: A reader to read the packed files.
+        """
+        save_dir = pathlib.Path(save_dir)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        rows: List[Dict[str, Any]] = []
+        fout, shard, offset, num_shards = None, '', 0, 0
+        try:
+            for file_path in tqdm.tqdm(file_paths):
+                if fout is None or offset >= shard_size:
+                    if fout: fout.close()
+                    shard, offset = f'shard-{num_shards:05d}.bin', 0
+                    fout = (save_dir/shard).open('wb')
+                    num_shards += 1
+                with reader.open(file_path) as fin:
+                    shutil.copyfileobj(fin, fout, 2**20)
+                size = fout.tell() - offset
+                rows.append({'file_path':str(file_path), 'shard':shard, 'offset':offset, 'size':size})
+                offset += size
+        finally:
+            if fout: fout.close()
+        pd.to_pickle(pd.DataFrame(rows, columns=['file_path', 'shard', 'offset', 'size']),
+                     save_dir/cls.INDEX)
+        return cls(save_dir)
+
+class CompositeReader(Reader):
+    """A data reader over the union of multiple readers.
+
+    By default, the files of all readers share a single namespace, and a path
+    existing in multiple readers is read from the first one. If ``prefixes`` is
+    specified, then the files of the i-th reader are placed under the folder
+    ``prefixes[i]``. A path is dispatched to its reader through a dict index.
+
+    :param readers: The readers.
+    :param prefixes: The folders to place the files of each reader.
+    """
+    def __init__(self, readers: Sequence[Reader], prefixes: Optional[Sequence[str]] = None):
+        if prefixes is not None and len(prefixes) != len(readers):
+            raise ValueError(f'Mismatched {len(readers)} readers and {len(prefixes)} prefixes')
+        self.readers = list(readers)
+        self.prefixes = list(prefixes) if prefixes is not None else None
+        self._root = tuple(getattr(r, '_root', None) for r in self.readers)
+        self._files: Optional[pd.DataFrame] = None
+        self._paths: Dict[str, Tuple[int, str]] = {}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Reader):
+            raise NotImplementedError()
+        return (isinstance(other, CompositeReader) and self.readers == other.readers
+                and self.prefixes == other.prefixes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_files'], state['_paths'] = None, {}
+        return state
+
+    def manifest(self) -> pd.DataFrame:
+        # Each reader caches its own manifest, only the merged index is kept here.
+        if self._files is None:
+            frames = []
+            for i, reader in enumerate(self.readers):
+                files = reader.manifest().copy()
+                files['reader'] = i
+                files['inner_path'] = files['file_path']
+                if self.prefixes is not None:
+                    files['file_path'] = self.prefixes[i] + '/' + files['file_path']
+                frames.append(files)
+            files = pd.concat(frames, ignore_index=True).drop_duplicates('file_path')
+            self._paths = dict(zip(files['file_path'], zip(files['reader'], files['inner_path'])))
+            self._files = files.drop(columns=['reader', 'inner_path']).reset_index(drop=True)
+        return self._files
 
-    def _list_all(self):
-        return [pathlib.Path(fn) for fn in self._root_fp.getmembers()]
+    def _update_manifest(self, saved):
+        return {'state':None, 'files':self.manifest()}
+
+    def _locate(self, path: Union[str, pathlib.Path]) -> Tuple[Reader, str]:
+        self.manifest()
+        key = pathlib.PurePath(path).as_posix()
+        if key not in self._paths:
+            raise KeyError(f'{path} is not found in {self._root}')
+        i, inner = self._paths[key]
+        return self.readers[i], inner
+
+    def open(self, path: Union[str, pathlib.Path]):
+        reader, inner = self._locate(path)
+        return reader.open(inner)
+
+    def _file_size(self, path: Union[str, pathlib.Path]) -> int:
+        reader, inner = self._locate(path)
+        return reader._file_size(inner)
+
+# Whether create_reader extracts downloaded archives, set it by ``d8.core.EXTRACT_ARCHIVES``.
+# If False, a dataset is read directly from the downloaded archive, which saves the
+# extraction time before the first sample can be read, and the disk space of zip
+# and uncompressed tar files. A compressed tar file is still decompressed into a
+# second, uncompressed copy unless the disk space is not enough.
+EXTRACT_ARCHIVES = True
+
+def _archive_type(path: pathlib.Path) -> Optional[str]:
+    """Return ``'zip'`` or ``'tar'`` by the content of a file, where a tar file
+    may be compressed by gzip, bzip2 or xz, or None if it is not an archive."""
+    if not path.is_file():
+        return None
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    try:
+        if tarfile.is_tarfile(path):
+            return 'tar'
+    except (OSError, EOFError, tarfile.TarError):
+        pass
+    return None
 
 def create_reader(data_path: Union[str, Sequence[str]],
-                  name : Optional[str] = None) -> Reader:
+                  name : Optional[str] = None, extract: Optional[bool] = None) -> Reader:
     """Create a data reader.
 
-    :param data_path: Either local or remote.
+    :param data_path: Either local or remote, or a list of them, which are read
+        through a :class:`CompositeReader`.
+    :param name: The dataset name to save the remote data.
+    :param extract: Whether to extract a downloaded archive, the default value is
+        ``core.EXTRACT_ARCHIVES``. If False, an archive reader is returned for it,
+        and a compressed tar file is decompressed next to it for fast random access,
+        which costs the disk space of an uncompressed copy. If the disk space is not
+        enough, then the compressed file is read, and random access is slow.
     :return: The created data reader
     """
+    extract = core.EXTRACT_ARCHIVES if extract is None else extract
     paths = listify(data_path)
-    local_paths = [(pathlib.Path(p) if pathlib.Path(p).exists() else core.download(
-        str(p), name, extract=True)) for p in paths]
-    local_paths = list(set(local_paths))
+    local_paths = []
+    for p in paths:
+        if pathlib.Path(p).exists():
+            local_paths.append(pathlib.Path(p))
+            continue
+        path = core.download(str(p), name, extract=extract)
+        if not extract and _archive_type(path) is None:
+            path = path.parent
+        local_paths.append(path)
+    local_paths = list(dict.fromkeys(local_paths))
     if len(local_paths) == 0:
         return EmptyReader()
     if len(local_paths) > 1:
-        raise NotImplementedError()
+        return CompositeReader([create_reader(str(p), name, extract) for p in local_paths])
     path = local_paths[0]
     if path.is_dir():
+        if (path/ShardReader.INDEX).is_file():
+            return ShardReader(path)
         return FolderReader(path)
-    if path.suffix == '.zip':
+    archive = _archive_type(path)
+    if archive == 'zip':
         return ZipReader(path)
-    if path.suffix in ['.tar', '.tgz', '.gz']:
-        return TarReader(path)
+    if archive == 'tar':
+        reader = TarReader(path)
+        return reader if extract else reader.decompress()
+    if not extract:
+        return FolderReader(path.parent)
     raise ValueError(f'Not support {path}')
 
+async def create_reader_async(data_path: Union[str, Sequence[str]], name : Optional[str] = None,
+                              extract: Optional[bool] = None) -> Reader:
+    """The asyncio version of :func:`create_reader`.
+
+    Remote data are downloaded concurrently by :func:`download_async`, and the
+    reader is then created in a thread, so the event loop is never blocked.
+    """
+    extract = core.EXTRACT_ARCHIVES if extract is None else extract
+    async def local_path(p):
+        if pathlib.Path(p).exists(): return pathlib.Path(p)
+        path = await core.download_async(str(p), name, extract=extract)
+        if not extract and _archive_type(path) is None:
+            path = path.parent
+        return path
+    local_paths = await asyncio.gather(*[local_path(p) for p in listify(data_path)])
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(create_reader, [str(p) for p in local_paths], name, extract))
+
+import pickle
+import tempfile
 import unittest
+from unittest.mock import patch
+
+def _read_member(reader_and_path):
+    reader, path = reader_and_path
+    with reader.open(path) as f:
+        return f.read()
 
 class TestListify(unittest.TestCase):
     def test_listify(self):
@@ -228,6 +879,268 @@ class TestReader(unittest.TestCase):
             lines = f.readlines()
             self.assertEqual(len(lines), 151)
 
+    def test_no_extract(self):
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmp:
+            zip_path = pathlib.Path(tmp)/'data.zip'
+            with zipfile.ZipFile(zip_path, 'w') as f:
+                f.writestr('a/1.txt', b'1')
+            with patch.object(core, 'download', return_value=zip_path) as download, \
+                patch.object(core, 'EXTRACT_ARCHIVES', False):
+                r = create_reader('https://example.com/data.zip', 'test')
+                download.assert_called_once_with('https://example.com/data.zip', 'test', extract=False)
+                self.assertEqual(type(r), ZipReader)
+                self.assertEqual(r.list_files(), [pathlib.Path('a/1.txt')])
+            csv_path = pathlib.Path(tmp)/'data.csv'
+            csv_path.write_text('a,b')
+            with patch.object(core, 'download', return_value=csv_path):
+                r = create_reader('https://example.com/data.csv', extract=False)
+                self.assertEqual(type(r), FolderReader)
+                self.assertEqual(r._root, pathlib.Path(tmp))
+            # Detected by the content instead of the suffix
+            gz_path = pathlib.Path(tmp)/'data.csv.gz'
+            with gzip.open(gz_path, 'wb') as f:
+                f.write(b'a,b')
+            with patch.object(core, 'download', return_value=gz_path):
+                r = create_reader('https://example.com/data.csv.gz', extract=False)
+                self.assertEqual(type(r), FolderReader)
+                self.assertEqual(r._root, pathlib.Path(tmp))
+            self.assertEqual(type(create_reader(str(gz_path), extract=False)), FolderReader)
+            for suffix, mode in (('.tar.bz2', 'w:bz2'), ('.tar.xz', 'w:xz')):
+                tar_path = pathlib.Path(tmp)/('data'+suffix)
+                with tarfile.open(tar_path, mode) as f:
+                    f.add(csv_path, 'a/data.csv')
+                with patch.object(core, 'download', return_value=tar_path):
+                    r = create_reader('https://example.com/data'+suffix, extract=False)
+                self.assertEqual(type(r), TarReader)
+                self.assertEqual(r._root, pathlib.Path(tmp)/'data.tar')
+                self.assertEqual(r.list_files(), [pathlib.Path('a/data.csv')])
+
+    def test_create_reader_async(self):
+        import asyncio
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {}
+            paths['a.zip'] = pathlib.Path(tmp)/'a.zip'
+            with zipfile.ZipFile(paths['a.zip'], 'w') as f:
+                f.writestr('a.txt', b'1')
+            paths['b.csv'] = pathlib.Path(tmp)/'b.csv'
+            paths['b.csv'].write_text('a,b')
+            async def download_async(url, name, extract):
+                await asyncio.sleep(0.01)
+                return paths[url.split('/')[-1]]
+            with patch.object(core, 'download_async', side_effect=download_async):
+                r = asyncio.run(create_reader_async('https://example.com/a.zip', extract=False))
+                self.assertEqual(type(r), ZipReader)
+                r = asyncio.run(create_reader_async('https://example.com/b.csv', extract=False))
+                self.assertEqual(type(r), FolderReader)
+
+    def test_composite_reader(self):
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            (root/'a').mkdir()
+            (root/'a'/'1.txt').write_bytes(b'1')
+            (root/'a'/'2.txt').write_bytes(b'2')
+            with zipfile.ZipFile(root/'b.zip', 'w') as f:
+                f.writestr('2.txt', b'x')
+                f.writestr('c/3.txt', b'3')
+            r = create_reader([str(root/'a'), str(root/'b.zip')])
+            self.assertEqual(type(r), CompositeReader)
+            self.assertEqual(r.list_files(), [pathlib.Path(p) for p in ('1.txt', '2.txt', 'c/3.txt')])
+            for path, data in (('2.txt', b'2'), ('c/3.txt', b'3'), (pathlib.Path('c/3.txt'), b'3')):
+                with r.open(path) as f:
+                    self.assertEqual(f.read(), data)
+            self.assertEqual(r._file_size('c/3.txt'), 1)
+            with self.assertRaises(KeyError):
+                r.open('3.txt')
+            r = pickle.loads(pickle.dumps(r))
+            self.assertEqual(r, CompositeReader([FolderReader(root/'a'), ZipReader(root/'b.zip')]))
+            r = CompositeReader(r.readers, ['x', 'y'])
+            self.assertEqual(len(r.list_files()), 4)
+            with r.open('y/2.txt') as f:
+                self.assertEqual(f.read(), b'x')
+
+    def test_get_image_info(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            (root/'a').mkdir()
+            PIL.Image.new('RGB', (40, 30)).save(root/'a'/'1.jpg')
+            PIL.Image.new('L', (20, 50)).save(root/'2.png')
+            with zipfile.ZipFile(root/'images.zip', 'w') as f:
+                f.write(root/'a'/'1.jpg', 'a/1.jpg')
+                f.write(root/'2.png', '2.png')
+            for reader in (FolderReader(root), ZipReader(root/'images.zip')):
+                df = reader.get_image_info(['a/1.jpg', '2.png'], num_workers=2)
+                self.assertEqual(df['width'].tolist(), [40, 20])
+                self.assertEqual(df['height'].tolist(), [30, 50])
+                self.assertEqual(df['size (KB)'].tolist(),
+                                 [(root/'a'/'1.jpg').stat().st_size/2**10,
+                                  (root/'2.png').stat().st_size/2**10])
+
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            (root/'a'/'b').mkdir(parents=True)
+            for fn in ('1.jpg', 'a/2.PNG', 'a/b/3.txt'):
+                (root/fn).write_bytes(b'123')
+            reader = FolderReader(root)
+            self.assertEqual(sorted(reader.list_files()),
+                             [pathlib.Path(p) for p in ('1.jpg', 'a/2.PNG', 'a/b/3.txt')])
+            self.assertEqual(reader.list_images(), [pathlib.Path('1.jpg'), pathlib.Path('a/2.PNG')])
+            self.assertEqual(reader.list_files(['.txt'], ['a']), [pathlib.Path('a/b/3.txt')])
+            saved = pd.read_pickle(reader._manifest_path())
+            self.assertIs(reader._update_manifest(saved), saved)
+            # changes are picked up by a new reader through the saved manifest
+            (root/'a'/'b'/'4.txt').write_bytes(b'1234')
+            (root/'1.jpg').unlink()
+            self.assertEqual(sorted(FolderReader(root).list_files()),
+                             [pathlib.Path(p) for p in ('a/2.PNG', 'a/b/3.txt', 'a/b/4.txt')])
+            self.assertEqual(reader.manifest()['size'].sum(), 10)
+            # a file rewritten in place, and a file added in the same mtime tick
+            past = time.time_ns() - 10 * _RACY_NS
+            for folder in (root, root/'a', root/'a'/'b'):
+                os.utime(folder, ns=(past, past))
+            self.assertEqual(reader.manifest()['size'].sum(), 10)
+            (root/'a'/'2.PNG').write_bytes(b'12345')
+            self.assertEqual(reader.manifest()['size'].sum(), 12)
+            now = time.time_ns()
+            os.utime(root/'a', ns=(now, now))
+            self.assertEqual(reader.manifest()['size'].sum(), 12)
+            (root/'a'/'5.txt').write_bytes(b'1')
+            os.utime(root/'a', ns=(now, now))
+            self.assertEqual(reader.manifest()['size'].sum(), 13)
+            (root/'a'/'5.txt').unlink()
+
+            with tarfile.open(root/'a.tar', 'w') as f:
+                f.add(root/'a', 'a')
+            reader = TarReader(root/'a.tar')
+            self.assertEqual(sorted(reader.list_files()),
+                             [pathlib.Path(p) for p in ('a/2.PNG', 'a/b/3.txt', 'a/b/4.txt')])
+            self.assertEqual(reader.open('a/b/4.txt').read(), b'1234')
+
+    def test_archive_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            contents = {f'{i}.txt': str(i).encode()*1000 for i in range(20)}
+            with zipfile.ZipFile(root/'a.zip', 'w') as zf, tarfile.open(root/'a.tar', 'w') as tf:
+                for fn, data in contents.items():
+                    zf.writestr(fn, data)
+                    info = tarfile.TarInfo(fn)
+                    info.size = len(data)
+                    tf.addfile(info, io.BytesIO(data))
+            for reader in (ZipReader(root/'a.zip'), TarReader(root/'a.tar')):
+                reader = pickle.loads(pickle.dumps(reader))
+                tasks = [(reader, fn) for fn in contents] * 5
+                with concurrent.futures.ThreadPoolExecutor(8) as pool:
+                    self.assertEqual(list(pool.map(_read_member, tasks)),
+                                     list(contents.values()) * 5)
+                with concurrent.futures.ProcessPoolExecutor(2) as pool:
+                    self.assertEqual(list(pool.map(_read_member, tasks)),
+                                     list(contents.values()) * 5)
+                # every handle opened by the threads is closed
+                handles = list(reader._handles)
+                self.assertGreater(len(handles), 1)
+                reader.close()
+                self.assertEqual(reader._handles, [])
+                self.assertEqual(_read_member((reader, '1.txt')), contents['1.txt'])
+                handles += reader._handles
+                del reader, tasks
+                for fp in handles:
+                    self.assertTrue(fp.fp is None if isinstance(fp, zipfile.ZipFile) else fp.closed)
+
+    def test_tar_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            contents = {f'a/{i}.txt': str(i).encode()*(i+1) for i in range(10)}
+            with tarfile.open(root/'a.tar.gz', 'w:gz') as f:
+                for fn, data in contents.items():
+                    info = tarfile.TarInfo(fn)
+                    info.size = len(data)
+                    f.addfile(info, io.BytesIO(data))
+            # the index is built once by scanning the archive
+            TarReader(root/'a.tar.gz').list_files()
+            TarReader(root/'a.tar.gz').decompress().list_files()
+            with patch.object(tarfile.TarFile, 'getmembers', side_effect=AssertionError):
+                for reader in (TarReader(root/'a.tar.gz'), TarReader(root/'a.tar.gz').decompress()):
+                    for fn in reversed(list(contents)):
+                        self.assertEqual(reader.open(fn).read(), contents[fn])
+                        self.assertEqual(reader._file_size(fn), len(contents[fn]))
+            self.assertTrue((root/'a.tar').is_file())
+            self.assertEqual(TarReader(root/'a.tar').decompress()._root, root/'a.tar')
+            # read compressed if the disk space is not enough
+            (root/'a.tar').unlink()
+            self.assertEqual(TarReader(root/'a.tar.gz')._decompressed_size(gzip.open),
+                             len(gzip.decompress((root/'a.tar.gz').read_bytes())))
+            with patch.object(core.downloader, 'MIN_FREE_SPACE', 2**62):
+                reader = TarReader(root/'a.tar.gz').decompress()
+            self.assertEqual(reader._root, root/'a.tar.gz')
+            self.assertFalse((root/'a.tar').exists())
+            self.assertEqual(reader.open('a/1.txt').read(), contents['a/1.txt'])
+
+    def test_shard_reader(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            (root/'data'/'a').mkdir(parents=True)
+            contents = {f'a/{i}.txt': str(i).encode()*(i*100) for i in range(10)}
+            for fn, data in contents.items():
+                (root/'data'/fn).write_bytes(data)
+            ShardReader.write(FolderReader(root/'data'), list(contents), root/'shards', 2000)
+            reader = create_reader(root/'shards')
+            self.assertEqual(type(reader), ShardReader)
+            self.assertGreater(len(list((root/'shards').glob('*.bin'))), 1)
+            self.assertEqual(sorted(reader.list_files()), sorted(pathlib.Path(p) for p in contents))
+            reader = pickle.loads(pickle.dumps(reader))
+            for fn, data in contents.items():
+                self.assertEqual(reader.open(fn).read(), data)
+                self.assertEqual(reader._file_size(pathlib.Path(fn)), len(data))
+
+    def test_image_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            for i in range(3):
+                PIL.Image.new('RGB', (10, 10), (i, i, i)).save(root/f'{i}.png')
+            reader = FolderReader(root)
+            reader.image_cache = ImageCache(max_bytes=600, cache_dir=root/'cache')
+            with patch.object(reader, 'open', wraps=reader.open) as mock_open:
+                for _ in range(2):
+                    for i in range(3):
+                        img = reader.read_image(f'{i}.png')
+                        self.assertEqual(np.asarray(img)[0, 0].tolist(), [i, i, i])
+                # the 2nd epoch is read from memory or disk
+                self.assertEqual(mock_open.call_count, 3)
+                # two 300-byte images fit into the memory budget
+                self.assertEqual(len(reader.image_cache), 2)
+            self.assertEqual(len(list((root/'cache').glob('*.npy'))), 3)
+            # a new process loads from disk
+            reader = pickle.loads(pickle.dumps(reader))
+            self.assertEqual(len(reader.image_cache), 0)
+            with patch.object(reader, 'open', side_effect=AssertionError):
+                self.assertEqual(reader.read_image('1.png').size, (10, 10))
+
+    def test_read_image(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            PIL.Image.new('RGB', (800, 600), (200, 100, 0)).save(root/'rgb.jpg')
+            PIL.Image.new('CMYK', (800, 600)).save(root/'cmyk.jpg')
+            PIL.Image.new('L', (600, 800)).save(root/'gray.jpg')
+            PIL.Image.new('P', (800, 600)).save(root/'palette.png')
+            reader = FolderReader(root)
+            for fn in ('rgb.jpg', 'cmyk.jpg', 'gray.jpg', 'palette.png'):
+                img = reader.read_image(fn)
+                self.assertEqual(img.mode, 'RGB')
+                w, h = img.size
+                self.assertEqual(reader.read_image(fn, max_width=100).size, (100, round(h*100/w)))
+                self.assertEqual(reader.read_image(fn, max_width=100, max_height=50).size, (round(w*50/h), 50))
+                self.assertEqual(reader.read_image(fn, max_width=1000).size, (w, h))
+                self.assertEqual(reader.read_image(fn, size=300).size,
+                                 (400, 300) if w > h else (300, 400))
+                self.assertEqual(reader.read_image(fn, size=(64, 32)).size, (64, 32))
+            jpeg = PIL.JpegImagePlugin.JpegImageFile
+            with patch.object(jpeg, 'draft', autospec=True, side_effect=jpeg.draft) as draft:
+                reader.read_image('rgb.jpg', max_width=100)
+                self.assertEqual(draft.call_args[0][1:], ('RGB', (100, 75)))
+
     def test_equal(self):
         a = create_reader('/')
         b = create_reader('/')
@@ -4,16 +4,38 @@
 
 #@save_all
 #@hide_all
+import concurrent.futures
+import dataclasses
 import pathlib
 import pandas as pd
 from matplotlib import pyplot as plt
-from typing import Union, Sequence, Callable, Optional
+from typing import Union, Sequence, Callable, List, Optional, Tuple
 import fnmatch
 import numpy as np
+import tempfile
 import unittest
+from unittest.mock import patch
+import PIL
 
 from d8 import core
 
+@dataclasses.dataclass
+class SampleTable:
+    """The examples of an image classification dataset in columnar arrays.
+
+    :ivar paths: The unique image file paths.
+    :ivar path_idx: The index into ``paths`` of each example.
+    :ivar labels: The index into ``classes`` of each example.
+    :ivar classes: The class names.
+    """
+    paths: np.ndarray
+    path_idx: np.ndarray
+    labels: np.ndarray
+    classes: List[str]
+
+    def __len__(self):
+        return len(self.path_idx)
+
 class Dataset(core.BaseDataset):
     """The class of an image classification dataset."""
     def __init__(self, df: pd.DataFrame, reader: core.Reader):
@@ -53,11 +75,54 @@ class Dataset(core.BaseDataset):
                                  'size (GB)':img_df['size (KB)'].sum()/2**20,}])
 
     def __getitem__(self, idx):
-        if idx < 0 or idx > self.__len__():
+        if idx < 0 or idx >= self.__len__():
             raise IndexError(f'index {idx} out of range [0, {self.__len__()})')
-        file_path = self.df['file_path'][idx]
-        img = self.reader.read_image(file_path)
-        return np.array(img), self.df['class_name'][idx]
+        table = self.freeze()
+        img = self.reader.read_image(table.paths[table.path_idx[idx]])
+        return np.array(img), table.classes[table.labels[idx]]
+
+    def _freeze(self) -> SampleTable:
+        classes = self.classes
+        path_idx, paths = pd.factorize(self.df['file_path'])
+        labels = pd.Categorical(self.df['class_name'], categories=classes).codes
+        return SampleTable(np.asarray(paths, dtype=object), path_idx.astype(np.int32),
+                           labels.astype(np.int32), classes)
+
+    def get_batch(self, indices: Sequence[int],
+                  size: Optional[Tuple[int, int]] = None,
+                  dtype: np.dtype = np.uint8,
+                  num_workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Read a batch of examples.
+
+        Images are decoded by a thread pool into a preallocated array.
+
+        :param indices: The positions of the examples.
+        :param size: The (width, height) to resize all images to. If None, all images
+            should have the same size.
+        :param dtype: The data type of the returned images.
+        :param num_workers: The number of threads to decode images.
+        :return: An array of images with shape (N, height, width, 3) and an int64
+            array with N class indices in :attr:`classes`.
+        """
+        table = self.freeze()
+        indices = np.asarray(indices, dtype=np.int64)
+        file_paths = table.paths[table.path_idx[indices]]
+        width, height = size if size else (0, 0)
+        first = None
+        if size is None and len(indices):
+            # The first image gives the size, and is reused instead of decoded again
+            first = self.reader.read_image(file_paths[0])
+            width, height = first.size
+        images = np.empty((len(indices), height, width, 3), dtype=dtype)
+        def read(i):
+            img = first if i == 0 and first is not None else self.reader.read_image(file_paths[i], size=size)
+            if img.size != (width, height):
+                raise ValueError(f'{file_paths[i]} has size {img.size}, which is '
+                                 f'different to {(width, height)}. You may specify `size`.')
+            images[i] = np.asarray(img)
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+            list(pool.map(read, range(len(indices))))
+        return images, table.labels[indices].astype(np.int64)
 
     def to_mxnet(self):
         """Returns a MXNet dataset instance"""
@@ -65,19 +130,19 @@ class Dataset(core.BaseDataset):
 
         class MXDataset(mx.gluon.data.Dataset):
             def __init__(self, dataset):
-                self.data = dataset
-                self.label_to_idx = {n:i for i, n in enumerate(self.data.classes)}
-                self.classes = dataset.classes
+                self.reader = dataset.reader
+                self.table = dataset.freeze()
+                self.classes = self.table.classes
 
             def __getitem__(self, idx):
-                file_path = self.data.df['file_path'][idx]
-                img = self.data.reader.read_image(file_path)
+                file_path = self.table.paths[self.table.path_idx[idx]]
+                img = self.reader.read_image(file_path)
                 img = mx.nd.array(img)
-                label = self.label_to_idx[self.data.df['class_name'][idx]]
-                return img, label
+                return img, int(self.table.labels[idx])
 
             def __len__(self):
-                return len(self.data.df)
+                return len(self.table)
+
         return MXDataset(self)
 
     @classmethod
@@ -118,6 +183,37 @@ class Dataset(core.BaseDataset):
 
 class TestDataset(unittest.TestCase):
 
+    def test_get_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            for i, (cls, size) in enumerate([('cat', (20, 10)), ('dog', (30, 20)), ('cat', (20, 10))]):
+                (root/cls).mkdir(exist_ok=True)
+                PIL.Image.new('RGB', size, (i, i, i)).save(root/cls/f'{i}.png')
+            ds = Dataset.from_folders(tmp, '.')
+            self.assertEqual(ds.classes, ['cat', 'dog'])
+            order = [str(p) for p in ds.df['file_path']]
+            images, labels = ds.get_batch([2, 0, 1], size=(8, 6), dtype=np.float32)
+            self.assertEqual(images.shape, (3, 6, 8, 3))
+            self.assertEqual(images.dtype, np.float32)
+            for img, lbl, i in zip(images, labels, [2, 0, 1]):
+                self.assertEqual(ds.classes[lbl], order[i].split('/')[0])
+                self.assertEqual(img[0, 0, 0], float(order[i].split('/')[1][0]))
+            cats = [i for i, p in enumerate(order) if p.startswith('cat')]
+            with patch.object(ds.reader, 'read_image', wraps=ds.reader.read_image) as read_image:
+                images, _ = ds.get_batch(cats)
+                self.assertEqual(read_image.call_count, 2)
+            self.assertEqual(images.shape, (2, 10, 20, 3))
+            with self.assertRaises(ValueError):
+                ds.get_batch([0, 1, 2])
+
+            table = ds.freeze()
+            self.assertEqual(len(table), 3)
+            self.assertEqual([str(p) for p in table.paths[table.path_idx]], order)
+            self.assertEqual([table.classes[l] for l in table.labels], ds.df['class_name'].tolist())
+            img, class_name = ds[2]
+            self.assertEqual(img.shape, (20, 30, 3))
+            self.assertEqual(class_name, 'dog')
+
     def test_from_folders(self):
         Dataset.add('chessman_test', Dataset.from_folders,
                      ['https://www.kaggle.com/niteshfre/chessman-image-dataset', '*'])
@@ -137,9 +233,6 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(len(ds.df), 5172)
         self.assertEqual(len(ds.classes), 45)
 
-
-
-
-
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
+
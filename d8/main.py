@@ -6,6 +6,8 @@ import pathlib
 import logging
 import importlib
 
+from d8 import core
+
 TASK_TYPES = ['image_classification', 'object_detection', 'tabular_classification']
 
 message = '''
@@ -47,6 +49,57 @@ def generate_built_in_desc(task_type: str):
             f.write(name+'\n')
         f.write('\n\n```')
 
+def prefetch(argv):
+    parser = argparse.ArgumentParser(prog='d8 prefetch', description='Download and construct datasets concurrently.')
+    parser.add_argument('names', nargs='*', help='dataset names, the default is all datasets of the tasks')
+    parser.add_argument('--task', choices=TASK_TYPES, action='append', help='the task types, the default is all')
+    parser.add_argument('--workers', type=int, default=4, help='number of datasets to prefetch concurrently')
+    parser.add_argument('--max-rate', type=float, help='maximal total download rate in MB/s')
+    parser.add_argument('--min-free', type=float, default=0, help='minimal free disk space to keep in GB')
+    args = parser.parse_args(argv)
+
+    datasets = []
+    for tt in args.task or TASK_TYPES:
+        mod = importlib.import_module('d8.'+tt)
+        names = mod.Dataset.list() # type: ignore
+        datasets += [(mod.Dataset, name) for name in (args.names or names) if name in names] # type: ignore
+    unknown = set(args.names) - set(name for _, name in datasets)
+    if unknown:
+        logging.warning(f'Not found datasets: {sorted(unknown)}')
+    max_rate = args.max_rate * 2**20 if args.max_rate else None
+    status = core.prefetch(datasets, args.workers, max_rate, int(args.min_free * 2**30))
+    print(status.to_string(index=False))
+    if (status['error'] != '').any():
+        sys.exit(1)
+
+def verify(argv):
+    parser = argparse.ArgumentParser(prog='d8 verify', description='Fully rehash downloaded files to detect corruption.')
+    parser.add_argument('names', nargs='*', help='dataset names, the default is all downloaded datasets')
+    args = parser.parse_args(argv)
+    corrupted = []
+    for name in (args.names or ['']):
+        corrupted += core.verify(name)
+    for path in corrupted:
+        print(path)
+    if corrupted:
+        sys.exit(1)
+
+def cache(argv):
+    parser = argparse.ArgumentParser(prog='d8 cache', description='Manage the datasets cached in core.DATAROOT.')
+    parser.add_argument('action', nargs='?', default='list', choices=['list', 'evict', 'pin', 'unpin'])
+    parser.add_argument('names', nargs='*', help='dataset names to pin or unpin')
+    parser.add_argument('--quota', type=float, help='the quota in GB to evict datasets, the default is D8_QUOTA_GB')
+    args = parser.parse_args(argv)
+    if args.action == 'evict':
+        quota = int(args.quota * 2**30) if args.quota is not None else None
+        print(core.enforce_quota(quota).to_string(index=False))
+    for name in args.names:
+        if args.action == 'pin': core.pin(name)
+        if args.action == 'unpin': core.unpin(name)
+    usage = core.cache_usage()
+    print(usage.to_string(index=False))
+    print(f'Total: {core.cache._total_usage()/2**30:.2f} GB')
+
 def main():
 
 #     parser = argparse.ArgumentParser(description='''
@@ -61,6 +114,14 @@ def main():
     if cmd == 'gen_desc':
         for tt in TASK_TYPES:
             generate_built_in_desc(tt)
+    elif cmd == 'prefetch':
+        prefetch(sys.argv[2:])
+    elif cmd == 'verify':
+        verify(sys.argv[2:])
+    elif cmd == 'cache':
+        cache(sys.argv[2:])
+    elif cmd == 'gc':
+        print(f'Freed {core.gc()/2**30:.2f} GB')
 
 if __name__ == "__main__":
     main()
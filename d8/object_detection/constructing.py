@@ -30,13 +30,10 @@ import pandas as pd
 def stanford_dogs():
     reader = core.create_reader('https://www.kaggle.com/jessicali9530/stanford-dogs-dataset')
     images = reader.list_images()
-    entries = []
-    for img in images:
-        xml_fp = 'annotations/Annotation/'+img.parent.name+'/'+img.stem
-        for label in object_detection.parse_voc_annotation(reader.open(xml_fp)):
-            label.file_path = str(img)
-            entries.append(label)
-    return Dataset(pd.DataFrame(entries), reader)
+    xml_fps = ['annotations/Annotation/'+img.parent.name+'/'+img.stem for img in images]
+    df = object_detection.parse_voc_annotations(reader, xml_fps)
+    df['file_path'] = pd.Series([str(img) for img in images]).values[df.pop('xml_index')]
+    return Dataset(df, reader)
 
 
 #@save_cell
@@ -4,13 +4,18 @@
 
 #@save_all
 #@hide_all
+import array
 import collections
+import concurrent.futures
+import copy
 import dataclasses
+import io
+import json
 import logging
 import pathlib
-import random
-from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import PIL
 from matplotlib import pyplot as plt
@@ -67,23 +72,342 @@ def parse_voc_annotation(xml_fp) -> List[BBox]:
     return labels
 
 
+def _voc_text(node) -> str:
+    return '' if node is None else node.text.strip()
+
+def _project_boxes(boxes: np.ndarray, source: Callable[[int], Any]) -> np.ndarray:
+    """Project normalized boxes with shape (N, 4) into the image in place.
+
+    :param boxes: Rows of ``[xmin, ymin, xmax, ymax]``.
+    :param source: Return where the i-th box comes from, used in the warning.
+    :return: The boolean mask of valid boxes. A warning is logged for invalid ones.
+    """
+    boxes[:, :2] = np.maximum(boxes[:, :2], 0)
+    boxes[:, 2:] = np.minimum(boxes[:, 2:], 1)
+    valid = ((boxes >= 0).all(axis=1) & (boxes <= 1).all(axis=1) &
+             (boxes[:, 0] <= boxes[:, 2]) & (boxes[:, 1] <= boxes[:, 3]))
+    if not valid.all():
+        i = np.flatnonzero(~valid)[0]
+        logging.warning(f'Ignored {(~valid).sum()} invalid bounding boxes, such as '
+                        f'{boxes[i]} in {source(i)}')
+    return valid
+
+def _map_chunks(func: Callable, reader: core.Reader, paths: List, num_workers: int,
+                processes: bool) -> List:
+    """Call ``func(reader, chunk)`` for chunks of paths in parallel."""
+    chunk_size = max(1, min(256, len(paths) // (num_workers * 4)))
+    chunks = [paths[i:i+chunk_size] for i in range(0, len(paths), chunk_size)]
+    pool_cls = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+    with pool_cls(max(1, min(num_workers, len(chunks)))) as pool:
+        return list(pool.map(func, [reader]*len(chunks), chunks))
+
+def _parse_voc_files(reader: core.Reader, xml_paths: Sequence[Union[str, pathlib.Path]]
+                     ) -> Tuple[List[str], np.ndarray, np.ndarray, List[str], np.ndarray]:
+    """Parse VOC annotation files into the image filenames, the number of objects
+    and the image size of each file, the class names and the raw boxes of all objects."""
+    filenames, counts, sizes, class_names, boxes = [], [], [], [], []
+    for xml_path in xml_paths:
+        with reader.open(xml_path) as f:
+            root = ET.parse(f).getroot()
+        filenames.append(_voc_text(root.find('filename')))
+        size = root.find('size')
+        sizes.append((float(_voc_text(size.find('width'))), float(_voc_text(size.find('height')))))
+        count = 0
+        for obj in root.iter('object'):
+            xml_box = obj.find('bndbox')
+            class_names.append(_voc_text(obj.find('name')).lower())
+            boxes.append([float(_voc_text(xml_box.find(k))) for k in ('xmin', 'ymin', 'xmax', 'ymax')])
+            count += 1
+        counts.append(count)
+    return (filenames, np.array(counts, dtype=np.int64), np.array(sizes, dtype=np.float64).reshape(-1, 2),
+            class_names, np.array(boxes, dtype=np.float64).reshape(-1, 4))
+
+def parse_voc_annotations(reader: core.Reader, xml_paths: Sequence[Union[str, pathlib.Path]],
+                          num_workers: int = 8, processes: bool = False) -> pd.DataFrame:
+    """Parse VOC annotation files in parallel.
+
+    Boxes are normalized by the image sizes, projected into the image, and invalid
+    ones are dropped, all vectorized.
+
+    :param reader: The reader to read the files.
+    :param xml_paths: The annotation files.
+    :param num_workers: The number of workers parsing files.
+    :param processes: If True, then use processes instead of threads, which is faster
+        to parse many files as the XML parser holds the GIL.
+    :return: A dataframe with a row for each bounding box, where ``xml_index`` is the
+        index of its annotation file in xml_paths, and ``file_path`` is the image
+        filename saved in the annotation file.
+    """
+    xml_paths = list(xml_paths)
+    results = _map_chunks(_parse_voc_files, reader, xml_paths, num_workers, processes)
+    filenames = [f for r in results for f in r[0]]
+    counts = np.concatenate([r[1] for r in results] + [np.zeros(0, dtype=np.int64)])
+    sizes = np.concatenate([r[2] for r in results] + [np.zeros((0, 2))])
+    class_names = np.array([c for r in results for c in r[3]], dtype=object)
+    boxes = np.concatenate([r[4] for r in results] + [np.zeros((0, 4))])
+
+    xml_index = np.repeat(np.arange(len(xml_paths)), counts)
+    boxes /= np.tile(sizes, 2)[xml_index]
+    valid = _project_boxes(boxes, lambda i: xml_paths[xml_index[i]])
+    boxes = boxes[valid].astype(np.float32)
+    xml_index = xml_index[valid]
+    return pd.DataFrame({'xml_index':xml_index.astype(np.int32),
+                         'file_path':np.array(filenames, dtype=object)[xml_index],
+                         'class_name':pd.Categorical(class_names[valid]),
+                         'xmin':boxes[:, 0], 'ymin':boxes[:, 1],
+                         'xmax':boxes[:, 2], 'ymax':boxes[:, 3]})
+
+def _subfolders(folder: pathlib.Path) -> List[str]:
+    return [str(folder)] if folder.parts else []
+
+def _folders(folders: Union[str, Sequence[str]]) -> List[str]:
+    """Make folders a list, where ``''`` is the root folder instead of no folder."""
+    return [folders] if isinstance(folders, (str, pathlib.PurePath)) else list(folders)
+
+def _join_images(reader: core.Reader, df: pd.DataFrame, image_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """Prefix image filenames in df with image_dir and drop boxes whose images are not found."""
+    image_dir = pathlib.Path(image_dir)
+    imgs = set(str(img) for img in reader.list_images(_subfolders(image_dir)))
+    image_paths = {f:str(image_dir/f) for f in df['file_path'].unique()}
+    df['file_path'] = df['file_path'].map(image_paths)
+    found = df['file_path'].isin(imgs)
+    if not found.all():
+        logging.warning(f'Not found {df["file_path"][~found].nunique()} images, '
+                        f'such as {df["file_path"][~found].iloc[0]}')
+    return df[found].reset_index(drop=True)
+
 def _parse_voc(reader, image_dir, annotation_dir):
-    entries = []
-    annotation_dir = str(pathlib.Path(annotation_dir))
-    image_dir = str(pathlib.Path(image_dir))
     # don't use .is_relative_to as it requires python >= 3.9
-    xmls = [xml for xml in reader.list_files(['.xml'], [annotation_dir])]
-    imgs = set([img for img in reader.list_images([image_dir])])
-    for xml in xmls:
-        labels = parse_voc_annotation(reader.open(xml))
-        if labels:
-            image_path = pathlib.Path(image_dir)/labels[0].file_path
-            if image_path not in imgs:
-                logging.warning(f'Not found image {limage_path}')
-            else:
-                for l in labels: l.file_path = str(image_path)
-                entries.extend(labels)
-    return pd.DataFrame(entries)
+    xmls = reader.list_files(['.xml'], _subfolders(pathlib.Path(annotation_dir)))
+    df = parse_voc_annotations(reader, xmls).drop(columns='xml_index')
+    return _join_images(reader, df, image_dir)
+
+class _JSONStream:
+    """Decode a JSON document incrementally from a text file, so that a large
+    array can be iterated element by element without loading the whole document."""
+    def __init__(self, fp: IO[str], chunk_size: int = 2**20):
+        self._fp, self._chunk_size = fp, chunk_size
+        self._buf, self._pos, self._eof = '', 0, False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof: return False
+        data = self._fp.read(self._chunk_size)
+        self._buf, self._pos, self._eof = self._buf[self._pos:] + data, 0, not data
+        return bool(data)
+
+    def _peek(self) -> str:
+        while True:
+            n = len(self._buf)
+            while self._pos < n and self._buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < n or not self._fill():
+                return self._buf[self._pos:self._pos+1]
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError(f'Expect one of {chars!r} in JSON, but got {c!r}')
+        self._pos += 1
+        return c
+
+    def value(self) -> Any:
+        """Decode the next value."""
+        self._peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill(): raise
+                continue
+            # a number at the end of the buffer may be truncated
+            if end == len(self._buf) and self._fill(): continue
+            self._pos = end
+            return obj
+
+    def items(self) -> Iterator[Any]:
+        """Iterate the elements of the next array."""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._expect(',]') == ']': return
+
+    def keys(self) -> Iterator[str]:
+        """Iterate the keys of the next object. The caller needs to consume each value
+        with :meth:`value` or :meth:`items` before getting the next key."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}': return
+
+def parse_coco_annotations(fp: IO[bytes]) -> pd.DataFrame:
+    """Parse a COCO annotation file incrementally.
+
+    The file is streamed, only the image ids, sizes and box coordinates are kept
+    in compact arrays. Boxes are then normalized and projected vectorized. Crowd
+    annotations are ignored.
+
+    :param fp: The annotation file opened in binary mode.
+    :return: A dataframe with a row for each bounding box, where ``file_path`` is the
+        ``file_name`` of its image.
+    """
+    stream = _JSONStream(io.TextIOWrapper(fp, encoding='utf-8'))
+    image_ids, sizes, file_names = array.array('q'), array.array('d'), []
+    box_image_ids, box_category_ids, boxes = array.array('q'), array.array('q'), array.array('d')
+    category_names: Dict[int, str] = {}
+    for key in stream.keys():
+        if key == 'images':
+            for img in stream.items():
+                image_ids.append(img['id'])
+                sizes.extend((img['width'], img['height']))
+                file_names.append(img['file_name'])
+        elif key == 'annotations':
+            for ann in stream.items():
+                if ann.get('iscrowd') or len(ann.get('bbox', ())) != 4: continue
+                box_image_ids.append(ann['image_id'])
+                box_category_ids.append(ann['category_id'])
+                boxes.extend(ann['bbox'])
+        elif key == 'categories':
+            category_names.update((c['id'], c['name']) for c in stream.items())
+        else:
+            stream.value()
+    classes, category_codes = np.unique(np.array(list(category_names.values()), dtype=object),
+                                        return_inverse=True)
+    image_index = pd.Index(np.array(image_ids, dtype=np.int64)).get_indexer(np.array(box_image_ids, dtype=np.int64))
+    category_index = pd.Index(np.array(list(category_names), dtype=np.int64)).get_indexer(
+        np.array(box_category_ids, dtype=np.int64))
+    found = (image_index >= 0) & (category_index >= 0)
+    if not found.all():
+        logging.warning(f'Ignored {(~found).sum()} bounding boxes with unknown image or category ids')
+    # [x, y, width, height] in pixels to normalized [xmin, ymin, xmax, ymax]
+    xywh = np.array(boxes, dtype=np.float64).reshape(-1, 4)[found]
+    image_index, category_index = image_index[found], category_index[found]
+    xywh[:, 2:] += xywh[:, :2]
+    xywh /= np.tile(np.array(sizes, dtype=np.float64).reshape(-1, 2), 2)[image_index]
+    valid = _project_boxes(xywh, lambda i: file_names[image_index[i]])
+    xyxy = xywh[valid].astype(np.float32)
+    image_index = image_index[valid]
+    return pd.DataFrame({'file_path':np.array(file_names, dtype=object)[image_index],
+                         'class_name':pd.Categorical.from_codes(
+                             category_codes[category_index[valid]], categories=classes),
+                         'xmin':xyxy[:, 0], 'ymin':xyxy[:, 1],
+                         'xmax':xyxy[:, 2], 'ymax':xyxy[:, 3]})
+
+def _parse_yolo_line(line: bytes) -> Optional[List[float]]:
+    """Parse a line of a YOLO label file, return None if it's invalid."""
+    values = line.split()
+    if len(values) != 5:
+        return None
+    try:
+        return [float(v) for v in values]
+    except ValueError:
+        return None
+
+def _parse_yolo_files(reader: core.Reader, txt_paths: Sequence[Union[str, pathlib.Path]]
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse YOLO label files into the number of objects of each file and the rows of
+    ``[class index, x center, y center, width, height]`` of all objects."""
+    counts, rows = [], []
+    for txt_path in txt_paths:
+        with reader.open(txt_path) as f:
+            lines = [_parse_yolo_line(l) for l in f.read().splitlines() if l.strip()]
+        values = [l for l in lines if l is not None]
+        if len(values) < len(lines):
+            logging.warning(f'Ignored {len(lines) - len(values)} lines in {txt_path}, '
+                            'each line should have 5 numbers')
+        counts.append(len(values))
+        rows.append(np.array(values, dtype=np.float64).reshape(-1, 5))
+    return (np.array(counts, dtype=np.int64),
+            np.concatenate(rows + [np.zeros((0, 5))]))
+
+def parse_yolo_annotations(reader: core.Reader, txt_paths: Sequence[Union[str, pathlib.Path]],
+                           class_names: Sequence[str], num_workers: int = 8,
+                           processes: bool = False) -> pd.DataFrame:
+    """Parse YOLO label files in parallel.
+
+    :param reader: The reader to read the files.
+    :param txt_paths: The label files, each line is ``class x_center y_center width height``
+        normalized by the image size.
+    :param class_names: The class names indexed by the class indices.
+    :param num_workers: The number of workers parsing files.
+    :param processes: If True, then use processes instead of threads.
+    :return: A dataframe with a row for each bounding box, where ``txt_index`` is the
+        index of its label file in txt_paths.
+    """
+    txt_paths = list(txt_paths)
+    results = _map_chunks(_parse_yolo_files, reader, txt_paths, num_workers, processes)
+    counts = np.concatenate([r[0] for r in results] + [np.zeros(0, dtype=np.int64)])
+    rows = np.concatenate([r[1] for r in results] + [np.zeros((0, 5))])
+    txt_index = np.repeat(np.arange(len(txt_paths)), counts)
+    class_index = rows[:, 0].astype(np.int64)
+    known = (class_index == rows[:, 0]) & (class_index >= 0) & (class_index < len(class_names))
+    if not known.all():
+        logging.warning(f'Ignored {(~known).sum()} bounding boxes with unknown class indices, '
+                        f'such as {rows[~known][0, 0]} in {txt_paths[txt_index[~known][0]]}')
+    rows, txt_index, class_index = rows[known], txt_index[known], class_index[known]
+    boxes = np.concatenate([rows[:, 1:3] - rows[:, 3:5] / 2, rows[:, 1:3] + rows[:, 3:5] / 2], axis=1)
+    valid = _project_boxes(boxes, lambda i: txt_paths[txt_index[i]])
+    boxes = boxes[valid].astype(np.float32)
+    classes, codes = np.unique(np.array(class_names, dtype=object), return_inverse=True)
+    return pd.DataFrame({'txt_index':txt_index[valid].astype(np.int32),
+                         'class_name':pd.Categorical.from_codes(codes[class_index[valid]], categories=classes),
+                         'xmin':boxes[:, 0], 'ymin':boxes[:, 1],
+                         'xmax':boxes[:, 2], 'ymax':boxes[:, 3]})
+
+def _parse_yolo(reader, image_dir, label_dir, class_names):
+    image_dir, label_dir = pathlib.Path(image_dir), pathlib.Path(label_dir)
+    txts = set(reader.list_files(['.txt'], _subfolders(label_dir)))
+    imgs, labels = [], []
+    for img in reader.list_images(_subfolders(image_dir)):
+        label = label_dir/(img.relative_to(image_dir) if image_dir.parts else img).with_suffix('.txt')
+        if label in txts:
+            imgs.append(str(img))
+            labels.append(label)
+    df = parse_yolo_annotations(reader, labels, class_names)
+    df.insert(0, 'file_path', np.array(imgs, dtype=object)[df.pop('txt_index')])
+    return df
+
+@dataclasses.dataclass
+class SampleTable:
+    """The bounding boxes of an object detection dataset grouped by images.
+
+    The boxes of the i-th image are ``boxes[offsets[i]:offsets[i+1]]``.
+
+    :ivar paths: The unique image file paths.
+    :ivar offsets: An int64 array with ``len(paths)+1`` elements.
+    :ivar boxes: A float32 array with shape (number of boxes, 5), each row is
+        ``[xmin, ymin, xmax, ymax, class index]``.
+    :ivar classes: The class names.
+    :ivar rows: The row position in the dataframe of each box.
+    """
+    paths: np.ndarray
+    offsets: np.ndarray
+    boxes: np.ndarray
+    classes: List[str]
+    rows: np.ndarray
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_boxes(self, idx: int) -> np.ndarray:
+        """Return the boxes of the idx-th image."""
+        return self.boxes[self.offsets[idx]:self.offsets[idx+1]]
+
+    def get_rows(self, indices: np.ndarray) -> np.ndarray:
+        """Return the dataframe row positions of all boxes of the images in indices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts, counts = self.offsets[indices], np.diff(self.offsets)[indices]
+        ends = np.cumsum(counts)
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - ends + counts, counts)
+        return self.rows[positions]
 
 class Dataset(core.BaseDataset):
     """The class of an object detection dataset."""
@@ -91,6 +415,8 @@ class Dataset(core.BaseDataset):
         super().__init__(df, reader, label_name='class_name')
 
     TYPE = 'object_detection'
+    # 2: float32 coordinates and categorical class names
+    CACHE_VERSION = 2
 
     def show(self, layout=(2,4)) -> None:
         """Show several random examples with their labels.
@@ -102,30 +428,30 @@ class Dataset(core.BaseDataset):
         scale = 10 / ncols
         figsize = (ncols * scale, nrows * scale)
         _, axes = plt.subplots(nrows, ncols, figsize=figsize)
-        random.seed(0)
-        samples = random.sample(list(self.df.groupby('file_path')), nrows*ncols)
+        table = self.freeze()
+        samples = np.random.RandomState(0).choice(len(table), min(nrows*ncols, len(table)), replace=False)
+        confidences = self.df['confidence'].to_numpy() if 'confidence' in self.df else None
         colors = ['b', 'g', 'r', 'm', 'c']
-        class_to_color = {c:colors[i%len(colors)] for i, c in enumerate(self.classes)}
-        for ax, sample in zip(axes.flatten(), samples):
-            img = self.reader.read_image(sample[0], max_width=max_width)
+        for ax, idx in zip(axes.flatten(), samples):
+            img = self.reader.read_image(table.paths[idx], max_width=max_width)
             ax.imshow(img, aspect='auto')
             img_width, img_height = img.size
             ax.axis("off")
-            for _, row in sample[1].iterrows():
+            rows = table.rows[table.offsets[idx]:table.offsets[idx+1]]
+            for (xmin, ymin, xmax, ymax, label), row in zip(table.get_boxes(idx), rows):
+                color = colors[int(label)%len(colors)]
                 bbox = plt.Rectangle(
-                    xy=(row['xmin']*img_width, row['ymin']*img_height),
-                    width=(row['xmax']-row['xmin'])*img_width,
-                    height=(row['ymax']-row['ymin'])*img_height,
-                    fill=False, edgecolor=class_to_color[row['class_name']], linewidth=2)
+                    xy=(xmin*img_width, ymin*img_height),
+                    width=(xmax-xmin)*img_width, height=(ymax-ymin)*img_height,
+                    fill=False, edgecolor=color, linewidth=2)
                 ax.add_patch(bbox)
-                class_name = row['class_name']
-                if 'confidence' in row:
+                class_name = table.classes[int(label)]
+                if confidences is not None:
                     # add confidence to the text if available
-                    class_name += f': {float(row["confidence"]):.2f}'
+                    class_name += f': {float(confidences[row]):.2f}'
                 ax.text(bbox.xy[0], bbox.xy[1], class_name,
                       va='center', ha='center', fontsize=7, color='w',
-                      bbox=dict(facecolor=class_to_color[row['class_name']],
-                                lw=0, alpha=1, pad=2))
+                      bbox=dict(facecolor=color, lw=0, alpha=1, pad=2))
 
     def _summary(self):
         """Returns a summary about this dataset."""
@@ -142,6 +468,123 @@ class Dataset(core.BaseDataset):
                                  'bbox height':get_mean_std((merged_df['ymax']-merged_df['ymin'])*merged_df['height']),
                                  'size (GB)':img_df['size (KB)'].sum()/2**20}])
 
+    def __len__(self) -> int:
+        """Return the number of images."""
+        return len(self.freeze())
+
+    def __getitem__(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the idx-th image and its boxes, each row of the boxes is
+        ``[xmin, ymin, xmax, ymax, class index]`` normalized into [0, 1]."""
+        table = self.freeze()
+        if idx < 0 or idx >= len(table):
+            raise IndexError(f'index {idx} out of range [0, {len(table)})')
+        img = self.reader.read_image(table.paths[idx])
+        return np.array(img), table.get_boxes(idx).copy()
+
+    def _select(self, indices: np.ndarray) -> 'Dataset':
+        """Return a new dataset with all boxes of the images in indices."""
+        rows = self.freeze().get_rows(indices)
+        self_df, self.df = self.df, None
+        new_ds = copy.deepcopy(self)
+        self.df = self_df
+        new_ds.df = self_df.iloc[rows].reset_index(drop=True)
+        return new_ds
+
+    def sample(self, n: int, seed: int = 0) -> 'Dataset':
+        """Randomly sample images.
+
+        :param n: The number of images.
+        :param seed: The random seed.
+        :return: A new dataset with all boxes of the n sampled images.
+        """
+        return self._select(np.random.RandomState(seed).choice(len(self), n, replace=False))
+
+    def split(self, frac: Union[float, Sequence[float]], shuffle: bool = True, seed: int = 0) -> List['Dataset']:
+        """Split a dataset by images, all boxes of an image are in the same split.
+
+        :param frac: A fraction, in (0, 1), or a list of fractions of images.
+        :param shuffle: If True (default), then randomly shuffle the images before spliting.
+        :param seed: The random seed (default 0) to shuffle the images given ``shuffle=True``.
+        :return: A list of datasets.
+        """
+        num_images = len(self)
+        order = np.random.RandomState(seed).permutation(num_images) if shuffle else np.arange(num_images)
+        fracs = core.listify(frac)
+        if sum(fracs) >= 1:
+            raise ValueError(f'the sum of frac {sum(fracs)} should be less than 1')
+        if min(fracs) <= 0:
+            raise ValueError(f'frac {min(fracs)} is not in (0, 1)')
+        ends = [int(f * num_images) for f in np.cumsum(fracs)] + [num_images]
+        rets = []
+        for i, (s, e) in enumerate(zip([0] + ends[:-1], ends)):
+            new_ds = self._select(order[s:e])
+            if new_ds.name:
+                new_ds.name += f'.{i}'
+            rets.append(new_ds)
+        return rets
+
+    def _freeze(self) -> SampleTable:
+        classes = self.classes
+        codes, paths = pd.factorize(self.df['file_path'])
+        order = np.argsort(codes, kind='stable')
+        boxes = np.empty((len(self.df), 5), dtype=np.float32)
+        boxes[:, :4] = self.df[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy(dtype=np.float32)
+        boxes[:, 4] = pd.Categorical(self.df['class_name'], categories=classes).codes
+        offsets = np.zeros(len(paths)+1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(paths)), out=offsets[1:])
+        return SampleTable(np.asarray(paths, dtype=object), offsets, boxes[order], classes, order)
+
+    @classmethod
+    def from_coco(cls, data_path: Union[str, Sequence[str]],
+                  annotation_files: Union[str, Sequence[str]],
+                  image_folders: Union[str, Sequence[str]] = ''):
+        """Create a dataset when data are stored in the COCO format.
+
+        :param data_path: Either a URL or a local path. For the former, data will be downloaded automatically.
+        :param annotation_files: The COCO JSON annotation files.
+        :param image_folders: The folders containing the images of each annotation file.
+        :return: The created dataset.
+        """
+        reader = core.create_reader(data_path)
+        annotation_files, image_folders = core.listify(annotation_files), _folders(image_folders)
+        if len(image_folders) == 1:
+            image_folders = image_folders * len(annotation_files)
+        dfs = []
+        for annotation_file, image_folder in zip(annotation_files, image_folders):
+            with reader.open(annotation_file) as f:
+                df = parse_coco_annotations(f)
+            dfs.append(_join_images(reader, df, image_folder))
+        df = pd.concat(dfs, axis=0, ignore_index=True)
+        return cls(df, reader)
+
+    @classmethod
+    def from_yolo(cls, data_path: Union[str, Sequence[str]],
+                  image_folders: Union[str, Sequence[str]],
+                  label_folders: Union[str, Sequence[str]],
+                  class_names: Union[pathlib.Path, Sequence[str]]):
+        """Create a dataset when data are stored in the YOLO format.
+
+        The labels of ``image_folder/x.jpg`` are in ``label_folder/x.txt``.
+
+        :param data_path: Either a URL or a local path. For the former, data will be downloaded automatically.
+        :param image_folders: The folders containing all example images.
+        :param label_folders: The folders containing the label files of each image folder.
+        :param class_names: The class names, or a :class:`pathlib.Path` of the file in
+            data_path with one class name per line. A string is a single class name.
+        :return: The created dataset.
+        """
+        reader = core.create_reader(data_path)
+        if isinstance(class_names, pathlib.PurePath):
+            with reader.open(class_names) as f:
+                class_names = [l.strip() for l in f.read().decode().splitlines() if l.strip()]
+        class_names = core.listify(class_names)
+        dfs = []
+        for image_folder, label_folder in zip(
+            _folders(image_folders), _folders(label_folders)):
+            dfs.append(_parse_yolo(reader, image_folder, label_folder, class_names))
+        df = pd.concat(dfs, axis=0, ignore_index=True)
+        return cls(df, reader)
+
     @classmethod
     def from_voc(cls, data_path: Union[str, Sequence[str]],
                  image_folders: str, annotation_folders: str):
@@ -155,7 +598,7 @@ class Dataset(core.BaseDataset):
         reader = core.create_reader(data_path)
         dfs = []
         for image_folder, annotation_folder in zip(
-            core.listify(image_folders), core.listify(annotation_folders)):
+            _folders(image_folders), _folders(annotation_folders)):
             dfs.append(_parse_voc(reader, image_folder, annotation_folder))
         df = pd.concat(dfs, axis=0, ignore_index=True)
         return cls(df, reader)
@@ -163,31 +606,170 @@ class Dataset(core.BaseDataset):
     def to_mxnet(self):
         """Returns a MXNet dataset instance for object detection"""
         import mxnet as mx
-        import numpy as np
 
         class MXDataset(mx.gluon.data.Dataset):
             def __init__(self, dataset):
-                self.data = list(dataset.df.groupby('file_path'))
                 self.reader = dataset.reader
-                self.classes = dataset.classes
-                self.label_to_idx = {n:i for i, n in enumerate(self.classes)}
+                self.table = dataset.freeze()
+                self.classes = self.table.classes
 
             def __getitem__(self, idx):
-                sample = self.data[idx]
-                filepath = sample[0]
-                img = self.reader.read_image(filepath)
+                img = self.reader.read_image(self.table.paths[idx])
                 img = mx.nd.array(img)
                 width, height = img.shape[1], img.shape[0]
-                label = []
-                for _, row in sample[1].iterrows():
-                    cls_id = float(self.label_to_idx[row['class_name']])
-                    label.append([row['xmin'], row['ymin'], row['xmax'], row['ymax'], cls_id])
-                label = np.array(label)
+                label = self.table.get_boxes(idx).copy()
                 label[:, (0, 2)] *= width
                 label[:, (1, 3)] *= height
                 return img, label
 
             def __len__(self):
-                return len(self.data)
+                return len(self.table)
 
         return MXDataset(self)
+
+import unittest
+
+class TestDataset(unittest.TestCase):
+    def test_parse_voc(self):
+        import tempfile
+        xml = '''<annotation><filename>{}.jpg</filename>
+            <size><width>100</width><height>50</height></size>{}</annotation>'''
+        obj = '''<object><name> {} </name><bndbox><xmin>{}</xmin><ymin>{}</ymin>
+            <xmax>{}</xmax><ymax>{}</ymax></bndbox></object>'''
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            (root/'ann').mkdir()
+            (root/'img').mkdir()
+            for i in range(20):
+                objs = obj.format('Dog', 10, 10, 120, 40) + obj.format('cat', 50, 40, 10, 45)
+                (root/'ann'/f'{i}.xml').write_text(xml.format(i, objs if i else ''))
+                if i < 19:
+                    PIL.Image.new('RGB', (100, 50)).save(root/'img'/f'{i}.jpg')
+            reader = core.create_reader(tmp)
+            xmls = sorted(reader.list_files(['.xml']))
+            for processes in (False, True):
+                df = parse_voc_annotations(reader, xmls, num_workers=2, processes=processes)
+                self.assertEqual(len(df), 19)
+                self.assertEqual(df['class_name'].unique().tolist(), ['dog'])
+                np.testing.assert_allclose(df[['xmin', 'ymin', 'xmax', 'ymax']].iloc[0], [0.1, 0.2, 1, 0.8], rtol=1e-6)
+                self.assertEqual(df['xmin'].dtype, np.float32)
+                expected = [parse_voc_annotation(reader.open(p)) for p in xmls]
+                self.assertEqual(df['xml_index'].tolist(), [i for i, l in enumerate(expected) for _ in l])
+            ds = Dataset.from_voc(tmp, 'img', 'ann')
+            self.assertEqual(len(ds), 18)
+            self.assertEqual(sorted(ds.df['file_path'].unique()), sorted(f'img/{i}.jpg' for i in range(1, 19)))
+
+    def test_json_stream(self):
+        doc = {'info':{'a':[1, {'b':'c'}]}, 'images':[{'id':i, 'x':1.5**i} for i in range(100)],
+               'empty':[], 'annotations':[]}
+        for chunk_size in (1, 7, 2**20):
+            stream = _JSONStream(io.StringIO(json.dumps(doc, indent=1)), chunk_size)
+            parsed = {}
+            for key in stream.keys():
+                parsed[key] = list(stream.items()) if isinstance(doc[key], list) else stream.value()
+            self.assertEqual(parsed, doc)
+
+    def test_parse_coco(self):
+        import tempfile
+        doc = {'images':[{'id':10, 'file_name':'a.jpg', 'width':100, 'height':50},
+                         {'id':11, 'file_name':'b.jpg', 'width':100, 'height':100}],
+               'annotations':[{'image_id':10, 'category_id':3, 'bbox':[10, 10, 120, 30]},
+                              {'image_id':11, 'category_id':1, 'bbox':[50, 50, 10, 20]},
+                              {'image_id':11, 'category_id':1, 'bbox':[50, 50, 10, 20], 'iscrowd':1},
+                              {'image_id':12, 'category_id':1, 'bbox':[0, 0, 1, 1]},
+                              {'image_id':10, 'category_id':1, 'bbox':[120, 0, 10, 10]}],
+               'categories':[{'id':1, 'name':'dog'}, {'id':3, 'name':'cat'}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            (root/'images').mkdir()
+            (root/'train.json').write_text(json.dumps(doc))
+            PIL.Image.new('RGB', (100, 50)).save(root/'images'/'a.jpg')
+            PIL.Image.new('RGB', (100, 100)).save(root/'images'/'b.jpg')
+            with open(root/'train.json', 'rb') as f:
+                df = parse_coco_annotations(f)
+            self.assertEqual(df['file_path'].tolist(), ['a.jpg', 'b.jpg'])
+            self.assertEqual(df['class_name'].tolist(), ['cat', 'dog'])
+            np.testing.assert_allclose(df[['xmin', 'ymin', 'xmax', 'ymax']],
+                                       [[0.1, 0.2, 1, 0.8], [0.5, 0.5, 0.6, 0.7]], rtol=1e-6)
+            ds = Dataset.from_coco(tmp, 'train.json', 'images')
+            self.assertEqual(ds.df['file_path'].tolist(), ['images/a.jpg', 'images/b.jpg'])
+            self.assertEqual(ds.classes, ['cat', 'dog'])
+
+    def test_parse_yolo(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            root = pathlib.Path(tmp)
+            for folder in ('images', 'labels'):
+                (root/folder).mkdir()
+            for i in range(10):
+                PIL.Image.new('RGB', (10, 10)).save(root/'images'/f'{i}.jpg')
+                if i:
+                    (root/'labels'/f'{i}.txt').write_text('1 0.5 0.5 0.2 0.4\n0 0.9 0.1 0.4 0.4\n\n5 0.5 0.5 0.1 0.1\n'
+                                                         + ('0 0.5\n1 x 0.5 0.1 0.1\n' if i == 9 else ''))
+            (root/'classes.txt').write_text('cat\ndog\n')
+            reader = core.create_reader(tmp)
+            txts = sorted(reader.list_files(['.txt'], ['labels']))
+            for processes in (False, True):
+                df = parse_yolo_annotations(reader, txts, ['cat', 'dog'], num_workers=2, processes=processes)
+                self.assertEqual(df['txt_index'].tolist(), [i for i in range(9) for _ in range(2)])
+                self.assertEqual(df['class_name'].tolist()[:2], ['dog', 'cat'])
+                np.testing.assert_allclose(df[['xmin', 'ymin', 'xmax', 'ymax']].iloc[:2],
+                                           [[0.4, 0.3, 0.6, 0.7], [0.7, 0, 1, 0.3]], rtol=1e-6)
+            ds = Dataset.from_yolo(tmp, 'images', 'labels', pathlib.Path('classes.txt'))
+            self.assertEqual(len(ds), 9)
+            self.assertEqual(len(ds.df), 18)
+            self.assertEqual(sorted(ds.df['file_path'].unique()), sorted(f'images/{i}.jpg' for i in range(1, 10)))
+            # Images in the root folder, and a single class name
+            (root/'flat'/'labels').mkdir(parents=True)
+            PIL.Image.new('RGB', (10, 10)).save(root/'flat'/'1.jpg')
+            (root/'flat'/'labels'/'1.txt').write_text('0 0.5 0.5 0.2 0.4\n')
+            ds = Dataset.from_yolo(str(root/'flat'), '', 'labels', 'cat')
+            self.assertEqual(ds.df['file_path'].tolist(), ['1.jpg'])
+            self.assertEqual(ds.classes, ['cat'])
+
+    def test_freeze(self):
+        df = pd.DataFrame({'file_path':['b.jpg', 'a.jpg', 'b.jpg', 'c.jpg', 'a.jpg'],
+                           'class_name':['dog', 'cat', 'cat', 'dog', 'dog'],
+                           'xmin':[0.1, 0.2, 0.3, 0.4, 0.5], 'ymin':0.0,
+                           'xmax':1.0, 'ymax':[0.6, 0.7, 0.8, 0.9, 1.0]})
+        table = Dataset(df, core.EmptyReader()).freeze()
+        self.assertEqual(table.paths.tolist(), ['b.jpg', 'a.jpg', 'c.jpg'])
+        self.assertEqual(table.offsets.tolist(), [0, 2, 4, 5])
+        self.assertEqual(table.classes, ['cat', 'dog'])
+        self.assertEqual(table.boxes.dtype, np.float32)
+        np.testing.assert_allclose(table.get_boxes(0), [[0.1, 0, 1, 0.6, 1], [0.3, 0, 1, 0.8, 0]])
+        np.testing.assert_allclose(table.get_boxes(2), [[0.4, 0, 1, 0.9, 1]])
+        self.assertEqual(table.get_rows([2, 0]).tolist(), [3, 0, 2])
+        self.assertEqual(table.get_rows([]).tolist(), [])
+
+    def test_images(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            rows = []
+            for i in range(10):
+                PIL.Image.new('RGB', (8, 4)).save(pathlib.Path(tmp)/f'{i}.jpg')
+                rows += [(f'{i}.jpg', 'cat' if j else 'dog', 0, 0, 0.5, j/10) for j in range(i % 3 + 1)]
+            df = pd.DataFrame(rows, columns=['file_path', 'class_name', 'xmin', 'ymin', 'xmax', 'ymax'])
+            ds = Dataset(df, core.create_reader(tmp))
+            self.assertEqual(len(ds), 10)
+            img, boxes = ds[2]
+            self.assertEqual(img.shape, (4, 8, 3))
+            np.testing.assert_allclose(boxes, [[0, 0, 0.5, 0, 1], [0, 0, 0.5, 0.1, 0], [0, 0, 0.5, 0.2, 0]])
+            with self.assertRaises(IndexError):
+                ds[10]
+            splits = ds.split([0.3, 0.5])
+            self.assertEqual([len(s) for s in splits], [3, 5, 2])
+            self.assertEqual(sum(len(s.df) for s in splits), len(df))
+            paths = [set(s.df['file_path']) for s in splits]
+            self.assertEqual(len(set().union(*paths)), 10)
+            sample = ds.sample(4, seed=1)
+            self.assertEqual(len(sample), 4)
+            counts = sample.df.groupby('file_path').size()
+            self.assertEqual(counts.tolist(), df.groupby('file_path').size()[counts.index].tolist())
+
+
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
+
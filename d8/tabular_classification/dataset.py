@@ -3,33 +3,225 @@
 # Don't edit it directly
 
 #@save_all
+import contextvars
+import copy
+import dataclasses
 import fnmatch
+import io
+import logging
+import os
 import pathlib
-from typing import Callable, Sequence, Union
+import threading
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
 from d8 import core
 
-__all__ = ['read_csv', 'Dataset']
+__all__ = ['read_csv', 'compact_dtypes', 'Dataset', 'LazyDataset']
 
-def read_csv(data_path: Union[str, Sequence[str]], columns=None):
+def compact_dtypes(df: pd.DataFrame, max_category_ratio: float = 0.5) -> pd.DataFrame:
+    """Convert columns into compact dtypes to reduce memory.
+
+    Integer columns are downcast to the smallest dtypes holding their values, float
+    columns are downcast to float32 only if no value loses precision, and string columns with at most ``max_category_ratio * len(df)`` unique
+    values are converted into categoricals.
+
+    :param df: The dataframe.
+    :param max_category_ratio: The maximal ratio of unique values in a categorical column.
+    :return: The converted dataframe.
+    """
+    columns = {}
+    for name, col in df.items():
+        if pd.api.types.is_bool_dtype(col.dtype):
+            pass
+        elif pd.api.types.is_integer_dtype(col.dtype):
+            col = pd.to_numeric(col, downcast='integer')
+        elif pd.api.types.is_float_dtype(col.dtype):
+            small = col.astype(np.float32)
+            if small.astype(col.dtype).equals(col):
+                col = small
+        elif ((col.dtype == object or pd.api.types.is_string_dtype(col.dtype)) and
+              pd.api.types.infer_dtype(col, skipna=True) == 'string' and
+              col.nunique() <= max_category_ratio * len(col)):
+            col = col.astype('category')
+        columns[name] = col
+    return pd.DataFrame(columns, index=df.index)
+
+def _concat(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate dataframes, categorical columns are kept by unioning their categories."""
+    if len(dfs) == 1:
+        return dfs[0]
+    for name in dfs[0].columns:
+        cols = [df[name] for df in dfs if name in df.columns]
+        if len(cols) == len(dfs) and all(isinstance(c.dtype, pd.CategoricalDtype) for c in cols):
+            categories = pd.api.types.union_categoricals([c.cat.remove_unused_categories() for c in cols]).categories
+            for df in dfs:
+                df[name] = df[name].cat.set_categories(categories)
+    return pd.concat(dfs, axis=0, ignore_index=True)
+
+def _temporal_columns(df: pd.DataFrame) -> List[Any]:
+    """Return the columns with dates, times or timestamps."""
+    return [name for name, col in df.items()
+            if pd.api.types.is_datetime64_any_dtype(col.dtype) or
+            pd.api.types.is_timedelta64_dtype(col.dtype) or
+            (col.dtype == object and
+             pd.api.types.infer_dtype(col, skipna=True) in ('date', 'time', 'datetime'))]
+
+# The bytes used to infer column types, which is the default block size of pyarrow
+_CSV_HEAD_SIZE = 2**20
+
+def _csv_head(reader: core.Reader, filename: str) -> bytes:
+    """Return the complete lines in the first ``_CSV_HEAD_SIZE`` bytes of a file."""
+    with reader.open(filename) as f:
+        head = f.read(_CSV_HEAD_SIZE)
+    return head[:head.rfind(b'\n') + 1] if len(head) == _CSV_HEAD_SIZE else head
+
+def _read_csv_file(reader: core.Reader, filename: str, compact: bool, engine: Optional[str],
+                   chunksize: Optional[int], **kwargs) -> pd.DataFrame:
+    if chunksize:
+        with reader.open(filename) as f:
+            chunks = [compact_dtypes(c) if compact else c
+                      for c in pd.read_csv(f, chunksize=chunksize, **kwargs)]
+        df = _concat(chunks)
+    else:
+        try:
+            # pyarrow infers dates and times, which the C parser keeps as strings.
+            # Find them from the first lines and read them as strings, so all parsers
+            # return the same dtypes with a single pass over the file
+            dtype = {}
+            if (engine or 'pyarrow') == 'pyarrow':
+                head = pd.read_csv(io.BytesIO(_csv_head(reader, filename)), engine='pyarrow', **kwargs)
+                dtype = {c:str for c in _temporal_columns(head)}
+            with reader.open(filename) as f:
+                df = pd.read_csv(f, engine=engine or 'pyarrow', dtype=dtype or None, **kwargs)
+            temporal = _temporal_columns(df)
+            if temporal and (engine or 'pyarrow') == 'pyarrow':
+                # Only found after the first lines, read the file again
+                with reader.open(filename) as f:
+                    df = pd.read_csv(f, engine='pyarrow', dtype={**dtype, **{c:str for c in temporal}}, **kwargs)
+        except (ImportError, ValueError) as e:
+            if engine: raise
+            logging.info(f'Failed to parse {filename} by pyarrow, fallback to the C parser. {e}')
+            with reader.open(filename) as f:
+                df = pd.read_csv(f, **kwargs)
+    return compact_dtypes(df) if compact else df
+
+def _csv_filenames(data_path: Union[str, Sequence[str]]) -> List[str]:
+    """Return the names of the CSV files in data_path."""
+    return [p.replace('#','/').replace('?select=','/').replace('+',' ').split('/')[-1]
+            for p in core.listify(data_path)]
+
+def read_csv(data_path: Union[str, Sequence[str]], columns=None, compact: bool = True,
+             engine: Optional[str] = None, chunksize: Optional[int] = None
+             ) -> Tuple[pd.DataFrame, core.Reader]:
+    """Read CSV files into a dataframe.
+
+    :param data_path: The CSV files, which are concatenated.
+    :param columns: The column names.
+    :param compact: If True, then convert columns into compact dtypes by :func:`compact_dtypes`.
+    :param engine: The pandas CSV parser, the default is ``pyarrow``, which parses
+        by multiple threads, with a fallback to the C parser if it fails.
+    :param chunksize: If specified, then parse this number of rows each time and
+        compact each chunk, so the file is never in memory with the original dtypes.
+        The compacted chunks are concatenated in memory, so the compacted dataframe
+        still needs to fit in memory, use :class:`LazyDataset` for larger files.
+    :return: The dataframe and the reader.
+    """
     header = 0 if columns else 'infer'
     reader = core.create_reader(data_path)
-    filenames = [p.replace('#','/').replace('?select=','/').replace('+',' ').split('/')[-1]
-                 for p in core.listify(data_path)]
-    dfs = [pd.read_csv(reader.open(f), header=header, names=columns) for f in filenames]
-    df = dfs[0] if len(dfs) == 1 else pd.concat(dfs, axis=0, ignore_index=True)
-    return df, reader
+    filenames = _csv_filenames(data_path)
+    dfs = [_read_csv_file(reader, f, compact, engine, chunksize, header=header, names=columns)
+           for f in filenames]
+    df = _concat(dfs)
+    return (compact_dtypes(df) if compact and len(dfs) > 1 else df), reader
 
 
+# The columns to load by Dataset.get, None means all columns
+_load_columns: contextvars.ContextVar[Optional[Sequence[str]]] = contextvars.ContextVar(
+    'load_columns', default=None)
+
 class Dataset(core.BaseDataset):
     TYPE = 'tabular_classification'
+    # 2: compact dtypes and the Arrow IPC cache, 3: dates and times read as strings,
+    # 4: floats downcast only without precision loss
+    CACHE_VERSION = 4
 
     @classmethod
-    def from_csv(cls, data_path: Union[str, Sequence[str]], label_name, columns=None, df_func=None) -> 'Dataset':
-        df, reader = read_csv(data_path, columns)
+    def get(cls, name: str, cache: bool = True, columns: Optional[Sequence[str]] = None) -> 'Dataset':
+        """Return the dataset by its name.
+
+        The dataframe is cached in the Arrow IPC format, which is memory mapped when
+        loading, so processes on the same host share the pages of numeric columns.
+
+        :param name: The dataset name.
+        :param cache: If True (default), then reuse the dataset constructed before.
+        :param columns: If specified, then only load these columns and the label column.
+        """
+        token = _load_columns.set(columns)
+        try:
+            ds = super().get(name, cache)
+        finally:
+            _load_columns.reset(token)
+        if columns is not None:
+            ds.df = ds.df[[c for c in ds.df.columns if c in columns or c == ds.label_name]]
+        return ds
+
+    def _save_cache(self, cache_path: pathlib.Path, key: str) -> None:
+        # The dataframe is saved into a separate Arrow file with the key in its
+        # metadata, and the rest of the dataset is pickled as usual.
+        df = self.df
+        try:
+            import pyarrow as pa
+            table = pa.Table.from_pandas(df)
+            table = table.replace_schema_metadata({**table.schema.metadata, b'd8_key':key.encode()})
+            arrow_path = cache_path.with_suffix('.arrow')
+            tmp_path = arrow_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            with pa.OSFile(str(tmp_path), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, arrow_path)
+        except Exception as e:
+            logging.info(f'Failed to save the dataframe in the Arrow format, pickle it instead. {e}')
+            super()._save_cache(cache_path, key)
+            return
+        self.df = df.iloc[:0]
+        try:
+            super()._save_cache(cache_path, key)
+        finally:
+            self.df = df
+
+    @classmethod
+    def _load_cache(cls, cache_path: pathlib.Path, key: str) -> Optional['Dataset']:
+        ds = super()._load_cache(cache_path, key)
+        arrow_path = cache_path.with_suffix('.arrow')
+        if ds is None or len(ds.df) or not arrow_path.is_file():
+            return ds  # None, or a dataframe pickled as a fallback
+        try:
+            import pyarrow as pa
+            with pa.memory_map(str(arrow_path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            if table.schema.metadata.get(b'd8_key') != key.encode():
+                return None
+            columns = _load_columns.get()
+            if columns is not None:
+                names = [c for c in ds.df.columns if c in columns or c == ds.label_name]
+                index = [c for c in table.column_names if c.startswith('__index_level_')]
+                table = table.select(names + index)
+            ds.df = table.to_pandas(split_blocks=True)
+        except Exception as e:
+            logging.warning(f'Failed to load {arrow_path}: {e}')
+            return None
+        return ds
+
+    @classmethod
+    def from_csv(cls, data_path: Union[str, Sequence[str]], label_name, columns=None, df_func=None,
+                 **kwargs) -> 'Dataset':
+        """Construct a dataset from CSV files.
+
+        :param kwargs: Other arguments passed to :func:`read_csv`.
+        """
+        df, reader = read_csv(data_path, columns, **kwargs)
         if df_func: df = df_func(df)
         return cls(df, reader, label_name)
 
@@ -41,7 +233,261 @@ class Dataset(core.BaseDataset):
                               '#category_features':len(self.df.columns) - 1 - numeric_cols,
                               'size(MB)':self.df.memory_usage().sum()/2**20,}])
 
+@dataclasses.dataclass
+class _Source:
+    """A list of files scanned together, with the splits selecting their rows."""
+    paths: List[str]
+    column_names: Optional[List[str]] = None
+    # A list of (shuffle, seed, low, high) to select rows by their positions
+    parts: List[Tuple[bool, int, float, float]] = dataclasses.field(default_factory=list)
+    num_rows: Optional[int] = None
+
+    def dataset(self):
+        try:
+            import pyarrow.csv
+            import pyarrow.dataset
+        except ImportError as e:
+            raise ImportError('LazyDataset requires pyarrow, install it by '
+                              '`pip install "d8[arrow]"`') from e
+        suffix = pathlib.Path(self.paths[0]).suffix
+        if suffix == '.parquet':
+            return pyarrow.dataset.dataset(self.paths, format='parquet')
+        if suffix in ('.arrow', '.feather'):
+            return pyarrow.dataset.dataset(self.paths, format='ipc')
+        # Same as pandas, the header row is replaced if column names are given
+        read_options = pyarrow.csv.ReadOptions(
+            column_names=self.column_names, skip_rows=1 if self.column_names else 0)
+        return pyarrow.dataset.dataset(
+            self.paths, format=pyarrow.dataset.CsvFileFormat(read_options=read_options))
+
+    def count_rows(self) -> int:
+        if self.num_rows is None:
+            self.num_rows = self.dataset().count_rows()
+        return self.num_rows
+
+    def mask(self, positions: np.ndarray) -> Optional[np.ndarray]:
+        """Return if rows at positions are selected, or None if all are selected."""
+        mask = None
+        for shuffle, seed, low, high in self.parts:
+            if shuffle:
+                u = _uniform(positions, seed)
+                m = (u >= low) & (u < high)
+            else:
+                n = self.count_rows()
+                m = (positions >= int(low * n)) & (positions < int(high * n))
+            mask = m if mask is None else mask & m
+        return mask
+
+def _uniform(positions: np.ndarray, seed: int) -> np.ndarray:
+    """Map row positions to deterministic pseudo random numbers in [0, 1)."""
+    x = positions.astype(np.uint64) + np.uint64(seed + 1) * np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0**53
+
+class LazyDataset(Dataset):
+    """A tabular classification dataset scanning files lazily.
+
+    It requires ``pyarrow``, which is installed by ``pip install "d8[arrow]"``.
+
+    :param paths: The local CSV, Parquet or Arrow files.
+    :param label_name: The label column name, or its index.
+    :param column_names: The column names of CSV files, which replace the header row.
+    :param reader: The reader of the folder containing the files.
+    """
+    def __init__(self, paths: Sequence[Union[str, pathlib.Path]], label_name: Union[str, int],
+                 column_names: Optional[Sequence[str]] = None,
+                 reader: Optional[core.Reader] = None) -> None:
+        self.sources = [_Source([str(p) for p in paths],
+                                list(column_names) if column_names else None)]
+        self.reader = reader or core.FolderReader(pathlib.Path(paths[0]).parent)
+        names = self.sources[0].dataset().schema.names
+        if isinstance(label_name, int):
+            label_name = names[label_name]
+        if label_name not in names:
+            raise ValueError(f'Label_name {label_name} is not in {names}')
+        self.label_name = label_name
+        self.columns: Optional[List[str]] = None
+        self.name = ''
+
+    @classmethod
+    def from_csv(cls, data_path: Union[str, Sequence[str]], label_name, columns=None, df_func=None,
+                 **kwargs) -> 'LazyDataset':
+        """Construct a dataset from CSV files, which are extracted if compressed.
+
+        It has the same arguments as :meth:`Dataset.from_csv`, except that ``df_func``
+        is not supported and other arguments for :func:`read_csv` are ignored.
+        """
+        if df_func:
+            raise ValueError('df_func needs the whole dataframe, use Dataset.from_csv instead')
+        reader = core.create_reader(data_path, extract=True)
+        if not isinstance(reader, core.FolderReader):
+            raise ValueError(f'{type(reader).__name__} cannot be scanned lazily')
+        paths = [reader._root/f for f in _csv_filenames(data_path)]
+        return cls(paths, label_name, columns, reader)
+
+    @classmethod
+    def get(cls, name: str, cache: bool = True, columns: Optional[Sequence[str]] = None) -> 'LazyDataset':
+        """Return the dataset registered by :meth:`Dataset.from_csv` lazily.
+
+        :param name: The dataset name.
+        :param cache: Not used, constructing a lazy dataset only reads the schema.
+        :param columns: If specified, then only scan these columns and the label column.
+        """
+        (fn, fn_args, fn_kwargs) = cls._DATASETS[(cls.TYPE, name)]
+        if getattr(fn, '__func__', None) is not Dataset.from_csv.__func__:  # type: ignore
+            raise ValueError(f'{name} is not constructed by Dataset.from_csv')
+        with core.NameContext(name), core.pinned(name):
+            ds = cls.from_csv(*fn_args, **fn_kwargs)
+            ds.name = name
+            ds._hold = core.hold(name)
+            core.touch(name)
+        return ds.select(columns) if columns is not None else ds
+
+    @property
+    def df(self):
+        raise TypeError(f'{type(self).__name__} is not loaded, use to_pandas() instead')
+
+    def select(self, columns: Sequence[str]) -> 'LazyDataset':
+        """Return a dataset only scanning the columns and the label column."""
+        names = self.sources[0].dataset().schema.names
+        ds = copy.copy(self)
+        ds.columns = [c for c in names if c in columns or c == self.label_name]
+        return ds
+
+    def _scan(self, columns: Optional[Sequence[str]] = None, batch_size: int = 2**16) -> Iterator[Any]:
+        import pyarrow as pa
+        columns = self.columns if columns is None else columns
+        for source in self.sources:
+            start = 0
+            for batch in source.dataset().to_batches(columns=columns, batch_size=batch_size):
+                mask = source.mask(np.arange(start, start+batch.num_rows))
+                start += batch.num_rows
+                if mask is not None:
+                    batch = batch.filter(pa.array(mask))
+                if batch.num_rows:
+                    yield batch
+
+    def iter_batches(self, columns: Optional[Sequence[str]] = None,
+                     batch_size: int = 2**16) -> Iterator[pd.DataFrame]:
+        """Iterate the examples by dataframes with at most batch_size rows."""
+        for batch in self._scan(columns, batch_size):
+            yield batch.to_pandas()
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Load all examples into a dataframe."""
+        import pyarrow as pa
+        schema = self.sources[0].dataset().schema
+        if self.columns is not None:
+            schema = pa.schema([schema.field(c) for c in self.columns])
+        return compact_dtypes(pa.Table.from_batches(list(self._scan()), schema).to_pandas())
+
+    def to_dataset(self) -> Dataset:
+        """Load all examples into a :class:`Dataset`."""
+        ds = Dataset(self.to_pandas(), self.reader, self.label_name)
+        ds.name = self.name
+        return ds
+
+    def __len__(self) -> int:
+        n = 0
+        for source in self.sources:
+            if not source.parts:
+                n += source.count_rows()
+                continue
+            for start in range(0, source.count_rows(), 2**22):
+                positions = np.arange(start, min(start+2**22, source.count_rows()))
+                n += int(source.mask(positions).sum())
+        return n
+
+    @property
+    def labels(self):
+        """Return the labels, only the label column is scanned."""
+        import pyarrow as pa
+        batches = list(self._scan([self.label_name]))
+        schema = pa.schema([self.sources[0].dataset().schema.field(self.label_name)])
+        return pa.Table.from_batches(batches, schema).column(0).to_pandas()
+
+    @property
+    def classes(self):
+        import pyarrow.compute as pc
+        classes: set = set()
+        for batch in self._scan([self.label_name]):
+            classes.update(pc.unique(batch.column(0)).drop_null().to_pylist())
+        return sorted(classes)
+
+    def split(self, frac: Union[float, Sequence[float]], shuffle: bool = True, seed: int = 0) -> List['LazyDataset']:
+        """Split a dataset without reading the files.
+
+        Rows are selected by their positions in the files. With ``shuffle=True``, a
+        row is assigned to a split by a hash of its position, so the split sizes
+        follow the fractions approximately.
+        """
+        fracs = core.listify(frac)
+        if sum(fracs) >= 1:
+            raise ValueError(f'the sum of frac {sum(fracs)} should be less than 1')
+        fracs = fracs + [1.0 - sum(fracs)]
+        bounds = np.cumsum([0] + fracs)
+        rets = []
+        for i, f in enumerate(fracs):
+            if f <= 0:
+                raise ValueError(f'frac {f} is not in (0, 1)')
+            ds = copy.copy(self)
+            ds.sources = [_split_source(s, shuffle, seed, bounds[i], bounds[i+1]) for s in self.sources]
+            if ds.name:
+                ds.name += f'.{i}'
+            rets.append(ds)
+        return rets
+
+    def merge(self, *args: core.BaseDataset) -> 'LazyDataset':
+        """Merge with other lazy datasets, whose files are scanned after this one's."""
+        ds = copy.copy(self)
+        ds.sources = list(self.sources)
+        for other in args:
+            if not isinstance(other, LazyDataset) or other.label_name != self.label_name:
+                raise ValueError('Only lazy datasets with the same label_name can be merged')
+            ds.sources += other.sources
+        readers = [self.reader]
+        for other in args:
+            if not any(type(r) == type(other.reader) and r == other.reader for r in readers):
+                readers.append(other.reader)
+        if len(readers) > 1:
+            ds.reader = core.CompositeReader(readers)
+        return ds
+
+    def summary(self):
+        """Returns a summary about this dataset.
+
+        It is not saved in ``core.DATAROOT``, which keeps the summary of the loaded
+        :class:`Dataset` with the same name.
+        """
+        return self._summary()
+
+    def _summary(self):
+        import pyarrow as pa
+        schema = self.sources[0].dataset().schema
+        names = [n for n in (self.columns or schema.names) if n != self.label_name]
+        numeric_cols = sum(1 for n in names if pa.types.is_integer(schema.field(n).type)
+                           or pa.types.is_floating(schema.field(n).type))
+        size = sum(os.path.getsize(p) for s in self.sources for p in dict.fromkeys(s.paths))
+        return pd.DataFrame([{'#examples':len(self),
+                              '#classes':len(self.classes),
+                              '#numeric_features':numeric_cols,
+                              '#category_features':len(names) - numeric_cols,
+                              'size(MB)':size/2**20,}])
+
+def _split_source(source: _Source, shuffle: bool, seed: int, low: float, high: float) -> _Source:
+    """Return a copy of source only selecting rows in [low, high) of its current rows."""
+    parts = list(source.parts)
+    if parts and parts[-1][:2] == (shuffle, seed):
+        # narrow the previous split, which selects rows in the same order
+        _, _, l, h = parts.pop()
+        low, high = l + (h - l) * low, l + (h - l) * high
+    parts.append((shuffle, seed, float(low), float(high)))
+    return dataclasses.replace(source, parts=parts)
+
 import unittest
+import unittest.mock
 
 class TestDataset(unittest.TestCase):
     def test_from_csv(self):
@@ -53,6 +499,116 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(len(ds.df), 889)
         self.assertEqual(ds.classes, ['C', 'Q', 'S'])
 
+    def test_arrow_cache(self):
+        name = 'test_arrow_cache'
+        df = compact_dtypes(pd.DataFrame({'a':np.arange(100), 'b':['x', 'y']*50, 'c':np.ones(100)}))
+        calls = []
+        def construct():
+            calls.append(1)
+            return Dataset(df[df['a'] % 3 > 0], core.EmptyReader(), 'b')
+        Dataset.add(name, construct)
+        (core.DATAROOT/name).mkdir(parents=True, exist_ok=True)
+        expected = Dataset.get(name).df
+        self.assertTrue((core.DATAROOT/name/f'{Dataset.TYPE}_dataset.arrow').is_file())
+        ds = Dataset.get(name)
+        self.assertEqual(len(calls), 1)
+        pd.testing.assert_frame_equal(ds.df, expected)
+        ds = Dataset.get(name, columns=['c'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(list(ds.df.columns), ['b', 'c'])
+        pd.testing.assert_frame_equal(ds.df, expected[['b', 'c']])
+        del Dataset._DATASETS[(Dataset.TYPE, name)]
+        import shutil
+        shutil.rmtree(core.DATAROOT/name)
+
+    def test_lazy_dataset(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            df = pd.DataFrame({'a':np.arange(1000), 'b':np.arange(1000) % 3, 'c':['x', 'y']*500})
+            df.to_csv(pathlib.Path(tmp)/'1.csv', index=False)
+            df.iloc[:100].to_csv(pathlib.Path(tmp)/'2.csv', index=False, header=False)
+            with unittest.mock.patch.dict('sys.modules', {'pyarrow.dataset':None}):
+                with self.assertRaisesRegex(ImportError, 'd8\\[arrow\\]'):
+                    LazyDataset([pathlib.Path(tmp)/'1.csv'], -1)
+            ds = LazyDataset([pathlib.Path(tmp)/'1.csv'], -1)
+            with self.assertRaises(TypeError):
+                ds.df
+            self.assertEqual(len(ds), 1000)
+            self.assertEqual(ds.classes, ['x', 'y'])
+            self.assertEqual(ds.labels.tolist(), df['c'].tolist())
+            pd.testing.assert_frame_equal(ds.to_pandas(), compact_dtypes(df))
+            self.assertEqual(sum(len(b) for b in ds.iter_batches(batch_size=300)), 1000)
+            self.assertEqual(list(ds.select(['a']).to_pandas().columns), ['a', 'c'])
+            # splits are disjoint and cover all rows
+            for shuffle in (False, True):
+                splits = ds.split([0.2, 0.3], shuffle=shuffle)
+                rows = [s.to_pandas()['a'].tolist() for s in splits]
+                self.assertEqual([len(s) for s in splits], [len(r) for r in rows])
+                self.assertEqual(sorted(sum(rows, [])), list(range(1000)))
+                if not shuffle: self.assertEqual(rows[0], list(range(200)))
+                self.assertLess(abs(len(rows[1]) - 300), 60)
+                a, b = splits[2].split(0.5, shuffle=shuffle)
+                self.assertEqual(sorted(a.to_pandas()['a'].tolist() + b.to_pandas()['a'].tolist()), sorted(rows[2]))
+            merged = ds.merge(LazyDataset([pathlib.Path(tmp)/'2.csv'], 'c', ['a', 'b', 'c']))
+            self.assertEqual(len(merged), 1099)
+            self.assertEqual(merged.summary()['#examples'][0], 1099)
+            self.assertEqual(merged.summary()['#numeric_features'][0], 2)
+            self.assertEqual(len(merged.to_dataset()), 1099)
+            with unittest.mock.patch.object(core, 'DATAROOT', pathlib.Path(tmp)):
+                (pathlib.Path(tmp)/'lazy').mkdir()
+                ds.name = 'lazy'
+                ds.summary()
+                self.assertEqual(list((pathlib.Path(tmp)/'lazy').iterdir()), [])
+
+    def test_compact_dtypes(self):
+        df = pd.DataFrame({'a':np.arange(100), 'b':np.arange(100)/2, 'c':['x', 'y']*50,
+                           'd':[str(i) for i in range(100)], 'e':[True]*100})
+        compact = compact_dtypes(df)
+        self.assertEqual([str(t) for t in compact.dtypes], ['int8', 'float32', 'category', str(df['d'].dtype), 'bool'])
+        self.assertTrue(compact.astype(df.dtypes.to_dict()).equals(df))
+        cols = ['a', 'b', 'c']
+        self.assertLess(compact[cols].memory_usage(deep=True).sum(), df[cols].memory_usage(deep=True).sum() / 3)
+        # floats are kept if float32 loses precision
+        df = pd.DataFrame({'x':[12345.67, np.nan], 'y':[-122.4194155, 0.5], 'z':[0.5, np.nan]})
+        self.assertEqual([str(t) for t in compact_dtypes(df).dtypes], ['float64', 'float64', 'float32'])
+        self.assertTrue(compact_dtypes(df).astype(np.float64).equals(df))
+
+    def test_read_csv_file(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            df = pd.DataFrame({'a':np.arange(1000), 'b':['x', 'y', 'z', 'w']*250})
+            df.to_csv(pathlib.Path(tmp)/'data.csv', index=False)
+            reader = core.create_reader(tmp)
+            for kwargs in ({}, {'engine':'c'}, {'chunksize':300}):
+                read = _read_csv_file(reader, 'data.csv', True, **{'engine':None, 'chunksize':None, **kwargs})
+                self.assertEqual(str(read['a'].dtype), 'int16')
+                self.assertEqual(str(read['b'].dtype), 'category')
+                self.assertEqual(read['b'].tolist(), df['b'].tolist())
+                self.assertEqual(read['a'].tolist(), df['a'].tolist())
+
+    def test_read_csv_dtypes(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            n = 100
+            df = pd.DataFrame({'a':np.arange(n), 'b':np.arange(n)/2, 'c':['x', 'y']*(n//2),
+                               'd':[f'2020-01-{i%28+1:02d}' for i in range(n)],
+                               'e':[f'2020-01-01 10:{i%60:02d}:00' for i in range(n)],
+                               'f':[f'10:{i%60:02d}:00' for i in range(n)], 'g':[True, False]*(n//2)})
+            df.to_csv(pathlib.Path(tmp)/'data.csv', index=False)
+            reader = core.create_reader(tmp)
+            for compact in (False, True):
+                reads = [_read_csv_file(reader, 'data.csv', compact, engine, chunksize)
+                         for engine, chunksize in ((None, None), ('c', None), (None, 30))]
+                for read in reads[1:]:
+                    self.assertEqual(read.dtypes.to_dict(), reads[0].dtypes.to_dict())
+                self.assertEqual(reads[0]['d'].tolist(), df['d'].tolist())
+                self.assertEqual(reads[0]['f'].tolist(), df['f'].tolist())
+            # the temporal columns are found without parsing the file twice
+            with unittest.mock.patch.object(pd, 'read_csv', wraps=pd.read_csv) as read_csv:
+                _read_csv_file(reader, 'data.csv', False, None, None)
+                self.assertEqual(read_csv.call_count, 2)
+                self.assertIsInstance(read_csv.call_args_list[0].args[0], io.BytesIO)
+
 
 
 
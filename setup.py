@@ -31,6 +31,10 @@ setup(
     packages=find_packages(),
     zip_safe=True,
     install_requires=requirements,
+    extras_require={
+        # faster CSV parsing, the Arrow dataset cache and LazyDataset
+        'arrow': ['pyarrow'],
+    },
     include_package_data=True,
     package_data={'d8':[]},
     entry_points={